@@ -39,6 +39,7 @@ _sima() {
           create-db \
           generate-config \
           purge-history \
+          migrate-cache \
           bl-view \
           bl-add-artist \
           bl-add-album \
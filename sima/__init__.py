@@ -8,6 +8,8 @@ LFM = {'apikey': 'NG4xcDlxcXJwMjk4MTZycTgwM3E3b3I5MTEzb240cG8',
        'version': '2.0',}
 
 WAIT_BETWEEN_REQUESTS = timedelta(days=0, seconds=2)
+#: Requests allowed in a row before waiting WAIT_BETWEEN_REQUESTS between them
+BURST_REQUESTS = 5
 SOCKET_TIMEOUT = 6
 
 # vim: ai ts=4 sw=4 sts=4 expandtab
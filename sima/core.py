@@ -90,12 +90,12 @@ class Sima(Daemon):
             self.log.debug('Queueing disabled!')
             return False
         queue_trigger = self.config.getint('sima', 'queue_length')
-        if self.player.playmode.get('random'):
-            queue = self.player.playlist
+        snapshot = self.player.snapshot
+        queue = snapshot.deny_list
+        if snapshot.playmode.get('random'):
             self.log.debug('Currently %s track(s) in the playlist. (target %s)',
                            len(queue), queue_trigger)
         else:
-            queue = self.player.queue
             self.log.debug('Currently %s track(s) ahead. (target %s)', len(queue), queue_trigger)
         if len(queue) < queue_trigger:
             return True
@@ -110,8 +110,7 @@ class Sima(Daemon):
                 to_add.extend(pl_candidates)
             if to_add:
                 break
-        for track in to_add:
-            self.player.add(track)
+        self.player.add(to_add)
 
     def reconnect_player(self):
         """Trying to reconnect cycling through longer timeout
@@ -140,6 +139,7 @@ class Sima(Daemon):
         self.player.clean()
         self.foreach_plugin('shutdown')
         self.player.disconnect()
+        self.player.shutdown()
         raise SigHup('SIGHUP caught!')
 
     def shutdown(self):
@@ -151,6 +151,7 @@ class Sima(Daemon):
             self.player.clean()
             self.foreach_plugin('shutdown')
             self.player.disconnect()
+            self.player.shutdown()
         except PlayerError as err:
             self.log.error('Player error during shutdown: %s', err)
         self.log.info('The way is shut, it was made by those who are dead. '
@@ -25,7 +25,7 @@ import logging
 import sys
 
 from importlib import __import__ as sima_import
-from os.path import isfile
+from os.path import isdir, isfile, join
 from os import rename
 ##
 
@@ -136,6 +136,23 @@ def start(sopt, restart=False):
                 sys.exit(1)
             SimaDB(db_path=db_file).purge_history(duration=0)
             sys.exit(0)
+        if cmd == "migrate-cache":
+            from .lib.cache import CODECS, SqliteCache, get_codec, migrate_filecache
+            http_dir = join(config.get('sima', 'var_dir'), 'http')
+            if not isdir(join(http_dir, 'LastFM')):
+                logger.warning('No file cache found: %s', join(http_dir, 'LastFM'))
+                sys.exit(1)
+            codec = config.get('lastfm', 'cache_codec')
+            if codec not in CODECS:
+                logger.warning('Cache codec "%s" not available, using zlib', codec)
+                codec = 'zlib'
+            cache = SqliteCache(join(http_dir, 'LastFM.db'), codec=get_codec(codec))
+            migrated, skipped = migrate_filecache(join(http_dir, 'LastFM'), cache)
+            logger.info('Migrated %d responses to %s (%d skipped)',
+                        migrated, cache.db_path, skipped)
+            logger.info('Set cache_backend=sqlite in [lastfm] section, '
+                        'the old cache directory can then be removed')
+            sys.exit(0)
         if cmd == 'random':
             config['sima']['internal'] = 'Crop, Random'
             if sopt.options.get('nbtracks'):
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-# Copyright (c) 2014, 2021 kaliko <kaliko@azylum.org>
+# Copyright (c) 2014, 2021, 2024 kaliko <kaliko@azylum.org>
 # Copyright (c) 2012, 2013 Eric Larson <eric@ionrock.org>
 #
 #   This program is free software: you can redistribute it and/or modify
@@ -20,16 +20,275 @@
 """
 The cache object API for implementing caches. The default is just a
 dictionary, which in turns means it is not threadsafe for writing.
+
+:py:class:`SqliteCache` stores responses in a single SQLite file, use
+:py:func:`migrate_filecache` to import an existing :py:class:`FileCache`
+directory.
+
+Caches expose a small :py:class:`CacheMeta` record per entry
+(:py:meth:`BaseCache.get_meta`), enough to check freshness without loading
+the stored response.
+
+Persistent caches are kept in check by :py:meth:`BaseCache.purge`, run
+periodically in a background thread by :py:class:`CacheMaintenance`.
+
+Persistent caches store bodies compressed with a :py:class:`Codec` (cf.
+:py:func:`get_codec`), they are decompressed on first access to the
+response content (:py:class:`CachedResponse`).
+
+:py:class:`TieredCache` puts a bounded in memory :py:class:`LRUCache` in
+front of a persistent cache.
+
+:py:class:`NegativeCache` remembers failed or empty web service answers
+for a while, independently of HTTP caching.
+
+Responses may carry a compact parsed representation of their body, a
+record, set as ``(schema, rows)`` in their ``record`` attribute. Rows are
+tuples of tuples of JSON scalars, schema names the record format and
+version, cf. :py:class:`sima.lib.http.HttpClient`.
 """
 
 import os
+import calendar
 import codecs
+import email.utils
+import json
+import sqlite3
+import tempfile
+import time
+import zlib
 
+from collections import namedtuple, OrderedDict
 from hashlib import md5
-from pickle import load, dump
-from threading import Lock
+from itertools import islice
+from logging import getLogger
+from pickle import load, dump, UnpicklingError
+from threading import Event, Lock, Thread
+
+from requests import PreparedRequest, Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from ..utils.filelock import FileLock, FileLockException
+
+#: Entries examined per :py:meth:`BaseCache.purge` call
+PURGE_BATCH = 200
+#: Seconds between two cache maintenance steps
+MAINTENANCE_INTERVAL = 60
+#: FileCache files being written
+TMP_SUFFIX = '.tmp'
+#: Default NegativeCache entries limit
+NEGATIVE_ENTRIES = 5000
+#: Exceptions raised loading corrupted pickles
+_PICKLE_ERRORS = (EOFError, UnpicklingError, AttributeError, ImportError,
+                  IndexError, TypeError, ValueError)
+#: SQL expression for the entry expiry date, cf. :py:func:`_expired`
+_EXPIRY = 'CASE WHEN date IS NULL THEN 0 ELSE coalesce(date + max_age, expires, 0) END'
+
+
+def parse_cache_control(headers):
+    """
+    Parse the cache control headers returning a dictionary with values
+    for the different directives.
+    """
+    retval = {}
+
+    # requests provides a CaseInsensitiveDict as headers
+    cc_header = 'cache-control'
+    if cc_header in headers:
+        parts = headers[cc_header].split(',')
+        parts_with_args = [
+            tuple([x.strip().lower() for x in part.split("=", 1)])
+            for part in parts if -1 != part.find("=")]
+        parts_wo_args = [(name.strip().lower(), 1)
+                         for name in parts if -1 == name.find("=")]
+        retval = dict(parts_with_args + parts_wo_args)
+    return retval
+
+
+def _timestamp(value):
+    """HTTP date header to epoch, None if missing or malformed"""
+    parsed = email.utils.parsedate_tz(value) if value else None
+    if parsed is None:
+        return None
+    return calendar.timegm(parsed)
+
+
+CacheMeta = namedtuple('CacheMeta', ['date', 'max_age', 'expires', 'etag',
+                                     'last_modified', 'vary', 'url'])
+CacheMeta.__new__.__defaults__ = (None,)  # python 3.6, no defaults argument
+CacheMeta.__doc__ = """Cached response freshness metadata
+
+Dates are epoch timestamps, max_age the response max-age directive in
+seconds, each possibly None. vary holds (header, original request value)
+pairs for headers listed in the response Vary header. url is the cache key,
+only set by caches storing it along the metadata.
+"""
+
+
+def response_meta(resp):
+    """Build :py:class:`CacheMeta` from a response"""
+    headers = resp.headers
+    max_age = str(parse_cache_control(headers).get('max-age', ''))
+    vary = ()
+    if 'vary' in headers:
+        varied_headers = headers['vary'].replace(' ', '').split(',')
+        request_headers = resp.request.headers if resp.request else {}
+        vary = tuple((header, request_headers.get(header))
+                     for header in varied_headers)
+    return CacheMeta(_timestamp(headers.get('date')),
+                     int(max_age) if max_age.isdigit() else None,
+                     _timestamp(headers.get('expires')),
+                     headers.get('etag'), headers.get('last-modified'), vary)
+
+
+class Codec:
+    """Identity codec, base class for codecs
+
+    Codecs account for bytes processed and CPU time spent, cf.
+    :py:meth:`report`.
+    """
+    name = 'none'
+
+    def __init__(self):
+        self._lock = Lock()
+        self.stats = {'raw': 0, 'stored': 0,
+                      'compress': 0.0, 'decompress': 0.0}
+
+    def _compress(self, data):
+        return data
+
+    def _decompress(self, data):
+        return data
+
+    def compress(self, data):
+        """Compress bytes"""
+        start = time.thread_time()
+        stored = self._compress(data)
+        with self._lock:
+            self.stats['compress'] += time.thread_time() - start
+            self.stats['raw'] += len(data)
+            self.stats['stored'] += len(stored)
+        return stored
+
+    def decompress(self, data):
+        """Decompress bytes"""
+        start = time.thread_time()
+        raw = self._decompress(data)
+        with self._lock:
+            self.stats['decompress'] += time.thread_time() - start
+        return raw
+
+    def report(self):
+        """Compression ratio and CPU time spent, as a string"""
+        stats = dict(self.stats)
+        ratio = stats['raw'] / stats['stored'] if stats['stored'] else 1
+        return (f'{self.name}: ratio {ratio:.1f}, '
+                f'cpu compress {stats["compress"]:.3f}s '
+                f'decompress {stats["decompress"]:.3f}s')
+
+
+class ZlibCodec(Codec):
+    """zlib codec"""
+    name = 'zlib'
+    level = 6
+
+    def _compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def _decompress(self, data):
+        return zlib.decompress(data)
+
+
+class ZstdCodec(Codec):
+    """Zstandard codec, needs zstandard module"""
+    name = 'zstd'
+    level = 3
+
+    def __init__(self):
+        super().__init__()
+        self._compressor = zstandard.ZstdCompressor(level=self.level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def _compress(self, data):
+        with self._lock:  # (de)compressor objects are not thread safe
+            return self._compressor.compress(data)
 
-from ..utils.filelock import FileLock
+    def _decompress(self, data):
+        with self._lock:
+            return self._decompressor.decompress(data)
+
+
+#: Available codecs
+CODECS = {codec.name: codec for codec in (Codec, ZlibCodec, ZstdCodec)
+          if codec is not ZstdCodec or zstandard}
+_CODECS_INSTANCES = {}
+
+
+def get_codec(name):
+    """Shared codec instance
+
+    :param str name: codec name, one of :py:data:`CODECS` keys
+    :raises KeyError: on unknown or unavailable codec
+    """
+    if name not in _CODECS_INSTANCES:
+        _CODECS_INSTANCES[name] = CODECS[name]()
+    return _CODECS_INSTANCES[name]
+
+
+class CachedResponse(Response):
+    """Response with its body kept compressed, decompressed on first access
+    to :py:attr:`content`
+
+    :param bytes body: compressed body
+    :param str codec_name: codec used to compress body
+    """
+    __attrs__ = [attr for attr in Response.__attrs__ if attr != '_content'] + \
+                ['body', 'codec_name', 'record']
+
+    def __init__(self, body=b'', codec_name='none'):
+        super().__init__()
+        self.body = body
+        self.codec_name = codec_name
+        self.record = None
+        self._content_consumed = True
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._content = False
+
+    @property
+    def content(self):
+        if self._content is False:
+            self._content = get_codec(self.codec_name).decompress(self.body)
+        return self._content
+
+    @classmethod
+    def from_response(cls, resp, codec):
+        """Compress resp body, responses already compressed with codec are
+        returned as is"""
+        if isinstance(resp, cls) and resp.codec_name == codec.name:
+            return resp
+        cached = cls(codec.compress(resp.content), codec.name)
+        for attr in Response.__attrs__ + ['record']:
+            setattr(cached, attr, getattr(resp, attr, None))
+        return cached
+
+
+def _expired(meta, now):
+    """Whether cached response is stale, entries without date are"""
+    if meta.date is None:
+        return True
+    if meta.max_age is not None:
+        return meta.date + meta.max_age <= now
+    if meta.expires is not None:
+        return meta.expires <= now
+    return True
 
 
 class BaseCache:
@@ -38,6 +297,45 @@ class BaseCache:
         """Get cache value"""
         raise NotImplementedError
 
+    def get_meta(self, key):
+        """Get cache value metadata, :py:class:`CacheMeta` or None.
+
+        Default implementation loads the full value, caches should
+        override it when a cheaper lookup is available.
+        """
+        resp = self.get(key)
+        if resp is None:
+            return None
+        return response_meta(resp)
+
+    def get_record(self, key):
+        """Get cached record, ``(schema, rows)`` or None.
+
+        Default implementation loads the full value.
+        """
+        resp = self.get(key)
+        return getattr(resp, 'record', None)
+
+    def purge(self, keep=None, max_entries=0, max_bytes=0, batch=PURGE_BATCH,
+              grace=0):
+        """Incremental maintenance step, examines about batch entries.
+
+        Evicts stale entries without etag (they cannot be revalidated) and
+        entries rejected by keep. Stale then least recently used entries
+        are evicted while the cache exceeds max_entries or max_bytes.
+
+        :param callable keep: called with the entry key, returns False to
+                              evict the entry
+        :param int max_entries: entries limit, 0 for no limit
+        :param int max_bytes: size limit, 0 for no limit
+        :param int batch: entries examined
+        :param int grace: seconds stale entries without etag are kept for,
+                          they may still be served stale
+        :return: number of evicted entries
+        """
+        # pylint: disable=unused-argument
+        return 0
+
     def set(self, key, value):
         """Set cache value"""
         raise NotImplementedError
@@ -66,11 +364,218 @@ class DictCache(BaseCache):
                 self.data.pop(key)
 
 
-class FileCache:
+def _size(value):
+    """Response body size, stored size for compressed responses"""
+    body = getattr(value, 'body', None)
+    if body is None:
+        body = value.content
+    return len(body)
+
+
+class LRUCache(BaseCache):
+    """Bounded in memory cache, least recently used entries are dropped
+    first.
+
+    :param int max_entries: entries limit, 0 for no limit
+    :param int max_bytes: bodies size limit, 0 for no limit
+    """
+
+    def __init__(self, max_entries=0, max_bytes=0):
+        self.lock = Lock()
+        self.data = OrderedDict()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+                return value[0]
+        return None
+
+    def set(self, key, value):
+        size = _size(value)
+        with self.lock:
+            if key in self.data:
+                self.size -= self.data.pop(key)[1]
+            self.data[key] = (value, size)
+            self.size += size
+            while self.data and (
+                    (self.max_entries and len(self.data) > self.max_entries) or
+                    (self.max_bytes and self.size > self.max_bytes)):
+                _, (_, evicted) = self.data.popitem(last=False)
+                self.size -= evicted
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.data:
+                self.size -= self.data.pop(key)[1]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
 
-    def __init__(self, directory, forever=False):
+
+class TieredCache(BaseCache):
+    """Memory cache (L1) in front of a persistent cache (L2)
+
+    Writes go through both tiers, entries read from L2 are promoted to L1.
+    Records read from L2 are promoted alone, without the response body.
+    Lookups are accounted in stats as ``l1_hit``, ``l1_miss``, ``l2_hit``
+    and ``l2_miss``.
+
+    :param LRUCache l1: memory cache
+    :param BaseCache l2: persistent cache, None for a memory only cache
+    :param dict stats: counters to update
+    """
+
+    def __init__(self, l1, l2=None, stats=None):
+        self.l1 = l1
+        self.l2 = l2
+        self.stats = stats if stats is not None else {}
+        for counter in ('l1_hit', 'l1_miss', 'l2_hit', 'l2_miss'):
+            self.stats.setdefault(counter, 0)
+        self._lock = Lock()
+
+    @property
+    def codec(self):
+        """L2 codec if any"""
+        return getattr(self.l2, 'codec', None)
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+
+    def get(self, key):
+        value = self.l1.get(key)
+        if value is not None or self.l2 is None:
+            return value
+        value = self.l2.get(key)
+        if value is not None:
+            self.l1.set(key, value)
+        return value
+
+    def get_meta(self, key):
+        """Lookups are accounted here, values are fetched only once known
+        to be fresh"""
+        value = self.l1.get(key)
+        if value is not None:
+            self._count('l1_hit')
+            return response_meta(value)
+        self._count('l1_miss')
+        if self.l2 is None:
+            return None
+        meta = self.l2.get_meta(key)
+        self._count('l2_hit' if meta else 'l2_miss')
+        return meta
+
+    def get_record(self, key):
+        """Records found in L2 are promoted to L1 as body less entries,
+        bodies are not loaded"""
+        value = self.l1.get(key)
+        if value is None:
+            value = self.l1.get((key, 'record'))
+        if value is not None:
+            return getattr(value, 'record', None)
+        if self.l2 is None:
+            return None
+        record = self.l2.get_record(key)
+        if record is not None:
+            entry = CachedResponse()
+            entry.record = record
+            self.l1.set((key, 'record'), entry)
+        return record
+
+    def set(self, key, value):
+        if self.l2 is not None:
+            self.l2.set(key, value)
+        self.l1.delete((key, 'record'))
+        self.l1.set(key, value)
+
+    def delete(self, key):
+        self.l1.delete(key)
+        self.l1.delete((key, 'record'))
+        if self.l2 is not None:
+            self.l2.delete(key)
+
+    def purge(self, keep=None, max_entries=0, max_bytes=0, batch=PURGE_BATCH,
+              grace=0):
+        """Maintains L2, L1 is bounded on its own"""
+        if self.l2 is None:
+            return 0
+        return self.l2.purge(keep, max_entries, max_bytes, batch, grace)
+
+
+class NegativeCache:
+    """Failed or empty web service answers, remembered ttl seconds
+
+    Keys are free form (for instance method and canonical artist), values
+    are either the exception raised, replayed as a new instance of the
+    same type, or empty results. Bounded in memory, oldest entries are
+    dropped first.
+
+    :param int ttl: seconds entries are valid for, 0 disables the cache
+    :param int max_entries: entries limit, 0 for no limit
+    """
+
+    def __init__(self, ttl=0, max_entries=NEGATIVE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.data = OrderedDict()
+
+    def get(self, key):
+        """Replay the cached answer for key: raises the cached exception or
+        returns the cached empty result, None if there is none"""
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self.data[key]
+                return None
+        if isinstance(value, Exception):
+            raise type(value)(*value.args)
+        return value
+
+    def set(self, key, value):
+        """Remember value, an exception or an empty result, for key"""
+        if not self.ttl:
+            return
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            while self.max_entries and len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+
+class FileCache(BaseCache):
+    """Responses stored one file per URL in a directory
+
+    Files modification time stands for last use: set on write, accesses are
+    recorded in memory and written to it on :py:meth:`purge` (access time
+    is not relied on, it is coarse or frozen on relatime/noatime mounts).
+    """
+
+    def __init__(self, directory, forever=False, codec=None):
         self.directory = directory
         self.forever = forever
+        self.codec = codec or get_codec('none')
+        self._scan = None
+        self._seen = {}
+        self._accessed = {}
+        self._lock = Lock()
 
         if not os.path.isdir(self.directory):
             os.makedirs(self.directory, mode=0o755)
@@ -81,17 +586,71 @@ class FileCache:
     def _fn(self, name):
         return os.path.join(self.directory, self.encode(name))
 
-    def get(self, key):
+    @staticmethod
+    def read(flh, meta_only=False):
+        """Read a cache file opened in binary mode, files hold a CacheMeta,
+        the record then the response (older files only the response, or the
+        CacheMeta and the response)"""
+        value = load(flh)
+        if not isinstance(value, CacheMeta):
+            return response_meta(value) if meta_only else value
+        if meta_only:
+            return value
+        value = load(flh)
+        if isinstance(value, Response):
+            return value
+        return load(flh)
+
+    @staticmethod
+    def read_record(flh):
+        """Read the record of a cache file opened in binary mode, the response
+        is only loaded for older files"""
+        value = load(flh)
+        if isinstance(value, CacheMeta):
+            value = load(flh)
+        if isinstance(value, Response):
+            return getattr(value, 'record', None)
+        return value
+
+    def _read(self, key, read, **kwargs):
+        """Missing and unreadable files are cache misses"""
         name = self._fn(key)
-        if os.path.exists(name):
-            return load(codecs.open(name, 'rb'))
-        return None
+        try:
+            with codecs.open(name, 'rb') as flh:
+                value = read(flh, **kwargs)
+        except FileNotFoundError:
+            return None
+        except _PICKLE_ERRORS:  # corrupted, left to purge
+            return None
+        with self._lock:
+            self._accessed[name] = time.time()
+        return value
+
+    def get(self, key):
+        return self._read(key, self.read)
+
+    def get_meta(self, key):
+        return self._read(key, self.read, meta_only=True)
+
+    def get_record(self, key):
+        return self._read(key, self.read_record)
 
     def set(self, key, value):
+        """Written to a temporary file then moved in place, readers never
+        see partially written files"""
         name = self._fn(key)
+        cached = CachedResponse.from_response(value, self.codec)
         with FileLock(name):
-            with codecs.open(name, 'w+b') as flh:
-                dump(value, flh)
+            fd, tmp = tempfile.mkstemp(suffix=TMP_SUFFIX, dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as flh:
+                    dump(response_meta(value)._replace(url=key), flh)
+                    dump(cached.record, flh)
+                    dump(cached, flh)
+                os.replace(tmp, name)
+            except BaseException:
+                os.remove(tmp)
+                raise
 
     def delete(self, key):
         if not self.forever:
@@ -100,5 +659,367 @@ class FileCache:
     def __iter__(self):
         for dirpath, _, filenames in os.walk(self.directory):
             for item in filenames:
+                if item.endswith(('.lock', TMP_SUFFIX)):
+                    continue
                 name = os.path.join(dirpath, item)
-                yield load(codecs.open(name, 'rb'))
+                with codecs.open(name, 'rb') as flh:
+                    yield self.read(flh)
+
+    @staticmethod
+    def _remove(name):
+        """Remove a file, locked as in :py:meth:`set`, returns False if it is
+        still locked"""
+        try:
+            with FileLock(name):
+                os.remove(name)
+        except FileNotFoundError:
+            pass
+        except FileLockException:
+            return False
+        return True
+
+    @staticmethod
+    def _remove_leftover(entry, now):
+        """Remove temporary files left by interrupted writes"""
+        try:
+            if entry.stat().st_mtime < now - MAINTENANCE_INTERVAL:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+    def _examine(self, entry, keep, now, grace=0):
+        """Returns False if entry was evicted"""
+        try:
+            stat = entry.stat()
+            with open(entry.path, 'rb') as flh:
+                value = load(flh)
+                resp = None
+                if isinstance(value, CacheMeta):
+                    meta = value
+                else:
+                    resp, meta = value, response_meta(value)
+                expired = _expired(meta, now)
+                if not meta.etag and _expired(meta, now - grace):
+                    return False
+                # Files written before the key was stored in metadata
+                if keep and not keep(meta.url or
+                                     (resp or load(flh)).request.url):
+                    return False
+        except FileNotFoundError:
+            return True
+        except _PICKLE_ERRORS + (OSError,):  # corrupted
+            return False
+        self._seen[entry.path] = (not expired, stat.st_mtime, stat.st_size)
+        return True
+
+    def _flush_accesses(self):
+        """Write recorded accesses to files modification time"""
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        for name, date in accessed.items():
+            try:
+                os.utime(name, (date, date))
+            except FileNotFoundError:
+                pass
+
+    def purge(self, keep=None, max_entries=0, max_bytes=0, batch=PURGE_BATCH,
+              grace=0):
+        """Size limits are enforced once every file was examined, files
+        modification time stands for last use."""
+        if self.forever:
+            return 0
+        self._flush_accesses()
+        now = time.time()
+        if self._scan is None:
+            self._scan = os.scandir(self.directory)
+            self._seen = {}
+        evicted = 0
+        entries = list(islice(self._scan, batch))
+        for entry in entries:
+            if entry.name.endswith(TMP_SUFFIX):
+                self._remove_leftover(entry, now)
+                continue
+            if entry.name.endswith('.lock') or not entry.is_file():
+                continue
+            if not self._examine(entry, keep, now, grace) and \
+                    self._remove(entry.path):
+                evicted += 1
+        if len(entries) == batch:
+            return evicted
+        # Went through the whole directory
+        self._scan.close()
+        self._scan = None
+        count = len(self._seen)
+        size = sum(length for _, _, length in self._seen.values())
+        for name, (_, _, length) in sorted(self._seen.items(),
+                                           key=lambda item: item[1]):
+            if (not max_entries or count <= max_entries) and \
+                    (not max_bytes or size <= max_bytes):
+                break
+            if not self._remove(name):
+                continue
+            count -= 1
+            size -= length
+            evicted += 1
+        return evicted
+
+
+class SqliteCache(BaseCache):
+    """Responses stored in a single SQLite file
+
+    Freshness related headers (date, max-age, expires, etag, last-modified)
+    are kept in their own columns, the body as a blob.
+
+    :param str db_path: SQLite file, created if missing
+    :param Codec codec: codec compressing bodies, defaults to no compression
+    """
+
+    def __init__(self, db_path, codec=None):
+        self.db_path = db_path
+        self.codec = codec or get_codec('none')
+        self._lock = Lock()
+        self._accessed = {}
+        self._scan = 0
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o755)
+        self.create_db()
+
+    def get_database_connection(self):
+        """get database reference"""
+        return sqlite3.connect(self.db_path, isolation_level=None)
+
+    def create_db(self):
+        """Set up the database"""
+        connection = self.get_database_connection()
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, '
+            'status INTEGER, date INTEGER, max_age INTEGER, expires INTEGER, '
+            'etag TEXT, last_modified TEXT, headers TEXT, '
+            'request_headers TEXT, body BLOB, size INTEGER, '
+            'last_access INTEGER, codec TEXT, record TEXT)')
+        columns = {row[1] for row in
+                   connection.execute('PRAGMA table_info(responses)')}
+        for column, sqltype in (('size', 'INTEGER'), ('last_access', 'INTEGER'),
+                                ('codec', 'TEXT'), ('record', 'TEXT')):  # tables created by v0.19.0.dev
+            if column not in columns:
+                connection.execute(f'ALTER TABLE responses ADD COLUMN {column} {sqltype}')
+        connection.execute('CREATE INDEX IF NOT EXISTS responses_date '
+                           'ON responses (date)')
+        connection.execute('CREATE INDEX IF NOT EXISTS responses_etag '
+                           'ON responses (etag)')
+        connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access '
+                           'ON responses (last_access)')
+        connection.close()
+
+    @staticmethod
+    def _record(value):
+        if value is None:
+            return None
+        schema, rows = json.loads(value)
+        return schema, tuple(map(tuple, rows))
+
+    def _response(self, row):
+        url, status, headers, request_headers, body, codec_name, record = row
+        resp = CachedResponse(body, codec_name or 'none')
+        resp.record = self._record(record)
+        resp.url = url
+        resp.status_code = status
+        resp.reason = 'OK'
+        resp.headers = CaseInsensitiveDict(json.loads(headers))
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        request = PreparedRequest()
+        request.method = 'GET'
+        request.url = url
+        request.headers = CaseInsensitiveDict(json.loads(request_headers))
+        resp.request = request
+        return resp
+
+    def get(self, key):
+        connection = self.get_database_connection()
+        row = connection.execute(
+            'SELECT url, status, headers, request_headers, body, codec, record '
+            'FROM responses WHERE url = ?', (key,)).fetchone()
+        connection.close()
+        if row is None:
+            return None
+        with self._lock:  # written to the database on next purge
+            self._accessed[key] = int(time.time())
+        return self._response(row)
+
+    def get_meta(self, key):
+        connection = self.get_database_connection()
+        row = connection.execute(
+            'SELECT date, max_age, expires, etag, last_modified, headers, '
+            'request_headers FROM responses WHERE url = ?', (key,)).fetchone()
+        connection.close()
+        if row is None:
+            return None
+        vary = ()
+        headers = CaseInsensitiveDict(json.loads(row[5]))
+        if 'vary' in headers:
+            request_headers = CaseInsensitiveDict(json.loads(row[6]))
+            vary = tuple((header, request_headers.get(header))
+                         for header in headers['vary'].replace(' ', '').split(','))
+        return CacheMeta(*row[:5], vary)
+
+    def get_record(self, key):
+        connection = self.get_database_connection()
+        row = connection.execute('SELECT record FROM responses WHERE url = ?',
+                                 (key,)).fetchone()
+        connection.close()
+        if row is None:
+            return None
+        with self._lock:
+            self._accessed[key] = int(time.time())
+        return self._record(row[0])
+
+    def set(self, key, value):
+        meta = response_meta(value)
+        request_headers = value.request.headers if value.request else {}
+        body = CachedResponse.from_response(value, self.codec).body
+        record = getattr(value, 'record', None)
+        connection = self.get_database_connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO responses (url, status, date, max_age, '
+            'expires, etag, last_modified, headers, request_headers, body, '
+            'size, last_access, codec, record) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, value.status_code, *meta[:5],
+             json.dumps(dict(value.headers)), json.dumps(dict(request_headers)),
+             body, len(body), int(time.time()), self.codec.name,
+             json.dumps(record) if record else None))
+        connection.close()
+
+    def delete(self, key):
+        connection = self.get_database_connection()
+        connection.execute('DELETE FROM responses WHERE url = ?', (key,))
+        connection.close()
+
+    def __len__(self):
+        connection = self.get_database_connection()
+        count, = connection.execute('SELECT count(*) FROM responses').fetchone()
+        connection.close()
+        return count
+
+    def __iter__(self):
+        connection = self.get_database_connection()
+        rows = connection.execute(
+            'SELECT url, status, headers, request_headers, body, codec, record '
+            'FROM responses').fetchall()
+        connection.close()
+        for row in rows:
+            yield self._response(row)
+
+    @staticmethod
+    def _delete_rows(connection, rowids):
+        if rowids:
+            connection.execute('DELETE FROM responses WHERE rowid IN '
+                               f'({", ".join("?" * len(rowids))})', rowids)
+        return len(rowids)
+
+    def purge(self, keep=None, max_entries=0, max_bytes=0, batch=PURGE_BATCH,
+              grace=0):
+        now = int(time.time())
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        connection = self.get_database_connection()
+        connection.executemany(
+            'UPDATE responses SET last_access = ? WHERE url = ?',
+            [(date, url) for url, date in accessed.items()])
+        evicted = connection.execute(
+            'DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses '
+            f'WHERE etag IS NULL AND {_EXPIRY} <= ? LIMIT ?)',
+            (now - grace, batch)).rowcount
+        if keep:
+            rows = connection.execute(
+                'SELECT rowid, url FROM responses WHERE rowid > ? '
+                'ORDER BY rowid LIMIT ?', (self._scan, batch)).fetchall()
+            # Carry on from there next time, start over at the end
+            self._scan = rows[-1][0] if len(rows) == batch else 0
+            evicted += self._delete_rows(
+                connection, [rowid for rowid, url in rows if not keep(url)])
+        if max_entries or max_bytes:
+            count, size = connection.execute(
+                'SELECT count(*), coalesce(sum(size), 0) '
+                'FROM responses').fetchone()
+            rowids = []
+            for rowid, length in connection.execute(
+                    f'SELECT rowid, size FROM responses ORDER BY {_EXPIRY} > ?, '
+                    'last_access LIMIT ?', (now, batch)):
+                if (not max_entries or count <= max_entries) and \
+                        (not max_bytes or size <= max_bytes):
+                    break
+                rowids.append(rowid)
+                count -= 1
+                size -= length or 0
+            evicted += self._delete_rows(connection, rowids)
+        connection.close()
+        return evicted
+
+
+class CacheMaintenance(Thread):
+    """Background thread running :py:meth:`BaseCache.purge` every interval
+
+    :param BaseCache cache: cache to maintain
+    :param int max_entries: entries limit, 0 for no limit
+    :param int max_bytes: size limit, 0 for no limit
+    :param int interval: seconds between maintenance steps
+    :param int grace: seconds stale entries without etag are kept for
+    """
+    log = getLogger('sima')
+
+    def __init__(self, cache, max_entries=0, max_bytes=0,
+                 interval=MAINTENANCE_INTERVAL, grace=0):
+        super().__init__(name='CacheMaintenance', daemon=True)
+        self.cache = cache
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self.interval = interval
+        #: entries filter passed to :py:meth:`BaseCache.purge`, replace it
+        #: rather than mutating state it relies on
+        self.keep = None
+        self._done = Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            try:
+                evicted = self.cache.purge(self.keep, self.max_entries,
+                                           self.max_bytes, grace=self.grace)
+            except (OSError, sqlite3.Error) as err:
+                self.log.warning('Cache maintenance failed: %s', err)
+                continue
+            if evicted:
+                self.log.debug('Cache maintenance: %d entries evicted', evicted)
+
+    def stop(self):
+        """Stop the thread, returns without waiting for it"""
+        self._done.set()
+
+
+def migrate_filecache(directory, cache):
+    """Copy responses from a :py:class:`FileCache` directory into cache
+
+    Unreadable files are skipped, the directory is left untouched.
+
+    :param str directory: FileCache directory
+    :param BaseCache cache: destination cache, usually a :py:class:`SqliteCache`
+    :return: (migrated, skipped) counts
+    """
+    migrated = skipped = 0
+    for dirpath, _, filenames in os.walk(directory):
+        for item in filenames:
+            try:
+                with open(os.path.join(dirpath, item), 'rb') as flh:
+                    resp = FileCache.read(flh)
+                key = resp.request.url
+            except _PICKLE_ERRORS + (OSError,):
+                skipped += 1
+                continue
+            cache.set(key, resp)
+            migrated += 1
+    return migrated, skipped
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-# Copyright (c) 2014-2015, 2020, 2021 kaliko <kaliko@azylum.org>
+# Copyright (c) 2014-2015, 2020, 2021, 2024 kaliko <kaliko@azylum.org>
 # Copyright (c) 2012, 2013 Eric Larson <eric@ionrock.org>
 #
 #   This program is free software: you can redistribute it and/or modify
@@ -21,18 +21,29 @@
 The httplib2 algorithms ported for use with requests.
 """
 import re
-import calendar
 import time
 
-import email.utils
+from logging import getLogger
+from threading import Thread
 
 from requests import Session, Request, Timeout, ConnectionError as HTTPConnectionError
 
-from sima import SOCKET_TIMEOUT, WAIT_BETWEEN_REQUESTS
-from sima.utils.utils import WSError, WSTimeout, WSHTTPError, Throttle
-from .cache import DictCache
+from sima import SOCKET_TIMEOUT, WAIT_BETWEEN_REQUESTS, BURST_REQUESTS
+from sima.utils.utils import WSError, WSTimeout, WSHTTPError
+from sima.utils.utils import SingleFlight, TokenBucket
+from .cache import DictCache, parse_cache_control
 
 
+#: Rate limiter shared by HttpClient instances
+LIMITER = TokenBucket(1 / WAIT_BETWEEN_REQUESTS.total_seconds(), BURST_REQUESTS)
+#: In flight requests shared by HttpClient instances
+FLIGHTS = SingleFlight()
+
+#: Cached response freshness, cf. :py:meth:`CacheController.lookup`
+FRESH = 'fresh'
+STALE = 'stale'
+STALE_IF_ERROR = 'stale-if-error'
+
 URI = re.compile(r"^(([^:/?#]+):)?(//([^/?#]*))?([^?#]*)(\?([^#]*))?(#(.*))?")
 
 
@@ -49,9 +60,14 @@ class CacheController:
     """An interface to see if request should cached or not.
     """
     CACHE_ANYWAY = False
+    #: Seconds past expiration stale responses are served while revalidated
+    STALE_WHILE_REVALIDATE = 0
+    #: Seconds past expiration stale responses are served on errors
+    STALE_IF_ERROR = 0
 
     def __init__(self, cache=None, cache_etags=True):
-        self.cache = cache or DictCache()
+        # Not relying on truth value, empty caches may be falsy
+        self.cache = DictCache() if cache is None else cache
         self.cache_etags = cache_etags
 
     def _urlnorm(self, uri):
@@ -80,23 +96,45 @@ class CacheController:
         Parse the cache control headers returning a dictionary with values
         for the different directives.
         """
-        retval = {}
-
-        # requests provides a CaseInsensitiveDict as headers
-        cc_header = 'cache-control'
-        if cc_header in headers:
-            parts = headers[cc_header].split(',')
-            parts_with_args = [
-                tuple([x.strip().lower() for x in part.split("=", 1)])
-                for part in parts if -1 != part.find("=")]
-            parts_wo_args = [(name.strip().lower(), 1)
-                             for name in parts if -1 == name.find("=")]
-            retval = dict(parts_with_args + parts_wo_args)
-        return retval
+        return parse_cache_control(headers)
 
     def cached_request(self, request):
         """Return the cached resquest if available and fresh
         """
+        cache_url = self.fresh_key(request)
+        if not cache_url:
+            return False
+        resp = self.cache.get(cache_url)
+        if not resp:  # removed in the meantime
+            return False
+        # make sure we set the from_cache to true
+        resp.from_cache = True
+        return resp
+
+    def fresh_key(self, request):
+        """Cache key of the fresh cached response for request, None if
+        there is none.
+
+        Only cache metadata are looked at. Stale responses are removed or
+        revalidation headers are set on request.
+        """
+        cache_url, freshness = self.lookup(request)
+        if freshness == FRESH:
+            return cache_url
+        return None
+
+    def lookup(self, request):
+        """Cache key and freshness of the cached response for request
+
+        Only cache metadata are looked at. Stale responses out of the
+        stale windows are removed or revalidation headers are set on
+        request.
+
+        :return: (cache_url, freshness), freshness is :py:data:`FRESH`,
+                 :py:data:`STALE` within :py:attr:`STALE_WHILE_REVALIDATE`,
+                 :py:data:`STALE_IF_ERROR` within :py:attr:`STALE_IF_ERROR`
+                 or None if there is no usable cached response
+        """
         cache_url = self.cache_url(request.url)
         cc = self.parse_cache_control(request.headers)
 
@@ -104,14 +142,11 @@ class CacheController:
         no_cache = bool('no-cache' in cc)
         if 'max-age' in cc and cc['max-age'] == 0:
             no_cache = True
-        # see if it is in the cache anyways
-        in_cache = self.cache.get(cache_url)
-        if no_cache or not in_cache:
-            return False
-
-        # It is in the cache, so lets see if it is going to be
-        # fresh enough
-        resp = self.cache.get(cache_url)
+        # see if it is in the cache anyways, only metadata are loaded
+        # until the cached response is known to be fresh
+        meta = self.cache.get_meta(cache_url)
+        if no_cache or not meta:
+            return cache_url, None
 
         # Check our Vary header to make sure our request headers match
         # up. We don't delete it from the though, we just don't return
@@ -120,76 +155,64 @@ class CacheController:
         # NOTE: Because httplib2 stores raw content, it denotes
         #       headers that were sent in the original response by
         #       adding -varied-$name. We don't have to do that b/c we
-        #       are storing the object which has a reference to the
-        #       original request. If that changes, then I'd propose
-        #       using the varied headers in the cache key to avoid the
-        #       situation all together.
-        if 'vary' in resp.headers:
-            varied_headers = resp.headers['vary'].replace(' ', '').split(',')
-            original_headers = resp.request.headers
-            for header in varied_headers:
-                # If our headers don't match for the headers listed in
-                # the vary header, then don't use the cached response
-                if request.headers.get(header, None) != original_headers.get(header):
-                    return False
-
-        now = time.time()
-        date = calendar.timegm(
-            email.utils.parsedate_tz(resp.headers['date'])
-        )
-        current_age = max(0, now - date)
-
-        # TODO: There is an assumption that the result will be a
-        # requests response object. This may not be best since we
-        # could probably avoid instantiating or constructing the
-        # response until we know we need it.
-        resp_cc = self.parse_cache_control(resp.headers)
-
-        # determine freshness
+        #       are storing the request headers listed in the vary
+        #       header in the cache metadata.
+        for header, original in meta.vary:
+            # If our headers don't match for the headers listed in
+            # the vary header, then don't use the cached response
+            if request.headers.get(header, None) != original:
+                return cache_url, None
+
+        # determine freshness, without date header the cached response
+        # can only be revalidated
         freshness_lifetime = 0
-        if 'max-age' in resp_cc and resp_cc['max-age'].isdigit():
-            freshness_lifetime = int(resp_cc['max-age'])
-        elif 'expires' in resp.headers:
-            expires = email.utils.parsedate_tz(resp.headers['expires'])
-            if expires is not None:
-                expire_time = calendar.timegm(expires) - date
-                freshness_lifetime = max(0, expire_time)
-
-        # determine if we are setting freshness limit in the req
-        if 'max-age' in cc:
-            try:
-                freshness_lifetime = int(cc['max-age'])
-            except ValueError:
-                freshness_lifetime = 0
-
-        if 'min-fresh' in cc:
-            try:
-                min_fresh = int(cc['min-fresh'])
-            except ValueError:
-                min_fresh = 0
-            # adjust our current age by our min fresh
-            current_age += min_fresh
+        current_age = 0
+        if meta.date is not None:
+            current_age = max(0, time.time() - meta.date)
+            if meta.max_age is not None:
+                freshness_lifetime = meta.max_age
+            elif meta.expires is not None:
+                freshness_lifetime = max(0, meta.expires - meta.date)
+
+            # determine if we are setting freshness limit in the req
+            if 'max-age' in cc:
+                try:
+                    freshness_lifetime = int(cc['max-age'])
+                except ValueError:
+                    freshness_lifetime = 0
+
+            if 'min-fresh' in cc:
+                try:
+                    min_fresh = int(cc['min-fresh'])
+                except ValueError:
+                    min_fresh = 0
+                # adjust our current age by our min fresh
+                current_age += min_fresh
 
         # see how fresh we actually are
         fresh = (freshness_lifetime > current_age)
 
         if fresh:
-            # make sure we set the from_cache to true
-            resp.from_cache = True
-            return resp
+            return cache_url, FRESH
+
+        staleness = current_age - freshness_lifetime
+        freshness = None
+        if staleness < self.STALE_WHILE_REVALIDATE:
+            freshness = STALE
+        elif staleness < self.STALE_IF_ERROR:
+            freshness = STALE_IF_ERROR
 
         # we're not fresh. If we don't have an Etag, clear it out
-        if 'etag' not in resp.headers:
+        if meta.etag:
+            request.headers['If-None-Match'] = meta.etag
+        elif freshness is None:
             self.cache.delete(cache_url)
 
-        if 'etag' in resp.headers:
-            request.headers['If-None-Match'] = resp.headers['ETag']
-
-        if 'last-modified' in resp.headers:
-            request.headers['If-Modified-Since'] = resp.headers['Last-Modified']
+        if meta.last_modified:
+            request.headers['If-Modified-Since'] = meta.last_modified
 
         # return the original handler
-        return False
+        return cache_url, freshness
 
     def cache_response(self, request, resp):
         """
@@ -209,7 +232,7 @@ class CacheController:
 
         # Delete it from the cache if we happen to have it stored there
         no_store = cc_resp.get('no-store') or cc_req.get('no-store')
-        if no_store and self.cache.get(cache_url):
+        if no_store and self.cache.get_meta(cache_url):
             self.cache.delete(cache_url)
 
         # If we've been given an etag, then keep the response
@@ -273,43 +296,156 @@ class CacheController:
 
 
 class HttpClient:
-    def __init__(self, cache=None, stats=None):
+    log = getLogger('sima')
+
+    def __init__(self, cache=None, stats=None, limiter=None, flights=None):
         """
         Prepare http request
         Use cached elements or proceed http request
+
+        Requests sent to the web service go through limiter, a
+        :py:class:`sima.utils.utils.TokenBucket` defaulting to the shared
+        :py:data:`LIMITER`, fresh cached responses are not rate limited.
+
+        Concurrent identical requests (same cache key) are coalesced by
+        flights, a :py:class:`sima.utils.utils.SingleFlight` defaulting to
+        the shared :py:data:`FLIGHTS`: only one reaches cache and network,
+        the others wait for its result.
+
+        Stale responses within the controller stale windows are served
+        right away and revalidated in a background thread, or served when
+        the web service fails.
         """
         self.stats = stats
         self.controller = CacheController(cache)
+        self.limiter = LIMITER if limiter is None else limiter
+        self.flights = FLIGHTS if flights is None else flights
         self.sess = Session()
 
-    def __call__(self, ress, payload):
+    def __call__(self, ress, payload, record=None):
+        """Fetch ress, from cache if fresh
+
+        :param tuple record: (schema, parse) where parse builds a compact
+                             record from the response, schema names the
+                             record version. Records are cached along with
+                             responses.
+        :return: the response, or record rows if record is set
+        """
         req = Request('GET', ress, params=payload,).prepare()
         if self.stats:
             self.stats.update(total=self.stats.get('total')+1)
-        cached_response = self.controller.cached_request(req)
-        if cached_response:
-            if self.stats:
-                self.stats.update(ccontrol=self.stats.get('ccontrol')+1)
-            return cached_response
+        key = (self.controller.cache_url(req.url), record[0] if record else None)
         try:
-            return self.fetch_ws(req)
+            result, shared = self.flights.do(key, self._get, req, record)
         except Timeout as err:
             raise WSTimeout(f'Failed to reach server within {SOCKET_TIMEOUT}s') from err
         except HTTPConnectionError as err:
             raise WSError(err) from err
+        if shared and self.stats:
+            self.stats.update(coalesced=self.stats.get('coalesced', 0)+1)
+        return result
+
+    def _get(self, req, record):
+        cache_url, freshness = self.controller.lookup(req)
+        if freshness == FRESH:
+            cached = self._cached(cache_url, record)
+            if cached is not None:
+                if self.stats:
+                    self.stats.update(ccontrol=self.stats.get('ccontrol')+1)
+                return cached
+        elif freshness == STALE:
+            cached = self._cached(cache_url, record)
+            if cached is not None:
+                if self.stats:
+                    self.stats.update(stale=self.stats.get('stale', 0)+1)
+                self._revalidate(cache_url, req, record)
+                return cached
+        try:
+            return self.fetch_ws(req, record,
+                                 keep_stale=freshness in (STALE, STALE_IF_ERROR))
+        except (WSError, Timeout, HTTPConnectionError) as err:
+            if freshness not in (STALE, STALE_IF_ERROR):
+                raise
+            cached = self._cached(cache_url, record)
+            if cached is None:
+                raise
+            self.log.debug('Serving stale %s: %s', cache_url, err)
+            if self.stats:
+                self.stats.update(stale_if_error=self.stats.get('stale_if_error', 0)+1)
+            return cached
 
-    @Throttle(WAIT_BETWEEN_REQUESTS)
-    def fetch_ws(self, prepreq):
-        """fetch from web service"""
-        settings = self.sess.merge_environment_settings(prepreq.url, {}, None, False, None)
-        resp = self.sess.send(prepreq, timeout=SOCKET_TIMEOUT, **settings)
+    def _revalidate(self, cache_url, req, record):
+        """Refresh stale cached response in a background thread"""
+        key = (cache_url, 'revalidate')
+        if key in self.flights:
+            return
+        Thread(target=self._background_fetch, args=(key, req, record),
+               name='revalidate', daemon=True).start()
+
+    def _background_fetch(self, key, req, record):
+        try:
+            with Session() as sess:
+                self.flights.do(key, self.fetch_ws, req, record, sess, True)
+        except (WSError, Timeout, HTTPConnectionError) as err:
+            self.log.debug('Background revalidation of %s failed: %s',
+                           key[0], err)
+
+    def _cached(self, cache_url, record):
+        cache = self.controller.cache
+        if record:
+            cached_record = cache.get_record(cache_url)
+            if cached_record and cached_record[0] == record[0]:
+                return cached_record[1]
+        resp = cache.get(cache_url)
+        if not resp:  # removed in the meantime
+            return None
+        resp.from_cache = True
+        if not record:
+            return resp
+        rows = self._parse(resp, record)
+        cache.set(cache_url, resp)  # parse once
+        return rows
+
+    @staticmethod
+    def _parse(resp, record):
+        schema, parse = record
+        rows = parse(resp)
+        resp.record = (schema, rows)
+        return rows
+
+    def fetch_ws(self, prepreq, record=None, sess=None, keep_stale=False):
+        """fetch from web service
+
+        :param Session sess: session to use, defaults to the client's one
+        :param bool keep_stale: answers failing to parse do not replace the
+                                cached response, it may still be served stale
+        """
+        sess = sess or self.sess
+        self.limiter.acquire()
+        settings = sess.merge_environment_settings(prepreq.url, {}, None, False, None)
+        resp = sess.send(prepreq, timeout=SOCKET_TIMEOUT, **settings)
         if resp.status_code == 304:
             self.stats.update(etag=self.stats.get('etag')+1)
             resp = self.controller.update_cached_response(prepreq, resp)
         elif resp.status_code != 200:
             raise WSHTTPError(f'{resp.status_code}: {resp.reason}')
+        if not record:
+            self.controller.cache_response(resp.request, resp)
+            return resp
+        cached_record = getattr(resp, 'record', None)
+        if cached_record and cached_record[0] == record[0]:  # 304
+            self.controller.cache_response(resp.request, resp)
+            return cached_record[1]
+        try:
+            rows = self._parse(resp, record)
+        except WSError:
+            # Error answers are cached as well, unless a stale response
+            # is to be served instead
+            if not keep_stale:
+                self.controller.cache_response(resp.request, resp)
+            raise
         self.controller.cache_response(resp.request, resp)
-        return resp
+        return rows
 
 # VIM MODLINE
 # vim: ai ts=4 sw=4 sts=4 expandtab
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright (c) 2013, 2014, 2015, 2021 kaliko <kaliko@azylum.org>
+# Copyright (c) 2013, 2014, 2015, 2021, 2024 kaliko <kaliko@azylum.org>
 #
 #  This file is part of sima
 #
@@ -23,13 +23,17 @@ Defines some object to handle audio file metadata
 
 
 from collections.abc import Set
+from copy import copy
 import logging
 import re
+from sys import intern
 
+from .mpdfilter import escape
 from ..utils.utils import MPDSimaException
 
 
 UUID_RE = r'^[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[89AB][a-f0-9]{3}-[a-f0-9]{12}$'
+_UUID_RE = re.compile(UUID_RE, re.IGNORECASE)
 #: The Track Object is collapsing multiple tags into a single string using this
 # separator. It is used then to split back the string to tags list.
 SEPARATOR = chr(0x1F)  # ASCII Unit Separator
@@ -41,8 +45,7 @@ def is_uuid4(uuid):
     :param str uuid: String representing the UUID
     :returns: boolean
     """
-    regexp = re.compile(UUID_RE, re.IGNORECASE)
-    if regexp.match(uuid):
+    if _UUID_RE.match(uuid):
         return True
     return False
 
@@ -51,6 +54,23 @@ class MetaException(MPDSimaException):
     """Generic Meta Exception"""
 
 
+class cached_property:
+    # pylint: disable=C0103,R0903
+    """Value computed once then stored in the instance __dict__, python 3.6
+    compatible :py:func:`functools.cached_property`"""
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+        self.name = func.__name__
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.func(instance)
+        return value
+
+
 def mbidfilter(func):
     def wrapper(*args, **kwargs):
         cls = args[0]
@@ -62,20 +82,15 @@ def mbidfilter(func):
     return wrapper
 
 
-def serialize(func):
-    def wrapper(*args, **kwargs):
-        ans = func(*args, **kwargs)
-        if isinstance(ans, set):
-            return {s.replace("'", r"\'").replace('"', r'\"') for s in ans}
-        return ans.replace("'", r"\'").replace('"', r'\"')
-    return wrapper
-
-
 class Meta:
     """
     A generic Class to handle tracks metadata such as artist, album, albumartist
     names and their associated MusicBrainz's ID.
 
+    Name, MusicBrainz ID and aliases are read-only, name and aliases strings
+    are interned and derived values (:attr:`names`, serialized forms) are
+    computed once. Objects are shared (:py:attr:`sima.lib.track.Track.Artist`
+    for instance), :meth:`with_alias` returns a new object with more aliases.
 
     Using generic kwargs in constructor for convenience but the actual signature is:
 
@@ -86,18 +101,18 @@ class Meta:
     """
     use_mbid = True
     """Class attribute to disable use of MusicBrainz IDs"""
+    log = logging.getLogger(__name__)
 
     def __init__(self, **kwargs):
         """Meta(name=<str>[, mbid=UUID4])"""
-        self.__name = None  # TODO: should be immutable
+        self.__name = None
         self.__mbid = None
-        self.__aliases = set()
-        self.log = logging.getLogger(__name__)
+        self.__aliases = frozenset()
         if 'name' not in kwargs or not kwargs.get('name'):
             raise MetaException('Need a "name" argument (str type)')
         if not isinstance(kwargs.get('name'), str):
             raise MetaException('"name" argument not a string')
-        self.__name = kwargs.pop('name').split(SEPARATOR)[0]
+        self.__name = intern(str(kwargs.pop('name').split(SEPARATOR)[0]))
         if 'mbid' in kwargs and kwargs.get('mbid'):
             mbid = kwargs.get('mbid').lower().split(SEPARATOR)[0]
             if is_uuid4(mbid):
@@ -118,11 +133,10 @@ class Meta:
         """
         Perform mbid equality test
         """
-        #if hasattr(other, 'mbid'):  # better isinstance?
-        if isinstance(other, Meta) and self.mbid and other.mbid:
-            return self.mbid == other.mbid
         if isinstance(other, Meta):
-            return bool(self.names & other.names)
+            if self.mbid and other.mbid:
+                return self.mbid == other.mbid
+            return not self.names.isdisjoint(other.names)
         if getattr(other, '__str__', None):
             # is other.__str__() in self.__name or self.__aliases
             return other.__str__() in self.names
@@ -133,30 +147,40 @@ class Meta:
             return hash(self.mbid)
         return hash(self.__name)
 
-    def add_alias(self, other):
-        """Add alternative name to `aliases` attibute.
+    def with_alias(self, other):
+        """Copy with an alternative name added to `aliases` attibute, the
+        object itself is left untouched.
 
         `other` can be a :class:`sima.lib.meta.Meta` object in which case aliases are merged.
 
         :param str other: Alias to add, could be any object with ``__str__`` method.
+        :return: a new object, or the object itself when aliases are unchanged
         """
+        aliases = self.__aliases
         if isinstance(other, Meta):
-            self.__aliases |= other.__aliases
-            self.__aliases -= {self.name}
+            aliases = aliases | other.__aliases
         if getattr(other, '__str__', None):
             if callable(other.__str__) and other.__str__() != self.name:
-                self.__aliases |= {other.__str__()}
+                aliases = aliases | {intern(other.__str__())}
         else:
             raise MetaException(f'No __str__ method found in {other!r}')
+        aliases = aliases - {self.name}
+        if aliases == self.__aliases:
+            return self
+        new = copy(self)
+        new.__aliases = frozenset(aliases)
+        for key in ('aliases_sz', 'names', 'names_sz'):  # cached_property
+            new.__dict__.pop(key, None)
+        return new
 
     @property
     def name(self):
         return self.__name
 
-    @property
-    @serialize
+    @cached_property
     def name_sz(self):
-        return self.name
+        """name escaped to be used in MPD filters, cf. :py:func:`sima.lib.mpdfilter.escape`"""
+        return escape(self.name)
 
     @property
     def mbid(self):
@@ -166,20 +190,18 @@ class Meta:
     def aliases(self):
         return self.__aliases
 
-    @property
-    @serialize
+    @cached_property
     def aliases_sz(self):
-        return self.aliases
+        return frozenset(map(escape, self.aliases))
 
-    @property
+    @cached_property
     def names(self):
         """aliases + name"""
-        return self.__aliases | {self.__name, }
+        return self.__aliases | {self.__name}
 
-    @property
-    @serialize
+    @cached_property
     def names_sz(self):
-        return self.names
+        return frozenset(map(escape, self.names))
 
 
 class Album(Meta):
@@ -228,22 +250,55 @@ class Artist(Meta):
 
 
 class MetaContainer(Set):
+    """Set of :class:`Meta` objects relying on :meth:`Meta.__eq__`, equal
+    objects are merged, aliases included (cf. :meth:`Meta.with_alias`).
+
+    Objects are indexed on MusicBrainz ID and names (aliases included) for
+    fast membership test, hence fast set operations.
+    """
 
     def __init__(self, iterable):
-        self.elements = lst = []
+        self.elements = []
+        self._mbids = {}
+        self._names = {}
         for value in iterable:
-            if value not in lst:
-                lst.append(value)
-            else:
-                for inlst in lst:
-                    if value == inlst:
-                        inlst.add_alias(value)
+            self._add(value)
+
+    def _index(self, idx):
+        elem = self.elements[idx]
+        if elem.mbid:
+            self._mbids.setdefault(elem.mbid, set()).add(idx)
+        for name in elem.names:
+            self._names.setdefault(name, set()).add(idx)
+
+    def _matches(self, value):
+        """Indexes of elements equal to value"""
+        if not isinstance(value, Meta):
+            return set(self._names.get(str(value), ()))
+        mbid = value.mbid
+        found = set(self._mbids.get(mbid, ())) if mbid else set()
+        for name in value.names:
+            for idx in self._names.get(name, ()):
+                # Same names but different MBIDs are not equal
+                if not mbid or not self.elements[idx].mbid:
+                    found.add(idx)
+        return found
+
+    def _add(self, value):
+        matches = self._matches(value)
+        if not matches:
+            self.elements.append(value)
+            self._index(len(self.elements) - 1)
+        for idx in matches:
+            # Elements might be shared (Track.Artist for instance)
+            self.elements[idx] = self.elements[idx].with_alias(value)
+            self._index(idx)
 
     def __iter__(self):
         return iter(self.elements)
 
     def __contains__(self, value):
-        return value in self.elements
+        return bool(self._matches(value))
 
     def __len__(self):
         return len(self.elements)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024 kaliko <kaliko@azylum.org>
+#
+#  This file is part of sima
+#
+#  sima is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  sima is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with sima.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""
+Build MPD filter expressions (MPD >= 0.21)
+
+>>> from sima.lib.mpdfilter import tag_filter, all_of, any_of
+>>> all_of(tag_filter('album', "Heaven's Door"),
+>>>        any_of(tag_filter('albumartist', 'Foo'),
+>>>               tag_filter('albumartist', 'Bar')))
+"((album == 'Heaven\\'s Door') AND (!((!(albumartist == 'Foo')) AND (!(albumartist == 'Bar')))))"
+
+MPD filters have no "OR" operator, :py:func:`any_of` relies on negated
+expressions instead: (A OR B) is written (!((!A) AND (!B))).
+"""
+
+#: First MPD version supporting filter expressions
+FILTERS_VERSION = (0, 21, 0)
+#: Longest blocklist expression sent to MPD, MPD limits the command line size
+BLOCKLIST_MAX_LENGTH = 2048
+
+
+def escape(value):
+    """Escape a string to be used as a quoted value in a filter expression
+
+    :param str value: the string to escape
+    """
+    return value.replace('\\', '\\\\').replace("'", "\\'").replace('"', '\\"')
+
+
+def tag_filter(tag, value, operator='=='):
+    """Single tag expression, for instance ``(artist == 'Name')``
+
+    :param str tag: tag name
+    :param str value: value to compare the tag with, escaped here
+    :param str operator: one of ``==``, ``!=``, ``=~``, ``!~``, ``contains``
+    """
+    return f"({tag} {operator} '{escape(value)}')"
+
+
+def negate(expression):
+    """Negate an expression"""
+    return f'(!{expression})'
+
+
+def all_of(*expressions):
+    """Combine expressions with AND, empty expressions are ignored"""
+    expressions = [exp for exp in expressions if exp]
+    if len(expressions) <= 1:
+        return ''.join(expressions)
+    return f"({' AND '.join(expressions)})"
+
+
+def any_of(*expressions):
+    """Combine expressions with a logical OR, empty expressions are ignored"""
+    expressions = [exp for exp in expressions if exp]
+    if len(expressions) <= 1:
+        return ''.join(expressions)
+    return negate(all_of(*map(negate, expressions)))
+
+
+def _exclude(tag, mbid_tag, name, mbid, use_mbid):
+    if use_mbid and mbid:
+        return tag_filter(mbid_tag, mbid, '!=')
+    if use_mbid:  # blocklisted by name only, tracks with MBID are not
+        return negate(all_of(tag_filter(tag, name), tag_filter(mbid_tag, '')))
+    return tag_filter(tag, name, '!=')
+
+
+def blocklist_filter(blocklist, use_mbid=True, max_length=BLOCKLIST_MAX_LENGTH):
+    """Compile blocklist entries into a single expression excluding them
+
+    Entries are matched as in :py:class:`sima.lib.simadb.SimaDB`, on
+    MusicBrainz identifier when available, else on name.
+
+    :param list blocklist: entries as returned by
+                           :py:meth:`sima.lib.simadb.SimaDB.view_bl`
+    :param bool use_mbid: match entries on MusicBrainz identifiers
+    :param int max_length: expression length limit
+    :return: the expression, an empty string for an empty blocklist or
+             None if the expression exceeds max_length
+    """
+    expressions = []
+    for entry in blocklist:
+        if entry.get('file'):
+            expressions.append(tag_filter('file', entry['file'], '!='))
+        elif entry.get('album'):
+            expressions.append(_exclude('album', 'MUSICBRAINZ_ALBUMID',
+                                        entry['album'],
+                                        entry.get('musicbrainz_album'), use_mbid))
+        elif entry.get('artist'):
+            expressions.append(_exclude('artist', 'MUSICBRAINZ_ARTISTID',
+                                        entry['artist'],
+                                        entry.get('musicbrainz_artist'), use_mbid))
+    expression = all_of(*expressions)
+    if len(expression) > max_length:
+        return None
+    return expression
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
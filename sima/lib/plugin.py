@@ -23,6 +23,8 @@ Plugin object to derive from
 
 import random
 
+from itertools import chain
+
 from .meta import Artist, MetaContainer
 
 
@@ -136,8 +138,8 @@ class AdvancedPlugin(Plugin):
 
         :param {Artist} alist: Artist objects list/container
         """
-        queued_artist = MetaContainer([Artist(_.artist) for _ in
-                                       self.player.queue if _.artist])
+        queued_artist = MetaContainer([Artist(name=name) for name, _ in
+                                       self.player.snapshot.queue_counter.artists])
         not_queued_artist = alist - queued_artist
         duration = self.main_conf.getint('sima', 'history_duration')
         hist = []
@@ -177,15 +179,20 @@ class AdvancedPlugin(Plugin):
         albums_not_in_hist.extend(albums_hist)
         self.log.trace('Album candidates: %s', albums_not_in_hist)
         album_to_queue = []
+        snapshot = self.player.snapshot
+        queued_albums = snapshot.queue_counter.album_names
+        random_mode = snapshot.playmode.get('random')
+        if random_mode:
+            playlist_albums = snapshot.playlist_counter.album_names
         for album in albums_not_in_hist:
             # Controls the album found is not already queued
-            if album in {t.Album.name for t in self.player.queue}:
+            if album.name in queued_albums:
                 self.log.debug('"%s" already queued, skipping!', album)
                 continue
             # In random play mode use complete playlist to filter
             # Yes indeed, some users play in random with album mode :|
-            if self.player.playmode.get('random'):
-                if album in {t.Album.name for t in self.player.playlist}:
+            if random_mode:
+                if album.name in playlist_albums:
                     self.log.debug('"%s" already in playlist, skipping!',
                                    album)
                     continue
@@ -198,45 +205,61 @@ class AdvancedPlugin(Plugin):
                       self.__class__.__name__, artist, album_to_queue)
         return album_to_queue
 
-    def filter_track(self, tracks, chosen=None, unplayed=False):
+    def filter_track(self, tracks, chosen=None):
         """
-        Extract one unplayed track from a Track object list.
+        Extract one unplayed track from tracks, picked at random.
             * not in history
             * not already in the queue
 
-        :param list(Track) tracks: List of tracks to chose from
+        Tracks are consumed once, lazily, they can be a generator as
+        returned by :py:meth:`sima.mpdclient.MPD.iter_tracks`.
+
+        :param iterable(Track) tracks: Tracks to chose from
         :param list(Track) chosen: List of tracks previously chosen
-        :param bool unplayed: chose only unplayed (honoring history duration setting)
         :return: A Track
         :rtype: Track
         """
-        artist = tracks[0].Artist
+        # Player state first, MPD is busy while tracks are iterated
+        snapshot = self.player.snapshot
+        tracks = iter(tracks)
+        first = next(tracks, None)
+        if first is None:
+            return None
+        artist = first.Artist
         # In random play mode use complete playlist to filter
-        if self.player.playmode.get('random'):
-            deny_list = self.player.playlist
-        else:
-            deny_list = self.player.queue
-        not_in_hist = list(set(tracks) - set(self.sdb.fetch_history(artist=artist)))
-        if not not_in_hist:
-            self.log.debug('All tracks already played for "%s"', artist)
-            if unplayed:
-                return None
-        random.shuffle(not_in_hist)
-        candidates = []
-        for trk in [_ for _ in not_in_hist if _ not in deny_list]:
+        deny = snapshot.deny_counter
+        history = set(self.sdb.fetch_history(artist=artist))
+        single_album = self.plugin_conf.getboolean('single_album', False)  # pylint: disable=no-member
+        if single_album:
+            albums = [tr.Album for tr in chosen or []]
+            album_names = deny.album_names
+            album_mbids = deny.album_mbids
+        not_in_hist = 0
+        candidates = 0
+        choice = None
+        for trk in chain([first], tracks):
+            if trk in history:
+                continue
+            not_in_hist += 1
+            if trk.file in deny.files:
+                continue
             # Should use albumartist heuristic as well
-            if self.plugin_conf.getboolean('single_album', False):  # pylint: disable=no-member
-                albums = [tr.Album for tr in deny_list]
-                albums += [tr.Album for tr in chosen]
-                if (trk.Album == self.player.current.Album or
-                        trk.Album in albums):
+            if single_album:
+                trk_album = trk.Album
+                if (trk_album == snapshot.current.Album or
+                        trk_album.name in album_names or
+                        trk_album.mbid in album_mbids or
+                        trk_album in albums):
                     self.log.debug('Found unplayed track ' +
                                    'but from an album already queued: %s', trk)
                     continue
-            candidates.append(trk)
-        if not candidates:
-            return None
-        return random.choice(candidates)
+            # Reservoir sampling, uniform choice among candidates
+            candidates += 1
+            if random.randrange(candidates) == 0:
+                choice = trk
+        if not not_in_hist:
+            self.log.debug('All tracks already played for "%s"', artist)
+        return choice
 
 # VIM MODLINE
 # vim: ai ts=4 sw=4 sts=4 expandtab
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-# Copyright (c) 2009-2014, 2021 kaliko <kaliko@azylum.org>
+# Copyright (c) 2009-2014, 2021, 2024 kaliko <kaliko@azylum.org>
 #
 #   This program is free software: you can redistribute it and/or modify
 #   it under the terms of the GNU General Public License as published by
@@ -21,39 +21,75 @@
 Consume Last.fm web service
 """
 
-__version__ = '0.5.2'
+__version__ = '0.7.0'
 __author__ = 'Jack Kaliko'
 
 
+from urllib.parse import parse_qs, urlsplit
+
 from sima import LFM
 from sima.lib.meta import Artist
 from sima.lib.track import Track
 
+from sima.lib.cache import NegativeCache
 from sima.lib.http import HttpClient
-from sima.utils.utils import WSError, WSNotFound
+from sima.utils.utils import WSError, WSNotFound, WSInvalidAnswer
 from sima.utils.utils import getws
 if len(LFM.get('apikey')) == 43:  # simple hack allowing imp.reload
     getws(LFM)
 
+#: Cached records schemas, bump version on records layout changes
+SIMILAR_RECORD = 'lastfm.similar/1'
+"""Similar artists records, (name, mbid, match) rows"""
+TOPTRACK_RECORD = 'lastfm.toptrack/2'
+"""Top tracks records, (title, mbid, playcount, duration) rows"""
+
 
 class SimaFM:
     """Last.fm http client
     """
     root_url = 'http://{host}/{version}/'.format(**LFM)
     name = 'Last.fm'
-    cache = False
+    cache = None
     """HTTP cache to use, in memory or persitent.
 
-    :param BaseCache cache: Set a cache, defaults to `False`.
+    :param BaseCache cache: Set a cache, defaults to `None`, clients then
+                            use their own :py:class:`sima.lib.cache.DictCache`.
+    """
+    negative = NegativeCache()
+    """Not found, malformed and empty answers per method and artist,
+    disabled (no ttl) by default.
+
+    :param NegativeCache negative: Set a negative cache.
     """
     stats = {'etag': 0,
              'ccontrol': 0,
-             'total': 0}
+             'total': 0,
+             'coalesced': 0,  # concurrent identical requests
+             'stale': 0,  # served while revalidated
+             'stale_if_error': 0,
+             'negative': 0,  # answers from the negative cache
+             # TieredCache lookups
+             'l1_hit': 0,
+             'l1_miss': 0,
+             'l2_hit': 0,
+             'l2_miss': 0}
 
     def __init__(self):
         self.http = HttpClient(cache=self.cache, stats=self.stats)
         self.artist = None
 
+    @staticmethod
+    def request_artist(url):
+        """Artist a request URL was forged for (cf. :py:meth:`_forge_payload`)
+
+        :param str url: request URL, ie. HTTP cache key
+        :return: (name, mbid), None for missing values
+        """
+        query = parse_qs(urlsplit(url).query)
+        return (query.get('artist', [None])[0],
+                query.get('mbid', [None])[0])
+
     def _controls_answer(self, ans):
         """Controls answer.
         """
@@ -65,6 +101,43 @@ class SimaFM:
             raise WSError(mess)
         return True
 
+    def _json(self, ans):
+        """Parse and control answer"""
+        try:
+            data = ans.json()
+        except ValueError as err:
+            # Corrupted/malformed cache? cf. gitlab issue #35
+            raise WSInvalidAnswer(f'Malformed json, try purging the cache: {err}') from err
+        self._controls_answer(data)
+        return data
+
+    def _similar_record(self, ans):
+        # Artist might be found but return no 'artist' list…
+        # cf. "Mulatu Astatqe" vs. "Mulatu Astatqé" with autocorrect=0
+        # json format is broken IMHO, xml is more consistent IIRC
+        # Here what we got:
+        # >>> {"similarartists":{"#text":"\n","artist":"Mulatu Astatqe"}}
+        # autocorrect=1 should fix it, checking anyway.
+        simarts = self._json(ans).get('similarartists').get('artist')
+        if not isinstance(simarts, list):
+            raise WSInvalidAnswer('Artist found but no similarities returned')
+        try:
+            return tuple((art.get('name'), art.get('mbid'),
+                          float(art.get('match', 0))) for art in simarts)
+        except (TypeError, ValueError) as err:
+            raise WSInvalidAnswer(f'Malformed similar artist: {err}') from err
+
+    def _toptrack_record(self, ans):
+        tops = self._json(ans).get('toptracks', {}).get('track')
+        if not isinstance(tops, list):
+            raise WSInvalidAnswer('Artist found but no top tracks returned')
+        try:
+            return tuple((song.get('name'), song.get('mbid'),
+                          int(song.get('playcount', 0)),
+                          int(song.get('duration') or 0)) for song in tops)
+        except (TypeError, ValueError) as err:
+            raise WSInvalidAnswer(f'Malformed top track: {err}') from err
+
     def _forge_payload(self, artist, method='similar', track=None):
         """Build payload
         """
@@ -90,6 +163,30 @@ class SimaFM:
         # return a sorted list of 2-tuple to have consistent cache
         return sorted(payload.items(), key=lambda param: param[0])
 
+    def _request(self, artist, payload, record):
+        """Request the web service unless a negative answer is known for
+        artist, not found, malformed and empty answers are remembered.
+
+        :return: record rows
+        """
+        key = (dict(payload).get('method'), artist.mbid or artist.name.casefold())
+        try:
+            rows = self.negative.get(key)
+        except WSError:
+            self.stats.update(negative=self.stats.get('negative')+1)
+            raise
+        if rows is not None:
+            self.stats.update(negative=self.stats.get('negative')+1)
+            return rows
+        try:
+            rows = self.http(self.root_url, payload, record=record)
+        except (WSNotFound, WSInvalidAnswer) as err:
+            self.negative.set(key, err)
+            raise
+        if not rows:
+            self.negative.set(key, rows)
+        return rows
+
     def get_similar(self, artist):
         """Fetch similar artists
 
@@ -98,24 +195,10 @@ class SimaFM:
         """
         payload = self._forge_payload(artist)
         # Construct URL
-        ans = self.http(self.root_url, payload)
-        try:
-            ans.json()
-        except ValueError as err:
-            # Corrupted/malformed cache? cf. gitlab issue #35
-            raise WSError('Malformed json, try purging the cache: %s') from err
-        self._controls_answer(ans.json())  # pylint: disable=no-member
-        # Artist might be found but return no 'artist' list…
-        # cf. "Mulatu Astatqe" vs. "Mulatu Astatqé" with autocorrect=0
-        # json format is broken IMHO, xml is more consistent IIRC
-        # Here what we got:
-        # >>> {"similarartists":{"#text":"\n","artist":"Mulatu Astatqe"}}
-        # autocorrect=1 should fix it, checking anyway.
-        simarts = ans.json().get('similarartists').get('artist')  # pylint: disable=no-member
-        if not isinstance(simarts, list):
-            raise WSError('Artist found but no similarities returned')
-        for art in ans.json().get('similarartists').get('artist'):  # pylint: disable=no-member
-            yield Artist(name=art.get('name'), mbid=art.get('mbid', None))
+        simarts = self._request(artist, payload,
+                                (SIMILAR_RECORD, self._similar_record))
+        for name, mbid, _ in simarts:
+            yield Artist(name=name, mbid=mbid)
 
     def get_toptrack(self, artist):
         """Fetch artist top tracks
@@ -124,20 +207,12 @@ class SimaFM:
         :returns: generator of :class:`sima.lib.track.Track`
         """
         payload = self._forge_payload(artist, method='top')
-        ans = self.http(self.root_url, payload)
-        self._controls_answer(ans.json())  # pylint: disable=no-member
-        tops = ans.json().get('toptracks').get('track')  # pylint: disable=no-member
-        art = {'artist': artist.name,
-               'musicbrainz_artistid': artist.mbid,}
-        for song in tops:
-            for key in ['artist', 'streamable', 'listeners',
-                        'url', 'image', '@attr']:
-                if key in song:
-                    song.pop(key)
-            song.update(art)
-            song.update(title=song.pop('name'))
-            song.update(time=song.pop('duration', 0))
-            yield Track(**song)
+        tops = self._request(artist, payload,
+                             (TOPTRACK_RECORD, self._toptrack_record))
+        for title, mbid, playcount, duration in tops:
+            yield Track(title=title, mbid=mbid, playcount=playcount,
+                        time=duration, duration=duration, artist=artist.name,
+                        musicbrainz_artistid=artist.mbid)
 
 # VIM MODLINE
 # vim: ai ts=4 sw=4 sts=4 expandtab
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 #
-# Copyright (c) 2009, 2010, 2013, 2021 kaliko <kaliko@azylum.org>
+# Copyright (c) 2009, 2010, 2013, 2021, 2024 kaliko <kaliko@azylum.org>
 #
 #  This program is free software; you can redistribute it and/or modify
 #  it under the terms of the GNU General Public License as
@@ -65,13 +65,17 @@ TODO:
 """
 
 __author__ = 'Jack Kaliko'
-__version__ = '0.4'
+__version__ = '0.5'
 
 # IMPORTS
 import unicodedata
+from functools import lru_cache
 from re import compile as re_compile, U, I
 
-from ..utils.leven import levenshtein_ratio
+from ..utils.leven import levenshtein_ratio_bounded
+
+#: Size of the normalized strings cache, cf. :py:func:`normalize`
+NORMALIZE_CACHE_SIZE = 8192
 
 
 class SimaStr(str):
@@ -104,11 +108,8 @@ class SimaStr(str):
         """
         super().__init__()
         self.orig = str(fuzzstr)
-        self.stripped = str(fuzzstr.strip())
         # fuzzy computation
-        self._get_root()
-        if self.__class__.diafilter:
-            self.remove_diacritics()
+        self.stripped = normalize(self.orig, self.__class__.diafilter)
 
     def __new__(cls, fuzzstr):
         return super(SimaStr, cls).__new__(cls, fuzzstr)
@@ -117,42 +118,97 @@ class SimaStr(str):
         """
         Remove all patterns in string.
         """
-        sea = SimaStr.reg_lead.search(self.stripped)
-        if sea:
-            self.stripped = sea.group('root0')
-
-        sea = SimaStr.reg_midl.search(self.stripped)
-        if sea:
-            self.stripped = str().join([sea.group('root0'), ' ',
-                                        sea.group('root1')])
-
-        sea = SimaStr.reg_trail.search(self.stripped)
-        if sea:
-            self.stripped = sea.group('root0')
+        self.stripped = _get_root(self.stripped)
 
     def remove_diacritics(self):
         """converting diacritics"""
-        self.stripped = ''.join(x for x in
-                                unicodedata.normalize('NFKD', self.stripped)
-                                if unicodedata.category(x) != 'Mn')
+        self.stripped = _remove_diacritics(self.stripped)
 
     def __hash__(self):
         return hash(self.stripped)
 
     def __eq__(self, other):
-        if not isinstance(other, SimaStr):
-            other = SimaStr(other)
-        levenr = levenshtein_ratio(self.stripped.lower(),
-                                   other.stripped.lower())
-        if hash(self) == hash(other):
-            return True
-        return levenr >= self.__class__.leven_ratio
+        if isinstance(other, SimaStr):
+            other = other.stripped
+        else:
+            other = normalize(str(other), self.__class__.diafilter)
+        return self._match(other)
 
     def __ne__(self, other):
         if not isinstance(other, SimaStr):
-            return hash(self) != hash(SimaStr(other))
+            return hash(self) != hash(normalize(str(other), self.__class__.diafilter))
         return hash(self) != hash(other)
 
+    def _match(self, stripped, lowered=None):
+        if hash(self) == hash(stripped):
+            return True
+        levenr = levenshtein_ratio_bounded(self.stripped.lower(),
+                                           lowered or stripped.lower(),
+                                           self.__class__.leven_ratio)
+        return levenr is not None and levenr >= self.__class__.leven_ratio
+
+    @classmethod
+    def keys(cls, strings):
+        """Precompute comparison keys for :py:meth:`matches`
+
+        :param list(str) strings: strings to compare with
+        :return: list of (normalized, lowercased normalized) tuples
+        """
+        keys = []
+        for string in strings:
+            stripped = normalize(str(string), cls.diafilter)
+            keys.append((stripped, stripped.lower()))
+        return keys
+
+    def matches(self, strings, keys=None):
+        """Strings equal to this one (in SimaStr sense)
+
+            >>> SimaStr('The Doors').matches(['Doors', 'Dolls'])
+            >>> ['Doors']
+
+        :param list(str) strings: strings to compare with
+        :param list keys: precomputed :py:meth:`keys` for strings
+        :return: list of matching strings, in the same order
+        """
+        if keys is None:
+            keys = self.keys(strings)
+        return [string for string, (stripped, lowered) in zip(strings, keys)
+                if self._match(stripped, lowered)]
+
+
+def _get_root(stripped):
+    sea = SimaStr.reg_lead.search(stripped)
+    if sea:
+        stripped = sea.group('root0')
+    sea = SimaStr.reg_midl.search(stripped)
+    if sea:
+        stripped = str().join([sea.group('root0'), ' ',
+                               sea.group('root1')])
+    sea = SimaStr.reg_trail.search(stripped)
+    if sea:
+        stripped = sea.group('root0')
+    return stripped
+
+
+def _remove_diacritics(stripped):
+    return ''.join(x for x in unicodedata.normalize('NFKD', stripped)
+                   if unicodedata.category(x) != 'Mn')
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize(fuzzstr, diafilter=True):
+    """Strip known patterns and (optionally) diacritics off a string, results
+    are cached.
+
+    :param str fuzzstr: string to normalize
+    :param bool diafilter: remove diacritics
+    :return: normalized string, cf. :py:attr:`SimaStr.stripped`
+    """
+    stripped = _get_root(fuzzstr.strip())
+    if diafilter:
+        stripped = _remove_diacritics(stripped)
+    return stripped
+
 
 # VIM MODLINE
 # vim: ai ts=4 sw=4 sts=4 expandtab
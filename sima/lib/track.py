@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-# Copyright (c) 2009-2021 kaliko <kaliko@azylum.org>
+# Copyright (c) 2009-2021, 2024 kaliko <kaliko@azylum.org>
 # Copyright (c) 2009 J. Alexander Treuman (Tag collapse method)
 # Copyright (c) 2008 Rick van Hattem
 #
@@ -31,12 +31,28 @@ class Track:
     Track object.
     Instantiate with Player replies.
 
+    Common tags are stored in slots, any other tag ends up in the :attr:`extra`
+    dict and is still available as an attribute. Tracks are not meant to be
+    modified once instantiated, :attr:`Artist` and :attr:`Album` are cached.
+
     :param str file: media file, defaults to ``None``
     :param int duration: duration in second, defaults to 0
     :param int pos: position in queue, defaults to -1
     :param str title|artist|album|albumartist: defaults to ""
     :param str musicbrainz_{artistid|albumartistid|albumid|trackid}: MusicBrainz IDs, defaults to ``None``
     """
+    #: Multi-valued tags collapsed into a single string using SEPARATOR
+    tags_to_collapse = frozenset(['artist', 'album', 'title', 'date',
+                                  'genre', 'albumartist',
+                                  'musicbrainz_artistid',
+                                  'musicbrainz_albumartistid'])
+    #: Tags stored in slots, no default value for date, track, time and id
+    known_tags = frozenset(['title', 'artist', 'album', 'albumartist', 'genre',
+                            'date', 'track', 'time', 'id',
+                            'musicbrainz_artistid', 'musicbrainz_albumartistid',
+                            'musicbrainz_albumid', 'musicbrainz_trackid'])
+    __slots__ = ('_file', '_empty', 'pos', 'duration', 'collapsed_tags',
+                 'extra', '_artist', '_album', *sorted(known_tags))
 
     def __init__(self, file=None, duration=0, pos=-1, **kwargs):
         self.title = self.artist = self.album = self.albumartist = self.genre = ''
@@ -44,31 +60,29 @@ class Track:
         self.musicbrainz_albumid = self.musicbrainz_trackid = None
         self.pos = int(pos)
         self._file = file
-        self._empty = False
+        self._empty = not kwargs
         self.duration = float(duration)
-        if not kwargs:
-            self._empty = True
-        self.__dict__.update(**kwargs)
-        self.tags_to_collapse = ['artist', 'album', 'title', 'date',
-                                 'genre', 'albumartist',
-                                 'musicbrainz_artistid',
-                                 'musicbrainz_albumartistid']
+        self._artist = self._album = None
         # Which tags have been collapsed?
         self.collapsed_tags = []
-        # Needed for multiple tags which returns a list instead of a string
-        self._collapse_tags()
-
-    def _collapse_tags(self):
-        """
-        Necessary to deal with tags defined multiple times.
-        These entries are set as lists instead of strings.
-        """
-        for tag, value in self.__dict__.items():
-            if tag not in self.tags_to_collapse:
+        self.extra = {}
+        for tag, value in kwargs.items():
+            if tag not in Track.known_tags:
+                self.extra[tag] = value
                 continue
-            if isinstance(value, list):
+            # Needed for multiple tags which returns a list instead of a string
+            if tag in Track.tags_to_collapse and isinstance(value, list):
                 self.collapsed_tags.append(tag)
-                self.__dict__.update({tag: SEPARATOR.join(value)})
+                value = SEPARATOR.join(value)
+            setattr(self, tag, value)
+
+    def __getattr__(self, name):
+        # Only called for rare tags (or known tags without default value)
+        try:
+            return object.__getattribute__(self, 'extra')[name]
+        except (AttributeError, KeyError):
+            raise AttributeError(f"'{self.__class__.__name__}' object "
+                                 f"has no attribute '{name}'") from None
 
     def __repr__(self):
         return '%s(artist="%s", album="%s", title="%s", file="%s")' % (
@@ -80,10 +94,7 @@ class Track:
         )
 
     def __str__(self):
-        return '{artist} - {album} - {title} ({length})'.format(
-            length=self.length,
-            **self.__dict__
-        )
+        return f'{self.artist} - {self.album} - {self.title} ({self.length})'
 
     def __int__(self):
         return int(self.duration)
@@ -110,6 +121,14 @@ class Track:
             return False
         return not self._empty
 
+    @property
+    def tags(self):
+        """All tags as a dict (but file, pos and duration)"""
+        tags = {tag: getattr(self, tag) for tag in Track.known_tags
+                if hasattr(self, tag)}
+        tags.update(self.extra)
+        return tags
+
     @property
     def file(self):
         """file is an immutable attribute that's used for the hash method"""
@@ -145,19 +164,30 @@ class Track:
     @property
     def Artist(self):
         """Get the :class:`sima.lib.meta.Artist` associated to this track"""
+        if self._artist is not None:
+            return self._artist
         if not self.artist:
             if not self.musicbrainz_artistid:
-                return Artist(name='[unknown]',
-                              mbid='125ec42a-7229-4250-afc5-e057484327fe')
-            return Artist(name='[unknown]', **self.__dict__)
-        return Artist(**self.__dict__)
+                self._artist = Artist(name='[unknown]',
+                                      mbid='125ec42a-7229-4250-afc5-e057484327fe')
+            else:
+                self._artist = Artist(name='[unknown]',
+                                      musicbrainz_artistid=self.musicbrainz_artistid,
+                                      albumartist=self.albumartist)
+        else:
+            self._artist = Artist(artist=self.artist,
+                                  musicbrainz_artistid=self.musicbrainz_artistid,
+                                  albumartist=self.albumartist)
+        return self._artist
 
     @property
     def Album(self):
         """Get the :class:`sima.lib.meta.Album` associated to this track"""
-        if not self.album:
-            return Album(name='[unknown]', **self.__dict__)
-        return Album(name=self.album, **self.__dict__)
+        if self._album is None:
+            tags = self.tags
+            tags.pop('album')
+            self._album = Album(name=self.album or '[unknown]', **tags)
+        return self._album
 
 # VIM MODLINE
 # vim: ai ts=4 sw=4 sts=4 expandtab
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright (c) 2009-2021 kaliko <kaliko@azylum.org>
+# Copyright (c) 2009-2021, 2024 kaliko <kaliko@azylum.org>
 # Copyright (c) 2019 sacha <sachahony@gmail.com>
 #
 #  This file is part of sima
@@ -26,7 +26,9 @@ Fetching similar artists from last.fm web services
 import random
 
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import md5
+from threading import local
 
 # third parties components
 
@@ -35,6 +37,9 @@ from .plugin import AdvancedPlugin
 from .meta import Artist, MetaContainer
 from ..utils.utils import WSError, WSNotFound, WSTimeout
 
+#: Threads fetching similar artists concurrently (recursive lookups)
+WS_WORKERS = 4
+
 
 def cache(func):
     """Caching decorator"""
@@ -70,7 +75,8 @@ class WebService(AdvancedPlugin):
                    'album': self._album}
         self.queue_mode = wrapper.get(self.plugin_conf.get('queue_mode'))
         self.ws = None
-        self.ws_retry = 0
+        self._executor = None
+        self._local = local()
 
     def _flush_cache(self):
         """
@@ -102,6 +108,7 @@ class WebService(AdvancedPlugin):
         if dynamic <= 0:
             dynamic = 100
         results = []
+        self.player.prefetch_artists(similarities)
         similarities.reverse()
         while (len(results) < dynamic+1 and similarities):
             art_pop = similarities.pop()
@@ -110,14 +117,18 @@ class WebService(AdvancedPlugin):
                 results.append(res)
         return results
 
-    def ws_similar_artists(self, artist):
+    def ws_similar_artists(self, artist, ws=None, retry=0):
         """
         Retrieve similar artists from WebServive.
+
+        :param ws: web service client, defaults to self.ws
+        :param int retry: attempts already made after timeouts
         """
+        ws = ws or self.ws
         # initialize artists deque list to construct from DB
         as_art = deque()
-        as_artists = self.ws.get_similar(artist=artist)
-        self.log.debug('Requesting %s for %r', self.ws.name, artist)
+        as_artists = ws.get_similar(artist=artist)
+        self.log.debug('Requesting %s for %r', ws.name, artist)
         try:
             [as_art.append(art) for art in as_artists]
         except WSNotFound as err:
@@ -125,35 +136,57 @@ class WebService(AdvancedPlugin):
             if artist.mbid:
                 self.log.info('Trying without MusicBrainzID')
                 try:
-                    return self.ws_similar_artists(Artist(name=artist.name))
+                    return self.ws_similar_artists(Artist(name=artist.name), ws)
                 except WSNotFound as err:
                     self.log.debug('%s: %s', self.ws.name, err)
         except WSTimeout as err:
             self.log.warning('%s: %s', self.ws.name, err)
-            if self.ws_retry < 3:
-                self.ws_retry += 1
+            if retry < 3:
                 self.log.warning('%s: retrying', self.ws.name)
-                as_art = self.ws_similar_artists(artist)
+                as_art = self.ws_similar_artists(artist, ws, retry + 1)
             else:
                 self.log.warning('%s: stop retrying', self.ws.name)
-            self.ws_retry = 0
         except WSError as err:
             self.log.warning('%s: %s', self.ws.name, err)
         if as_art:
             self.log.debug('Fetched %d artist(s)', len(as_art))
         return as_art
 
+    def _thread_similar_artists(self, artist):
+        """Runs in executor threads, each one with its own web service
+        client (clients are not thread safe, caches and stats are shared)"""
+        if not hasattr(self._local, 'ws'):
+            self._local.ws = type(self.ws)()
+        return self.ws_similar_artists(artist, self._local.ws)
+
+    def ws_similar_artists_many(self, artists):
+        """Fetch similar artists for several artists, concurrently within
+        the web service client rate limiter.
+
+        :param list(Artist) artists: artists to fetch similar artists from
+        :return: similar artists lists, in artists order
+        """
+        if len(artists) < 2:
+            return [self.ws_similar_artists(artist) for artist in artists]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=WS_WORKERS,
+                                                thread_name_prefix='ws')
+        futures = [self._executor.submit(self._thread_similar_artists, artist)
+                   for artist in artists]
+        return [future.result() for future in futures]
+
     def get_recursive_similar_artist(self):
         """Check against local player for similar artists (recursive w/ history)
         """
-        if not self.player.playlist:
+        snapshot = self.player.snapshot
+        if not snapshot.playlist:
             return []
         history = list(self.history)
         # In random play mode use complete playlist to filter
-        if self.player.playmode.get('random'):
-            history = self.player.playlist + history
+        if snapshot.playmode.get('random'):
+            history = list(snapshot.playlist) + history
         else:
-            history = self.player.queue + history
+            history = snapshot.queue + history
         history = deque(history)
         last_trk = history.popleft()  # remove
         extra_arts = []
@@ -168,11 +201,14 @@ class WebService(AdvancedPlugin):
                 continue
             extra_arts.append(trk.Artist)
             depth += 1
-        self.log.debug('EXTRA ARTS: %s', '/'.join(map(str, extra_arts)))
-        for artist in extra_arts:
-            self.log.debug('Looking for artist similar '
-                           'to "%s" as well', artist)
-            similar = self.ws_similar_artists(artist=artist)
+        self.log.debug('Looking for artists similar to "%s" as well',
+                       '/'.join(map(str, extra_arts)))
+        similars = self.ws_similar_artists_many(extra_arts)
+        # Library lookups share the player connection, they are run in
+        # order. Fuzzy matches are computed at once for all of them.
+        self.player.prefetch_artists([art for similar in similars
+                                      for art in similar])
+        for similar in similars:
             if not similar:
                 continue
             ret_extra.extend(self.get_artists_from_player(similar))
@@ -187,9 +223,10 @@ class WebService(AdvancedPlugin):
     def get_local_similar_artists(self):
         """Check against local player for similar artists
         """
-        if not self.player.playlist:
+        snapshot = self.player.snapshot
+        if not snapshot.playlist:
             return []
-        tolookfor = self.player.playlist[-1].Artist
+        tolookfor = snapshot.playlist[-1].Artist
         self.log.info('Looking for artist similar to "%s"', tolookfor)
         self.log.debug('%r', tolookfor)
         similar = self.ws_similar_artists(tolookfor)
@@ -223,19 +260,15 @@ class WebService(AdvancedPlugin):
             self.log.warning('Got nothing from music library.')
             return []
         # In random play mode use complete playlist to filter
-        if self.player.playmode.get('random'):
-            queued_artists = MetaContainer([trk.Artist for trk
-                                            in self.player.playlist])
-        else:
-            queued_artists = MetaContainer([trk.Artist for trk
-                                            in self.player.queue])
+        queued_artists = MetaContainer([Artist(name=name, mbid=mbid) for
+                                        name, mbid in snapshot.deny_counter.artists])
         self.log.trace('Already queued: %s', queued_artists)
         self.log.trace('Candidate: %s', ret)
         if ret & queued_artists:
             self.log.debug('Removing already queued artists: '
                            '%s', '/'.join(map(str, ret & queued_artists)))
             ret = ret - queued_artists
-        current = self.player.current
+        current = snapshot.current
         if current and current.Artist in ret:
             self.log.debug('Removing current artist: %s', current.Artist)
             ret = ret - MetaContainer([current.Artist])
@@ -309,14 +342,12 @@ class WebService(AdvancedPlugin):
         nbtracks_target = self.plugin_conf.getint('track_to_add')
         for artist in artists:
             self.log.debug('Trying to find titles to add for "%r"', artist)
-            found = self.player.find_tracks(artist)
-            if not found:
-                self.log.debug('Found nothing to queue for %s', artist)
-                continue
-            random.shuffle(found)
             # find tracks not in history for artist
-            track_candidate = self.filter_track(found, to_add)
-            if track_candidate:
+            track_candidate = self.filter_track(
+                    self.player.iter_tracks(artist), to_add)
+            if not track_candidate:
+                self.log.debug('Found nothing to queue for %s', artist)
+            else:
                 to_add.append(track_candidate)
                 self.log.info('%s plugin chose: %s',
                               self.ws.name, track_candidate)
@@ -345,17 +376,20 @@ class WebService(AdvancedPlugin):
 
     def callback_need_track(self):
         self._cleanup_cache()
-        if not self.player.playlist:
+        snapshot = self.player.snapshot
+        if not snapshot.playlist:
             self.log.info('No last track, cannot queue')
             return None
-        if not self.player.playlist[-1].artist:
+        if not snapshot.playlist[-1].artist:
             self.log.warning('No artist set for the last track in queue')
-            self.log.debug(repr(self.player.current))
+            self.log.debug(repr(snapshot.current))
             return None
         candidates = self.queue_mode()
         msg = ' '.join([f'{k}: {v:>3d}' for
                         k, v in sorted(self.ws.stats.items())])
         self.log.debug('http stats: ' + msg)
+        if getattr(self.ws.cache, 'codec', None):
+            self.log.debug('http cache codec %s', self.ws.cache.codec.report())
         if not candidates:
             self.log.info('%s plugin found nothing to queue', self.ws.name)
         if self.plugin_conf.get('queue_mode') != 'album':
@@ -365,5 +399,10 @@ class WebService(AdvancedPlugin):
     def callback_player_database(self):
         self._flush_cache()
 
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
 # VIM MODLINE
 # vim: ai ts=4 sw=4 sts=4 expandtab
@@ -17,9 +17,11 @@
 #  along with sima.  If not, see <http://www.gnu.org/licenses/>.
 
 # standard library import
+from collections import Counter
 from difflib import get_close_matches
 from functools import wraps
 from logging import getLogger
+from random import randrange, sample
 from select import select
 
 # external module
@@ -27,12 +29,18 @@ from musicpd import MPDClient, MPDError as PlayerError
 
 
 # local import
-from .lib.meta import Meta, Artist, Album
+from .lib.meta import Meta, Artist, Album, SEPARATOR
+from .lib.mpdfilter import FILTERS_VERSION, tag_filter, all_of, any_of
+from .lib.mpdfilter import blocklist_filter
 from .lib.track import Track
 from .lib.simastr import SimaStr
-from .utils.leven import levenshtein_ratio
+from .utils.leven import levenshtein_ratio_bounded, close_matches
+from .utils.matcher import ShardedMatcher
 from .utils.utils import get_decorator
 
+#: Prefetched close matches kept, cf. MPD.prefetch_artists
+PREFETCH_MAX = 1000
+
 
 # Some decorators
 def bl_artist(func):
@@ -59,9 +67,7 @@ def set_artist_mbid(func):
         if Meta.use_mbid:
             if result and not result.mbid:
                 mbid = cls._find_musicbrainz_artistid(result)
-                artist = Artist(name=result.name, mbid=mbid)
-                artist.add_alias(result)
-                return artist
+                return Artist(name=result.name, mbid=mbid).with_alias(result)
         return result
     return wrapper
 
@@ -83,6 +89,204 @@ we = get_decorator(errors=(OSError, TimeoutError), wrap_into=PlayerError)
 # / decorators
 
 
+class TrackCounter:
+    """Counts files, artists and albums of a track collection.
+
+    Artists and albums are counted as ``(name, mbid)`` tuples, the name is
+    the first value of a multi-valued tag as in :py:class:`sima.lib.meta.Meta`.
+
+    :param iterable tracks: Track objects to count
+    """
+
+    def __init__(self, tracks=()):
+        self.files = Counter()
+        self.artists = Counter()
+        self.albums = Counter()
+        for trk in tracks:
+            self.add(trk)
+
+    @staticmethod
+    def _keys(trk):
+        artist = album = None
+        if trk.artist:
+            mbid = (trk.musicbrainz_artistid or '').lower()
+            artist = (trk.artist.split(SEPARATOR)[0],
+                      mbid.split(SEPARATOR)[0] or None)
+        if trk.album:
+            album = (trk.album.split(SEPARATOR)[0],
+                     (trk.musicbrainz_albumid or '').lower() or None)
+        return trk.file, artist, album
+
+    def _update(self, trk, incr):
+        for counter, key in zip((self.files, self.artists, self.albums),
+                                self._keys(trk)):
+            if key is None:
+                continue
+            counter[key] += incr
+            if counter[key] <= 0:
+                del counter[key]
+
+    def copy(self):
+        """Independent copy of the counters"""
+        other = TrackCounter()
+        other.files = self.files.copy()
+        other.artists = self.artists.copy()
+        other.albums = self.albums.copy()
+        return other
+
+    def add(self, trk):
+        """Count a track in"""
+        self._update(trk, 1)
+
+    def remove(self, trk):
+        """Count a track out"""
+        self._update(trk, -1)
+
+    @property
+    def album_names(self):
+        """Set of albums names"""
+        return {name for name, _ in self.albums}
+
+    @property
+    def album_mbids(self):
+        """Set of albums MusicBrainz IDs"""
+        return {mbid for _, mbid in self.albums if mbid}
+
+
+class PlaylistModel:
+    """Local copy of the player queue kept up to date with MPD plchanges.
+
+    :py:attr:`version` is the playlist version the model is in sync with,
+    :py:obj:`None` when it needs a complete reload.
+
+    :py:attr:`tracks` and :py:attr:`counter` are replaced, never modified,
+    when the playlist changes, they can be handed out as is.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.tracks = ()
+        self.counter = TrackCounter()
+
+    def clear(self):
+        """Forget everything, next update must be a complete playlist"""
+        self.version = None
+        self.tracks = ()
+        self.counter = TrackCounter()
+
+    def update(self, version, length, changes):
+        """Apply plchanges output
+
+        :param int version: playlist version as found in MPD status
+        :param int length: playlist length as found in MPD status
+        :param list(Track) changes: tracks returned by plchanges
+        :return: False when changes cannot be applied, the model is then cleared
+        """
+        if self.version is not None and version < self.version:
+            self.clear()
+            return False
+        if not changes and length == len(self.tracks):
+            self.version = version
+            return True
+        tracks = list(self.tracks)
+        counter = self.counter.copy()
+        for trk in tracks[length:]:
+            counter.remove(trk)
+        del tracks[length:]
+        for trk in changes:
+            if trk.pos < len(tracks):
+                counter.remove(tracks[trk.pos])
+                tracks[trk.pos] = trk
+            elif trk.pos == len(tracks):
+                tracks.append(trk)
+            else:  # missing positions, out of sync
+                self.clear()
+                return False
+            counter.add(trk)
+        if len(tracks) != length:
+            self.clear()
+            return False
+        self.tracks = tuple(tracks)
+        self.counter = counter
+        self.version = version
+        return True
+
+
+class Snapshot:
+    """Player state at a given time: MPD status, current song and playlist.
+
+    The three of them are fetched in a single command list by
+    :py:attr:`MPD.snapshot`, it is then shared by core and plugins for the
+    rest of the loop iteration. It is a point-in-time view, later
+    playlist synchronisations leave it untouched.
+
+    :param dict status: MPD status as returned by MPDClient
+    :param Track current: current song
+    :param list(Track) playlist: player queue content
+    :param TrackCounter counter: playlist counters, computed when missing
+    """
+
+    def __init__(self, status, current, playlist, counter=None):
+        self.status = status
+        self.current = current
+        self.playlist = playlist
+        self._counter = counter
+        self._queue = None
+        self._queue_counter = None
+
+    @property
+    def playmode(self):
+        plm = {'repeat': None, 'single': None,
+               'random': None, 'consume': None, }
+        for key, val in self.status.items():
+            if key in plm:
+                plm.update({key: bool(int(val))})
+        return plm
+
+    @property
+    def queue(self):
+        """Tracks ahead of the current one, in reverse order"""
+        if self._queue is None:
+            curr_position = int(self.current.pos)
+            self._queue = [trk for trk in reversed(self.playlist)
+                           if int(trk.pos) > curr_position]
+        return self._queue
+
+    @property
+    def state(self):
+        """Returns (play|stop|pause)"""
+        return str(self.status.get('state'))
+
+    @property
+    def playlist_counter(self):
+        """:py:class:`TrackCounter` for the complete playlist"""
+        if self._counter is None:
+            self._counter = TrackCounter(self.playlist)
+        return self._counter
+
+    @property
+    def queue_counter(self):
+        """:py:class:`TrackCounter` for the tracks ahead"""
+        if self._queue_counter is None:
+            self._queue_counter = TrackCounter(self.queue)
+        return self._queue_counter
+
+    @property
+    def deny_list(self):
+        """Tracks not to queue again: the complete playlist in random mode,
+        the tracks ahead otherwise"""
+        if self.playmode.get('random'):
+            return self.playlist
+        return self.queue
+
+    @property
+    def deny_counter(self):
+        """:py:class:`TrackCounter` for :py:attr:`deny_list`"""
+        if self.playmode.get('random'):
+            return self.playlist_counter
+        return self.queue_counter
+
+
 class MPD(MPDClient):
     """
     Player instance inheriting from MPDClient (python-musicpd).
@@ -109,6 +313,11 @@ class MPD(MPDClient):
                           'MUSICBRAINZ_ARTISTID', 'MUSICBRAINZ_ALBUMID',
                           'MUSICBRAINZ_ALBUMARTISTID', 'MUSICBRAINZ_TRACKID',
                           'MUSICBRAINZ_RELEASETRACKID', 'MUSICBRAINZ_WORKID'}
+    #: Commands modifying the queue, current snapshot is dropped when used
+    queue_cmds = {'add', 'addid', 'clear', 'delete', 'deleteid', 'move',
+                  'moveid', 'shuffle', 'swap', 'swapid'}
+    #: Number of tracks fetched per command by :py:meth:`iter_find`
+    find_window = 1000
     database = None
 
     def __init__(self, config):
@@ -118,12 +327,28 @@ class MPD(MPDClient):
         self.log = getLogger('sima')
         self.config = config
         self._cache = None
+        self._snapshot = None
+        self._playlist = PlaylistModel()
+        self._close_matches = get_close_matches
+        matcher = config.get('sima', 'fuzzy_matcher', fallback='difflib')
+        if matcher == 'levenshtein':
+            self._close_matches = close_matches
+        elif matcher != 'difflib':
+            self.log.warning('Unknown fuzzy_matcher "%s", using difflib', matcher)
+            matcher = 'difflib'
+        self._matcher = None
+        workers = config.getint('sima', 'fuzzy_workers', fallback=0)
+        if workers > 0:
+            self.log.info('Fuzzy matching artists with %d processes', workers)
+            self._matcher = ShardedMatcher(workers, matcher)
 
     # ######### Overriding MPDClient ###########
     @we
     def __getattr__(self, cmd):
         """Wrapper around MPDClient calls for abstract overriding"""
         track_wrapped = {'currentsong', 'find', 'playlistinfo', }
+        if cmd in MPD.queue_cmds:
+            self._snapshot = None
         if cmd in track_wrapped:
             return tracks_wrapper(super().__getattr__(cmd))
         return super().__getattr__(cmd)
@@ -141,6 +366,8 @@ class MPD(MPDClient):
         port = mpd_config.get('port')
         password = mpd_config.get('password', fallback=None)
         self.disconnect()
+        self._snapshot = None
+        self._playlist.clear()
         super().connect(host, port)
         if password:
             self.password(password)
@@ -150,6 +377,9 @@ class MPD(MPDClient):
             if cmd not in available_cmd:
                 self.disconnect()
                 raise PlayerError(f'Could connect to "{host}", but command "{cmd}" not available')
+        if not self.use_filters:
+            self.log.warning('MPD protocol version: %s < 0.21.0, '
+                             'falling back to multiple queries', self.mpd_version)
         self.tagtypes_clear()
         for tag in MPD.needed_tags:
             self.tagtypes_enable(tag)
@@ -187,6 +417,7 @@ class MPD(MPDClient):
         * artists: all artists
         * nombid_artists: artists with no mbid (set only when self.use_mbid is True)
         * artist_tracks: caching last artist tracks, used in search_track
+        * close_matches: prefetched artists close matches, cf. :py:meth:`prefetch_artists`
         """
         if isinstance(self._cache, dict):
             self.log.info('Player: Flushing cache!')
@@ -197,8 +428,19 @@ class MPD(MPDClient):
                        'artist_tracks': {}}
         self._cache['artists'] = frozenset(filter(None, self.list('artist')))
         if self.use_mbid:
-            artists = self.list('artist', "(MUSICBRAINZ_ARTISTID == '')")
+            artists = self.list('artist', tag_filter('MUSICBRAINZ_ARTISTID', ''))
             self._cache['nombid_artists'] = frozenset(filter(None, artists))
+        self._cache['close_matches'] = {}
+        if self._matcher:  # Workers reload shards only on library changes
+            for key in ('artists', 'nombid_artists'):
+                if self._matcher.load(key, self._cache[key]):
+                    self.log.debug('Player: fuzzy matcher loaded %s', key)
+
+    def shutdown(self):
+        """Release resources not bound to the connection (fuzzy matcher
+        worker processes)"""
+        if self._matcher:
+            self._matcher.shutdown()
 
     def _skipped_track(self, previous):
         if (self.state == 'stop'
@@ -225,6 +467,7 @@ class MPD(MPDClient):
             _read, _, _ = select([self], [], [], select_timeout)
             if _read:  # tries to read response
                 ret = self.fetch_idle()
+                self._snapshot = None
                 if self._skipped_track(curr):
                     ret.append('skipped')
                 if 'database' in ret:
@@ -242,52 +485,113 @@ class MPD(MPDClient):
             self.log.warning('pending commands: %s', self._pending)
 
     @we
-    def add(self, payload):
+    def add(self, payload, position=None):
         """Overriding MPD's add method to accept Track objects
 
+        A list of tracks is sent in a single command list.
+
         :param Track,list payload: Either a single track or a list of it
+        :param int position: Queue position to insert tracks at (uses addid),
+                             defaults to append tracks to the queue
+        :return: list of song ids when position is set
         """
         if isinstance(payload, Track):
-            super().__getattr__('add')(payload.file)
-        elif isinstance(payload, list):
-            self.command_list_ok_begin()
-            map(self.add, payload)
-            self.command_list_end()
-        else:
+            payload = [payload]
+        elif not isinstance(payload, list):
             self.log.error('Cannot add %s', payload)
+            return None
+        if not payload:
+            return []
+        self._snapshot = None
+        self.command_list_ok_begin()
+        for idx, trk in enumerate(payload):
+            if position is None:
+                super().__getattr__('add')(trk.file)
+            else:
+                super().__getattr__('addid')(trk.file, position+idx)
+        ret = self.command_list_end()
+        if position is None:
+            return None
+        return ret
+
+    @we
+    def delete_range(self, start, end):
+        """Delete tracks from start up to end (excluded) in a single command
+
+        :param int start: first position to delete
+        :param int end: position to stop at
+        """
+        if end <= start:
+            return
+        self._snapshot = None
+        super().__getattr__('delete')((start, end))
 
     # ######### Properties #####################
+    @property
+    def version_info(self):
+        """MPD protocol version as a tuple of integers"""
+        return tuple(map(int, self.mpd_version.split('.')))
+
+    @property
+    def use_filters(self):
+        """Does MPD support filter expressions"""
+        return self.version_info >= FILTERS_VERSION
+
+    @property
+    @we
+    def snapshot(self):
+        """Player state shared within a loop iteration, cf. :py:class:`Snapshot`
+
+        Fetches status, currentsong and playlist changes in a single command
+        list. It is dropped on :py:meth:`monitor` events and when the queue
+        is modified through this client.
+
+        The playlist is a local model only updated with MPD plchanges since
+        the last known playlist version.
+        """
+        if self._snapshot is not None:
+            return self._snapshot
+        for _ in range(2):  # second attempt is a complete reload
+            self.command_list_ok_begin()
+            super().__getattr__('status')()
+            super().__getattr__('currentsong')()
+            super().__getattr__('plchanges')(self._playlist.version or 0)
+            status, current, changes = self.command_list_end()
+            if self._playlist.update(int(status.get('playlist', 0)),
+                                     int(status.get('playlistlength', 0)),
+                                     [Track(**trk) for trk in changes]):
+                break
+            self.log.debug('Player: playlist out of sync, reloading')
+        else:
+            raise PlayerError('Failed to synchronise playlist')
+        self._snapshot = Snapshot(status, Track(**current),
+                                  self._playlist.tracks,
+                                  self._playlist.counter)
+        return self._snapshot
+
     @property
     def current(self):
-        return self.currentsong()
+        return self.snapshot.current
 
     @property
     def playlist(self):
         """
         Override deprecated MPD playlist command
         """
-        return self.playlistinfo()
+        return list(self.snapshot.playlist)
 
     @property
     def playmode(self):
-        plm = {'repeat': None, 'single': None,
-               'random': None, 'consume': None, }
-        for key, val in self.status().items():
-            if key in plm:
-                plm.update({key: bool(int(val))})
-        return plm
+        return self.snapshot.playmode
 
     @property
     def queue(self):
-        plst = self.playlist
-        curr_position = int(self.current.pos)
-        plst.reverse()
-        return [trk for trk in plst if int(trk.pos) > curr_position]
+        return list(self.snapshot.queue)
 
     @property
     def state(self):
         """Returns (play|stop|pause)"""
-        return str(self.status().get('state'))
+        return self.snapshot.state
     # ######### / Properties ###################
 
 # #### find_tracks ####
@@ -308,27 +612,45 @@ class MPD(MPDClient):
             return self.find_tracks(Artist(name=what))
         raise PlayerError('Bad input argument')
 
+    def blocklist_filter(self):
+        """Blocklist as a filter expression to attach to MPD queries
+
+        :return: the expression, an empty string when the blocklist is empty
+                 or None when it is not usable, either because MPD does not
+                 support filters or because the blocklist is too large, the
+                 blocklist has to be checked client side then.
+        """
+        if not self.database or not self.use_filters:
+            return None
+        expression = blocklist_filter(self.database.view_bl(), self.use_mbid)
+        if expression is None:
+            self.log.debug('Blocklist too large for a filter expression, '
+                           'filtering client side')
+        return expression
+
     def _find_art(self, artist):
         tracks = set()
         # artist blocklist
         if self.database.get_bl_artist(artist, add=False):
             self.log.info('Artist in blocklist: %s', artist)
             return []
-        if artist.mbid:
-            tracks |= set(self.find('musicbrainz_artistid', artist.mbid))
-        for name in artist.names:
-            tracks |= set(self.find('artist', name))
+        bl_filter = self.blocklist_filter()
+        tracks |= set(self._find_any(*self._artist_alternatives(artist),
+                                     exclude=bl_filter))
+        if bl_filter is not None:  # blocklist already applied by MPD
+            return list(tracks)
+        blocklist = self.database.view_bl()
         # album blocklist
         albums = {Album(trk.Album.name, mbid=trk.musicbrainz_albumid)
                   for trk in tracks}
         bl_albums = {Album(a.get('album'), mbid=a.get('musicbrainz_album'))
-                     for a in self.database.view_bl() if a.get('album')}
+                     for a in blocklist if a.get('album')}
         if albums & bl_albums:
             self.log.info('Albums in blocklist for %s: %s', artist, albums & bl_albums)
             tracks = {trk for trk in tracks if trk.Album not in bl_albums}
         # track blocklist
         bl_tracks = {Track(title=t.get('title'), file=t.get('file'))
-                     for t in self.database.view_bl() if t.get('title')}
+                     for t in blocklist if t.get('title')}
         if tracks & bl_tracks:
             self.log.info('Tracks in blocklist for %s: %s',
                           artist, tracks & bl_tracks)
@@ -342,18 +664,163 @@ class MPD(MPDClient):
             self.log.info('Album in blocklist: %s', album)
             return []
         albums = []
+        bl_filter = self.blocklist_filter()
         if album.mbid:
-            filt = f"(MUSICBRAINZ_ALBUMID == '{album.mbid}')"
-            albums = self.find(filt)
+            albums = self._find_any([('MUSICBRAINZ_ALBUMID', album.mbid)],
+                                    exclude=bl_filter)
         # Now look for album with no MusicBrainzIdentifier
         if not albums and album.Artist.mbid:  # Use album artist MBID if possible
-            filt = f"((MUSICBRAINZ_ALBUMARTISTID == '{album.Artist.mbid}') AND (album == '{album.name_sz}'))"
-            albums = self.find(filt)
+            albums = self._find_any([('MUSICBRAINZ_ALBUMARTISTID', album.Artist.mbid),
+                                     ('album', album.name)], exclude=bl_filter)
         if not albums:  # Falls back to (album)?artist/album name
-            for artist in album.Artist.names_sz:
-                filt = f"((albumartist == '{artist}') AND (album == '{album.name_sz}'))"
-                albums.extend(self.find(filt))
+            albums = self._find_any(*[[('albumartist', name), ('album', album.name)]
+                                      for name in album.Artist.names],
+                                    exclude=bl_filter)
         return albums
+
+    def _find_any(self, *alternatives, exclude=None):
+        """Find tracks matching any of the alternatives
+
+        Each alternative is a list of (tag, value) pairs all to be matched.
+        All alternatives are sent in a single filter expression, MPD < 0.21
+        falls back to one query per alternative.
+
+        :param list alternatives: lists of (tag, value) tuples
+        :param str exclude: filter expression tracks must also match, ignored
+                            with MPD < 0.21, cf. :py:meth:`blocklist_filter`
+        :return: A list of track objects
+        """
+        if self.use_filters:
+            return self.find(all_of(
+                any_of(*[all_of(*[tag_filter(tag, val) for tag, val in alt])
+                         for alt in alternatives]),
+                exclude))
+        tracks = []
+        for alt in alternatives:
+            for trk in self.find(*[arg for pair in alt for arg in pair]):
+                if trk not in tracks:
+                    tracks.append(trk)
+        return tracks
+
+    @staticmethod
+    def _artist_alternatives(artist):
+        alternatives = [[('artist', name)] for name in artist.names]
+        if artist.mbid:
+            alternatives.insert(0, [('musicbrainz_artistid', artist.mbid)])
+        return alternatives
+
+    def _artist_filter(self, artist):
+        """Artist tracks filter expression, cf. :py:meth:`_find_any`"""
+        return any_of(*[all_of(*[tag_filter(tag, val) for tag, val in alt])
+                        for alt in self._artist_alternatives(artist)])
+
+    def _find_window(self, mpd_filter, start, end):
+        """Raw find command limited to a window, lazy in iterate mode"""
+        find = super().__getattr__('find')
+        if 'iterate' not in vars(self):  # python-musicpd without iterate mode
+            return find(mpd_filter, 'window', (start, end))
+        self.iterate = True
+        try:
+            return find(mpd_filter, 'window', (start, end))
+        finally:
+            self.iterate = False
+
+    def iter_find(self, mpd_filter, window=None):
+        """Find tracks matching a filter expression, results are paged with
+        the window argument and Track objects are built lazily.
+
+            >>> for trk in player.iter_find("(artist == 'Various Artists')"):
+            >>>     …
+
+        No other command can be sent to MPD while iterating over a page,
+        leaving the loop early consumes the remaining page only.
+
+        :param str mpd_filter: filter expression
+        :param int window: tracks fetched per command, defaults to :py:attr:`find_window`
+        :return: generator of Track objects
+        """
+        if not self.use_filters:
+            raise PlayerError('Need at least MPD 0.21 to use filters')
+        window = window or self.find_window
+        start = 0
+        while True:
+            fetched = 0
+            try:
+                page = self._find_window(mpd_filter, start, start + window)
+                try:
+                    for trk in page:
+                        fetched += 1
+                        yield Track(**trk)
+                finally:
+                    for _ in page:  # keep the connection in sync
+                        pass
+            except (OSError, TimeoutError) as err:
+                raise PlayerError(err) from err
+            if fetched < window:
+                return
+            start += window
+
+    @we
+    def sample_find(self, mpd_filter, size=1):
+        """Random selection of tracks matching a filter expression
+
+        Only a random window of size tracks is fetched, tracks are contiguous
+        in MPD database order.
+
+        :param str mpd_filter: filter expression
+        :param int size: number of tracks to fetch
+        :return: A list of track objects
+        """
+        if not self.use_filters:
+            raise PlayerError('Need at least MPD 0.21 to use filters')
+        total = int(self.count(mpd_filter).get('songs', 0))
+        if not total:
+            return []
+        start = randrange(max(1, total - size + 1))
+        return self.find(mpd_filter, 'window', (start, start + size))
+
+    def sample_tracks(self, what, size=1):
+        """Random selection of tracks for a specific artist or album, cf.
+        :py:meth:`find_tracks`
+
+        Fetches a random window of size tracks when the blocklist can be
+        applied server side, falls back to sampling :py:meth:`find_tracks`.
+
+        :param Artist,Album what: Artist or Album to fetch track from
+        :param int size: number of tracks to fetch
+        :return: A list of track objects
+        :rtype: list(Track)
+        """
+        bl_filter = self.blocklist_filter()
+        if not isinstance(what, Artist) or bl_filter is None:
+            tracks = self.find_tracks(what)
+            return sample(tracks, min(size, len(tracks)))
+        if self.database.get_bl_artist(what, add=False):
+            self.log.info('Artist in blocklist: %s', what)
+            return []
+        return self.sample_find(all_of(self._artist_filter(what), bl_filter), size)
+
+    def iter_tracks(self, what):
+        """Lazy :py:meth:`find_tracks`
+
+        Artist tracks are paged with :py:meth:`iter_find` when the blocklist
+        can be applied server side, falls back to :py:meth:`find_tracks`.
+        No other command can be sent to MPD while iterating.
+
+        :param Artist,Album what: Artist or Album to fetch track from
+        :return: generator of Track objects
+        """
+        if isinstance(what, str):
+            what = Artist(name=what)
+        bl_filter = self.blocklist_filter()
+        if not isinstance(what, Artist) or bl_filter is None:
+            yield from self.find_tracks(what)
+            return
+        if self.database.get_bl_artist(what, add=False):
+            self.log.info('Artist in blocklist: %s', what)
+            return
+        yield from self.iter_find(all_of(self._artist_filter(what), bl_filter))
+
 # #### / find_tracks ##
 
 # #### Search Methods #####
@@ -362,12 +829,9 @@ class MPD(MPDClient):
         """
         if not self.use_mbid:
             return None
-        mbids = None
-        for name in artist.names_sz:
-            filt = f'((artist == "{name}") AND (MUSICBRAINZ_ARTISTID != ""))'
-            mbids = self.list('MUSICBRAINZ_ARTISTID', filt)
-            if mbids:
-                break
+        filt = all_of(any_of(*[tag_filter('artist', name) for name in artist.names]),
+                      tag_filter('MUSICBRAINZ_ARTISTID', '', '!='))
+        mbids = self.list('MUSICBRAINZ_ARTISTID', filt)
         if not mbids:
             return None
         if len(mbids) > 1:
@@ -381,6 +845,50 @@ class MPD(MPDClient):
             return mbids[0]
         return None
 
+    def _artist_close_matches(self, key, name):
+        match = self._cache['close_matches'].get((key, name))
+        if match is not None:
+            return match
+        if self._matcher:
+            return self._matcher.close_matches(key, [name], 50, 0.73)[0]
+        return self._close_matches(name, self._cache[key], 50, 0.73)
+
+    def prefetch_artists(self, artists):
+        """Compute close matches used by :py:meth:`search_artist` for a
+        batch of artists at once, only with fuzzy matcher worker processes.
+        Matches are kept until the library changes, artists already
+        prefetched are skipped.
+
+        :param list(Artist) artists: artists about to be searched
+        """
+        if not self._matcher:
+            return
+        prefetched = self._cache['close_matches']
+        if len(prefetched) > PREFETCH_MAX:
+            prefetched.clear()
+        batches = {'artists': {}, 'nombid_artists': {}}
+        for artist in artists:
+            key = 'nombid_artists' if artist.mbid else 'artists'
+            if (key, artist.name) not in prefetched:
+                batches[key][artist.name] = None
+        for key, names in batches.items():
+            if not names:
+                continue
+            matches = self._matcher.close_matches(key, list(names), 50, 0.73)
+            prefetched.update({(key, name): match
+                               for name, match in zip(names, matches)})
+
+    def library_artists(self):
+        """Artists names and MusicBrainz IDs found in the music library
+
+        :return: (names, mbids) frozensets, mbids is empty when MusicBrainz
+                 identifiers are not used
+        """
+        mbids = frozenset()
+        if self.use_mbid:
+            mbids = frozenset(filter(None, self.list('MUSICBRAINZ_ARTISTID')))
+        return self._cache['artists'], mbids
+
     @bl_artist
     @set_artist_mbid
     def search_artist(self, artist):
@@ -398,7 +906,7 @@ class MPD(MPDClient):
         found = False
         if artist.mbid:
             # look for exact search w/ musicbrainz_artistid
-            library = self.list('artist', f"(MUSICBRAINZ_ARTISTID == '{artist.mbid}')")
+            library = self.list('artist', tag_filter('MUSICBRAINZ_ARTISTID', artist.mbid))
             if library:
                 found = True
                 self.log.trace('Found mbid "%r" in library', artist)
@@ -408,12 +916,11 @@ class MPD(MPDClient):
                     for name in library:
                         if SimaStr(artist.name) == name and name != artist.name:
                             self.log.debug('add alias for %s: %s', artist, name)
-                            artist.add_alias(name)
+                            artist = artist.with_alias(name)
             # Fetches remaining artists for potential match
-            artists = self._cache['nombid_artists']
+            match = self._artist_close_matches('nombid_artists', artist.name)
         else:  # not using MusicBrainzIDs
-            artists = self._cache['artists']
-        match = get_close_matches(artist.name, artists, 50, 0.73)
+            match = self._artist_close_matches('artists', artist.name)
         if not match and not found:
             return None
         if len(match) > 1:
@@ -423,7 +930,7 @@ class MPD(MPDClient):
         for close_art in match:
             # Regular lowered string comparison
             if artist.name.lower() == close_art.lower():
-                artist.add_alias(close_art)
+                artist = artist.with_alias(close_art)
                 found = True
                 if artist.name != close_art:
                     self.log.debug('"%s" matches "%s".', close_art, artist)
@@ -435,15 +942,14 @@ class MPD(MPDClient):
                 return artist
             return None
         # Now perform fuzzy search
-        for fuzz in match:
-            if fuzz in artist.names:  # Already found in lower cased comparison
-                continue
-            # SimaStr string __eq__ (not regular string comparison here)
-            if SimaStr(artist.name) == fuzz:
-                found = True
-                artist.add_alias(fuzz)
-                self.log.debug('"%s" quite probably matches "%s" (SimaStr)',
-                               fuzz, artist)
+        # Skip names already found in lower cased comparison
+        match = [fuzz for fuzz in match if fuzz not in artist.names]
+        # SimaStr comparison (not regular string comparison here)
+        for fuzz in SimaStr(artist.name).matches(match):
+            found = True
+            artist = artist.with_alias(fuzz)
+            self.log.debug('"%s" quite probably matches "%s" (SimaStr)',
+                           fuzz, artist)
         if found:
             if artist.aliases:
                 self.log.info('Found aliases: %s', '/'.join(artist.names))
@@ -462,23 +968,31 @@ class MPD(MPDClient):
         # Get all titles (filter missing titles set to 'None')
         all_artist_titles = frozenset([tr.title for tr in all_tracks
                                        if tr.title is not None])
-        match = get_close_matches(title, all_artist_titles, 50, 0.78)
+        match = self._close_matches(title, all_artist_titles, 50, 0.78)
         tracks = []
         if not match:
             return []
         for mtitle in match:
-            leven = levenshtein_ratio(title, mtitle)
+            leven = levenshtein_ratio_bounded(title, mtitle, 0.77)
             if leven == 1:
                 tracks.extend([t for t in all_tracks if t.title == mtitle])
-            elif leven >= 0.77:
+            elif leven is not None and leven >= 0.77:
                 self.log.debug('title: "%s" should match "%s" (lr=%1.3f)',
                                mtitle, title, leven)
                 tracks.extend([t for t in all_tracks if t.title == mtitle])
             else:
-                self.log.debug('title: "%s" does not match "%s" (lr=%1.3f)',
-                               mtitle, title, leven)
+                self.log.debug('title: "%s" does not match "%s" (lr<0.77)',
+                               mtitle, title)
         return tracks
 
+    @staticmethod
+    def _album_filter(album):
+        """Album name and MusicBrainz ID, when set, filter expression"""
+        if album.mbid:
+            return all_of(tag_filter('album', album.name),
+                          tag_filter('musicbrainz_albumid', album.mbid))
+        return tag_filter('album', album.name)
+
     def search_albums(self, artist):
         """Find potential albums for "artist"
 
@@ -487,74 +1001,101 @@ class MPD(MPDClient):
         * Tries to filter some mutli-artists album
           For instance an album by Artist_A may have a track by Artist_B. Then
           looking for albums for Artist_B wrongly returns this album.
+
+        Relies on list and count queries sent in command lists, tracks are
+        not fetched (unless the blocklist has to be checked client side).
         """
         # First, look for all potential albums
         self.log.debug('Searching album for "%r"', artist)
         if artist.aliases:
             self.log.debug('Searching album for %s aliases: "%s"',
                            artist, artist.aliases)
-        albums = set()
+        artist_filter = any_of(*[tag_filter('albumartist', name) for name in artist.names])
         if self.use_mbid and artist.mbid:
-            mpd_filter = f"((musicbrainz_albumartistid == '{artist.mbid}') AND ( album != ''))"
-            raw_album_id = self.list('musicbrainz_albumid', mpd_filter)
-            for albumid in raw_album_id:
-                mpd_filter = f"((musicbrainz_albumid == '{albumid}') AND ( album != ''))"
-                album_name = self.list('album', mpd_filter)
-                if not album_name:  # something odd here
-                    continue
-                albums.add(Album(album_name[0], artist=artist.name,
-                                 Artist=artist, mbid=albumid))
-        for name_sz in artist.names_sz:
-            mpd_filter = f"((albumartist == '{name_sz}') AND ( album != ''))"
-            raw_albums = self.list('album', mpd_filter)
-            for alb in raw_albums:
-                if alb in [a.name for a in albums]:
+            artist_filter = any_of(tag_filter('musicbrainz_albumartistid', artist.mbid),
+                                   artist_filter)
+        bl_filter = self.blocklist_filter()
+        # Albums with tracks all in blocklist are not listed
+        mpd_filter = all_of(artist_filter, tag_filter('album', '', '!='), bl_filter)
+        names = [name for name in self.list('album', mpd_filter) if name]
+        if not names:
+            return []
+        albums_ids = dict.fromkeys(names, [None])  # album name → MusicBrainz album IDs
+        if self.use_mbid:
+            self.command_list_ok_begin()
+            for name in names:
+                self.list('musicbrainz_albumid',
+                          all_of(mpd_filter, tag_filter('album', name)))
+            for name, ids in zip(names, self.command_list_end()):
+                albums_ids[name] = [mbid for mbid in ids if mbid] or [None]
+        albums = []
+        for name, ids in albums_ids.items():
+            for mbid in ids:
+                album = Album(name, artist=artist.name, Artist=artist, mbid=mbid)
+                if self.database.get_bl_album(album, add=False):
+                    self.log.info('Album in blocklist: %s', album)
                     continue
-                mbid = None
-                if self.use_mbid:
-                    _ = Album(alb)
-                    mpd_filter = f"((albumartist == '{artist.name_sz}') AND ( album == '{_.name_sz}'))"
-                    mbids = self.list('MUSICBRAINZ_ALBUMID', mpd_filter)
-                    if mbids:
-                        mbid = mbids[0]
-                albums.add(Album(alb, artist=artist.name,
-                                 Artist=artist, mbid=mbid))
+                if bl_filter is None and not self.find_tracks(album):
+                    continue  # blocklist applied client side
+                albums.append(album)
+        if not albums:
+            return []
+        # Album artists (names and mbids) for all potential albums at once
+        self.command_list_ok_begin()
+        for album in albums:
+            self.list('albumartist', self._album_filter(album))
+            if self.use_mbid:
+                self.list('musicbrainz_albumartistid', self._album_filter(album))
+        replies = iter(self.command_list_end())
+        album_artists = {}  # (name, mbid) → set of albumartist names and mbids
+        for album in albums:
+            values = set(next(replies))
+            if self.use_mbid:
+                values.update(next(replies))
+            album_artists[(album.name, album.mbid)] = set(filter(None, values))
         candidates = []
+        to_count = []
         for album in albums:
-            album_trks = self.find_tracks(album)
-            if not album_trks:  # find_track result can be empty, blocklist applied
-                continue
-            album_artists = {tr.albumartist for tr in album_trks if tr.albumartist}
-            if album.Artist.names & album_artists:
+            alb_artists = album_artists[(album.name, album.mbid)]
+            if album.Artist.names & alb_artists:
                 candidates.append(album)
                 continue
             if self.use_mbid and artist.mbid:
-                if artist.mbid == album_trks[0].musicbrainz_albumartistid:
+                if artist.mbid in alb_artists:
                     candidates.append(album)
                     continue
                 self.log.debug('Discarding "%s", "%r" not set as musicbrainz_albumartistid',
                                album, album.Artist)
                 continue
-            if 'Various Artists' in album_artists:
+            if 'Various Artists' in alb_artists:
                 self.log.debug('Discarding %s ("Various Artists" set)', album)
                 continue
-            if album_artists and album.Artist.name not in album_artists:
+            if alb_artists and album.Artist.name not in alb_artists:
                 self.log.debug('Discarding "%s", "%s" not set as albumartist', album, album.Artist)
                 continue
-            # Attempt to detect false positive (especially when no
-            # AlbumArtist/MBIDs tag ar set)
-            # Avoid selecting albums where artist is credited for a single
-            # track of the album
-            album_trks = self.find(f"(album == '{album.name_sz}')")
-            arts = [trk.artist for trk in album_trks]  # Artists in the album
+            to_count.append(album)
+        if not to_count:
+            return candidates
+        # Attempt to detect false positive (especially when no
+        # AlbumArtist/MBIDs tag ar set)
+        # Avoid selecting albums where artist is credited for a single
+        # track of the album
+        self.command_list_ok_begin()
+        for album in to_count:
+            super().__getattr__('count')(self._album_filter(album), 'group', 'artist')
+        for album, count in zip(to_count, self.command_list_end()):
+            arts = count.get('artist', [])
+            songs = count.get('songs', [])
+            if isinstance(arts, str):
+                arts, songs = [arts], [songs]
+            songs = dict(zip(arts, map(int, songs)))
             # count artist occurences
-            ratio = arts.count(album.Artist.name)/len(arts)
+            ratio = songs.get(album.Artist.name, 0)/max(1, sum(songs.values()))
             if ratio >= 0.8:
                 candidates.append(album)
             else:
                 self.log.debug('"%s" probably not an album of "%s" (ratio=%.2f)',
                                album, artist, ratio)
-            continue
         return candidates
 # #### / Search Methods ###
 
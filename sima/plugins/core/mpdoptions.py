@@ -42,12 +42,12 @@ class MpdOptions(Plugin):
         """
         Called on player changes
         """
-        player = self.daemon.player
-        if player.playmode.get('single'):
+        playmode = self.daemon.player.snapshot.playmode
+        if playmode.get('single'):
             if self.daemon.config.getboolean('sima', 'single_disable_queue'):
                 self.log.info('MPD "single" mode activated.')
                 self.daemon.enabled = False
-        elif player.playmode.get('repeat'):
+        elif playmode.get('repeat'):
             if self.daemon.config.getboolean('sima', 'repeat_disable_queue'):
                 self.log.info('MPD "repeat" mode activated.')
                 self.daemon.enabled = False
@@ -59,10 +59,10 @@ class Crop(Plugin):
             self.log.debug('Queueing disabled, not cropping')
             return
         player = self.daemon.player
-        if player.currentsong().pos > self.target:
+        position = player.current.pos
+        if position > self.target:
             self.log.debug('cropping playlist')
-        while player.currentsong().pos > self.target:
-            player.delete(0)
+            player.delete_range(0, position - self.target)
 
 
 # VIM MODLINE
@@ -30,13 +30,14 @@ from random import shuffle
 # local import
 from ...lib.plugin import AdvancedPlugin
 from ...lib.meta import Artist, MetaContainer
+from ...lib.mpdfilter import tag_filter, all_of
 from ...utils.utils import PluginException
 
 
 def forge_filter(genre):
-    mpd_filter = f"(Genre == '{genre.strip()}')"
+    mpd_filter = tag_filter('Genre', genre.strip())
     # Ensure there is at least an artist name
-    mpd_filter = f"({mpd_filter} AND (artist != ''))"
+    mpd_filter = all_of(mpd_filter, tag_filter('artist', '', '!='))
     return mpd_filter
 
 
@@ -86,8 +87,9 @@ class Genre(AdvancedPlugin):
             return []
         self.log.info('Genre plugin looking for genre: %s', ' / '.join(genres))
         artists = MetaContainer([])
+        bl_filter = self.player.blocklist_filter()
         for genre in genres:
-            mpd_filter = forge_filter(genre)
+            mpd_filter = all_of(forge_filter(genre), bl_filter)
             self.log.debug('mpd filter: %s', mpd_filter)
             _ = self.player.list('artist', mpd_filter)
             shuffle(_)
@@ -99,10 +101,7 @@ class Genre(AdvancedPlugin):
         self.log.debug('Genre plugin found: %s…', ' / '.join(map(str, artists[:4])))
         for artist in artists:
             self.log.debug('looking for %s', artist)
-            tracks = self.player.find_tracks(artist)
-            if not tracks:
-                continue
-            trk = self.filter_track(tracks, candidates)
+            trk = self.filter_track(self.player.iter_tracks(artist), candidates)
             if not trk:
                 continue
             if queue_mode == 'track':
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright (c) 2013, 2014, 2020 kaliko <kaliko@azylum.org>
+# Copyright (c) 2013, 2014, 2020, 2024 kaliko <kaliko@azylum.org>
 #
 #  This file is part of sima
 #
@@ -29,8 +29,11 @@ from os.path import join
 # local import
 from ...lib.simafm import SimaFM
 from ...lib.webserv import WebService
-from ...lib.cache import FileCache
+from ...lib.cache import CacheMaintenance, FileCache, SqliteCache
+from ...lib.cache import LRUCache, NegativeCache, TieredCache
+from ...lib.cache import CODECS, get_codec
 from ...lib.http import CacheController
+from ...lib.simastr import normalize
 
 
 class Lastfm(WebService):
@@ -39,16 +42,79 @@ class Lastfm(WebService):
 
     def __init__(self, daemon):
         WebService.__init__(self, daemon)
+        self.maintenance = None
         # Set persitent cache
         vardir = daemon.config['sima']['var_dir']
         persitent_cache = daemon.config.getboolean('lastfm', 'cache')
+        memory_cache = LRUCache(
+            max_entries=daemon.config.getint('lastfm', 'cache_memory_entries'),
+            max_bytes=daemon.config.getint('lastfm', 'cache_memory_size')*2**20)
+        CacheController.STALE_WHILE_REVALIDATE = 3600*daemon.config.getint(
+            'lastfm', 'cache_stale_while_revalidate')
+        CacheController.STALE_IF_ERROR = 3600*daemon.config.getint(
+            'lastfm', 'cache_stale_if_error')
+        SimaFM.negative = NegativeCache(3600*daemon.config.getint(
+            'lastfm', 'cache_negative_ttl'))
+        persistent = None
         if persitent_cache:
             CacheController.CACHE_ANYWAY = True
-            self.log.debug('Persistant cache enabled in %s',
-                           join(vardir, 'http', 'LastFM'))
-            SimaFM.cache = FileCache(join(vardir, 'http', 'LastFM'))
+            codec = daemon.config.get('lastfm', 'cache_codec')
+            if codec not in CODECS:
+                self.log.warning('Cache codec "%s" not available, using zlib',
+                                 codec)
+                codec = 'zlib'
+            if daemon.config.get('lastfm', 'cache_backend') == 'sqlite':
+                cache_path = join(vardir, 'http', 'LastFM.db')
+                persistent = SqliteCache(cache_path, codec=get_codec(codec))
+            else:
+                cache_path = join(vardir, 'http', 'LastFM')
+                persistent = FileCache(cache_path, codec=get_codec(codec))
+            self.log.debug('Persistant cache enabled in %s', cache_path)
+            self.maintenance = CacheMaintenance(
+                persistent,
+                max_entries=daemon.config.getint('lastfm', 'cache_max_entries'),
+                max_bytes=daemon.config.getint('lastfm', 'cache_max_size')*2**20,
+                grace=max(CacheController.STALE_WHILE_REVALIDATE,
+                          CacheController.STALE_IF_ERROR))
+            self.maintenance.start()
+        SimaFM.cache = TieredCache(memory_cache, persistent, stats=SimaFM.stats)
         self.ws = SimaFM()
 
+    def _update_cache_keep(self):
+        """Evict cached requests for artists no longer in the library
+
+        Names are compared normalized (cf. :py:func:`sima.lib.simastr.normalize`),
+        requests may be forged with a spelling slightly differing from the
+        library one."""
+        if not self.maintenance:
+            return
+        names, mbids = self.player.library_artists()
+        if not names:  # Not purging the whole cache on an empty library
+            self.maintenance.keep = None
+            return
+        names = frozenset(normalize(name).casefold() for name in names)
+
+        def keep(url):
+            name, mbid = SimaFM.request_artist(url)
+            if mbid:
+                return mbid in mbids
+            if name:
+                return normalize(name).casefold() in names
+            return True
+        self.maintenance.keep = keep
+
+    def start(self):
+        self._update_cache_keep()
+
+    def callback_player_database(self):
+        super().callback_player_database()
+        self._update_cache_keep()
+
+    def shutdown(self):
+        super().shutdown()
+        if self.maintenance:
+            self.maintenance.stop()
+
 
 # VIM MODLINE
 # vim: ai ts=4 sw=4 sts=4 expandtab
@@ -29,6 +29,7 @@ import random
 # local import
 from ...lib.plugin import Plugin
 from ...lib.meta import Artist
+from ...lib.mpdfilter import tag_filter, all_of
 
 
 class Random(Plugin):
@@ -44,6 +45,7 @@ class Random(Plugin):
             self.mode = 'pure'
         self.log.debug('Random flavour: %s', self.mode)
         self.candidates = []
+        self.bl_filtered = False
 
     def get_played_artist(self,):
         """Constructs list of already played artists."""
@@ -60,12 +62,12 @@ class Random(Plugin):
          * not in blocklist
         """
         if self.mode == 'sensible':
-            if self.sdb.get_bl_artist(Artist(artist), add=False):
+            if not self.bl_filtered and self.sdb.get_bl_artist(Artist(artist), add=False):
                 self.log.debug('Random plugin: Blacklisted "%s"', artist)
                 return True
             if artist in self.get_played_artist():
                 return True
-        if artist in self.player.queue:
+        if artist in self.player.snapshot.queue:
             return True
         if artist in self.candidates:
             return True
@@ -75,15 +77,20 @@ class Random(Plugin):
         self.candidates = []
         trks = []
         target = self.plugin_conf.getint('track_to_add')
-        artists = self.player.list('artist', '( artist != "")')
+        mpd_filter = tag_filter('artist', '', '!=')
+        bl_filter = None
+        if self.mode == 'sensible':
+            bl_filter = self.player.blocklist_filter()
+        self.bl_filtered = bl_filter is not None
+        artists = self.player.list('artist', all_of(mpd_filter, bl_filter))
         random.shuffle(artists)
         for art in artists:  # artists is a list of strings here
             if self.filtered_artist(art):
                 continue
             self.log.debug('Random art: %s', art)
-            trks = self.player.find_tracks(Artist(art))
+            trks = self.player.sample_tracks(Artist(art))
             if trks:
-                trk = random.choice(trks)
+                trk = trks[0]
                 self.candidates.append(trk)
                 self.log.info('Random plugin chose (%s): %s', self.mode, trk)
             if len(self.candidates) >= target:
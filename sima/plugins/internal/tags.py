@@ -31,6 +31,7 @@ from musicpd import CommandError
 # local import
 from ...lib.plugin import AdvancedPlugin
 from ...lib.meta import Artist, MetaContainer
+from ...lib.mpdfilter import tag_filter, all_of
 from ...utils.utils import PluginException
 
 
@@ -76,12 +77,11 @@ def forge_filter(cfg, logger):
             continue
         if ',' in cfg[tag]:
             patt = '|'.join(map(str.strip, cfg[tag].split(',')))
-            mpd_filter.append(f"({tag} =~ '({patt})')")
+            mpd_filter.append(tag_filter(tag, f'({patt})', '=~'))
         else:
-            mpd_filter.append(f"({tag} == '{cfg[tag].strip()}')")
-    mpd_filter = ' AND '.join(mpd_filter)
+            mpd_filter.append(tag_filter(tag, cfg[tag].strip()))
     # Ensure there is at least an artist name
-    mpd_filter = f"({mpd_filter} AND (artist != ''))"
+    mpd_filter = all_of(*mpd_filter, tag_filter('artist', '', '!='))
     return mpd_filter
 
 
@@ -139,7 +139,8 @@ class Tags(AdvancedPlugin):
         queue_mode = self.plugin_conf.get('queue_mode', 'track')
         target = self.plugin_conf.getint(f'{queue_mode}_to_add')
         # look for artists acording to filter
-        artists = [Artist(name=a) for a in self.player.list('artist', self.mpd_filter)]
+        mpd_filter = all_of(self.mpd_filter, self.player.blocklist_filter())
+        artists = [Artist(name=a) for a in self.player.list('artist', mpd_filter)]
         random.shuffle(artists)
         artists = MetaContainer(artists)
         if not artists:
@@ -149,10 +150,7 @@ class Tags(AdvancedPlugin):
         self.log.debug('Tags plugin found: %s', ' / '.join(map(str, artists)))
         for artist in artists:
             self.log.debug('looking for %s', artist)
-            tracks = self.player.find_tracks(artist)
-            if not tracks:
-                continue
-            trk = self.filter_track(tracks, candidates)
+            trk = self.filter_track(self.player.iter_tracks(artist), candidates)
             if not trk:
                 continue
             if queue_mode == 'track':
@@ -22,6 +22,7 @@ import sys
 
 # local import
 from ..mpdclient import MPD, Artist, Album
+from ..lib.mpdfilter import tag_filter
 from ..lib.simadb import SimaDB
 
 
@@ -101,8 +102,7 @@ class BLCli(MPD):
         else:  # album provided
             self.log.debug('Looking for %r', album)
             album = Album(album)
-            tracks = self.find(f'(album == "{album.name_sz}")',
-                               'window', (0, 1))
+            tracks = self.find(tag_filter('album', album.name), 'window', (0, 1))
             if not tracks:
                 self.log.warning('Album not found: "%s"', album)
                 return
@@ -132,8 +132,7 @@ class BLCli(MPD):
             track = self.current
         else:  # track provided
             self.log.debug('Looking for %r', track)
-            track_sz = track.replace("'", r"\'")
-            tracks = self.find(f'(title == "{track_sz}")')
+            tracks = self.find(tag_filter('title', track))
             if not tracks:
                 self.log.warning('Track not found: "%s"', track)
                 return
@@ -56,6 +56,8 @@ DEFAULT_CONF = {
             'repeat_disable_queue': True,
             'single_disable_queue': True,
             'mopidy_compat': False,
+            'fuzzy_matcher': "difflib",
+            'fuzzy_workers': 0,
             },
         'daemon': {
             'daemon': False,
@@ -79,6 +81,15 @@ DEFAULT_CONF = {
             'track_to_add_from_album': 0,  # <=0 means keep all
             'depth': 1,
             'cache': True,
+            'cache_backend': "file",  # in file, sqlite
+            'cache_memory_entries': 500,
+            'cache_memory_size': 16,  # MiB
+            'cache_codec': "zlib",  # in none, zlib, zstd
+            'cache_max_size': 0,  # MiB, 0 means no limit
+            'cache_max_entries': 0,  # 0 means no limit
+            'cache_stale_while_revalidate': 24,  # hours
+            'cache_stale_if_error': 168,  # hours
+            'cache_negative_ttl': 24,  # hours, 0 disables negative caching
             'priority': 100,
             },
         'random': {
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright (c) 2009, 2010, 2013 kaliko <kaliko@azylum.org>
+# Copyright (c) 2009, 2010, 2013, 2024 kaliko <kaliko@azylum.org>
 #
 #  This file is part of sima
 #
@@ -16,7 +16,21 @@
 #  You should have received a copy of the GNU General Public License
 #  along with sima.  If not, see <http://www.gnu.org/licenses/>.
 #
-"""Computes levenshtein distance/ratio"""
+"""Computes levenshtein distance/ratio
+
+Batch functions (:py:func:`levenshtein_ratios`, :py:func:`close_matches`)
+rely on NumPy when available, falling back to pure Python.
+"""
+
+from heapq import nlargest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#: Candidates processed at once by the NumPy batch matcher
+BLOCK_SIZE = 4096
 
 
 def levenshtein(a_st, b_st):
@@ -52,5 +66,153 @@ def levenshtein_ratio(string, strong):
     return ratio
 
 
+def levenshtein_bounded(a_st, b_st, max_dist):
+    """Computes the Levenshtein distance between two strings if it does not
+    exceed max_dist.
+
+    Only a band of 2*max_dist+1 diagonals is computed (Ukkonen), giving up as
+    soon as every cell of a row exceeds max_dist.
+
+    :return: the distance or None when greater than max_dist
+    """
+    n_a, m_b = len(a_st), len(b_st)
+    if n_a > m_b:
+        a_st, b_st = b_st, a_st
+        n_a, m_b = m_b, n_a
+    if m_b - n_a > max_dist:
+        return None
+    out = max_dist + 1  # any value out of bounds
+    # Two rows allocated once, swapped on each iteration
+    previous = [j if j <= max_dist else out for j in range(n_a+1)]
+    current = [out]*(n_a+1)
+    for i in range(1, m_b+1):
+        low, high = max(1, i-max_dist), min(n_a, i+max_dist)
+        current[0] = i if i <= max_dist else out
+        row_min = current[0]
+        if low > 1:
+            current[low-1] = out
+        char = b_st[i-1]
+        for j in range(low, high+1):
+            change = previous[j-1]
+            if a_st[j-1] != char:
+                change += 1
+            add, delete = previous[j] + 1, current[j-1] + 1
+            if add < change:
+                change = add
+            if delete < change:
+                change = delete
+            current[j] = change
+            if change < row_min:
+                row_min = change
+        if high < n_a:
+            current[high+1] = out
+        if row_min > max_dist:
+            return None
+        previous, current = current, previous
+    if previous[n_a] > max_dist:
+        return None
+    return previous[n_a]
+
+
+def levenshtein_ratio_bounded(string, strong, min_ratio):
+    """Same as :py:func:`levenshtein_ratio` when the ratio is at least
+    min_ratio, cf. :py:func:`levenshtein_bounded`.
+
+    :return: the ratio or None when lower than min_ratio
+    """
+    max_len = max(len(string), len(strong))
+    if not max_len:
+        return 1.0
+    # Edits allowed to keep ratio >= min_ratio (rounding error tolerated)
+    max_dist = int((1 - min_ratio) * max_len + 1e-9)
+    lev_dist = levenshtein_bounded(string, strong, max_dist)
+    if lev_dist is None:
+        return None
+    return 1 - (float(lev_dist) / float(max_len))
+
+
+def _encode(strings, width):
+    """Code points of strings in a zero padded 2D array"""
+    codes = numpy.zeros((len(strings), width), dtype=numpy.uint32)
+    for idx, string in enumerate(strings):
+        if string:
+            codes[idx, :len(string)] = numpy.frombuffer(
+                    string.encode('utf-32-le'), dtype=numpy.uint32)
+    return codes
+
+
+def _block_distances(query, block):
+    """Levenshtein distances between query and a block of strings.
+
+    The dynamic programming runs over candidates characters and query
+    characters, each step being vectorized over the whole block.
+    """
+    lengths = numpy.fromiter(map(len, block), dtype=numpy.int64, count=len(block))
+    width = int(lengths.max())
+    codes = _encode(block, width)
+    query = [ord(char) for char in query]
+    n_q = len(query)
+    distances = numpy.full(len(block), n_q, dtype=numpy.int64)  # empty strings
+    previous = numpy.repeat(numpy.arange(n_q+1)[:, None], len(block), axis=1)
+    current = numpy.empty_like(previous)
+    for j in range(width):
+        column = codes[:, j]
+        current[0] = j + 1
+        for i in range(1, n_q+1):
+            change = previous[i-1] + (column != query[i-1])
+            numpy.minimum(change, previous[i] + 1, out=change)
+            numpy.minimum(change, current[i-1] + 1, out=change)
+            current[i] = change
+        ended = lengths == j + 1
+        distances[ended] = current[n_q][ended]
+        previous, current = current, previous
+    return distances
+
+
+def levenshtein_ratios(query, candidates):
+    """Levenshtein ratios between query and every candidate, cf.
+    :py:func:`levenshtein_ratio`.
+
+    With NumPy candidates are sorted by length and processed by blocks of
+    :py:data:`BLOCK_SIZE`, each block in vectorized steps.
+
+    :param str query: string to compare
+    :param list(str) candidates: strings to compare with
+    :return: list of ratios, in candidates order
+    """
+    candidates = list(candidates)
+    if numpy is None or not candidates:
+        return [levenshtein_ratio(query, cand) if query or cand else 1.0
+                for cand in candidates]
+    ratios = [0.0]*len(candidates)
+    # Similar lengths in a block limit padding
+    order = sorted(range(len(candidates)), key=lambda idx: len(candidates[idx]))
+    for start in range(0, len(order), BLOCK_SIZE):
+        indexes = order[start:start+BLOCK_SIZE]
+        block = [candidates[idx] for idx in indexes]
+        distances = _block_distances(query, block)
+        for idx, cand, dist in zip(indexes, block, distances.tolist()):
+            max_len = max(len(query), len(cand))
+            ratios[idx] = 1 - dist/max_len if max_len else 1.0
+    return ratios
+
+
+def close_matches(word, possibilities, n=3, cutoff=0.6):
+    """Same as :py:func:`difflib.get_close_matches` with Levenshtein ratio
+    as similarity score, computed with :py:func:`levenshtein_ratios`.
+
+    :param str word: string to look for
+    :param list(str) possibilities: strings to match word against
+    :param int n: maximum number of matches to return
+    :param float cutoff: minimal ratio
+    :return: best matches, most similar first
+    """
+    possibilities = list(possibilities)
+    scored = [(ratio, poss) for ratio, poss in
+              zip(levenshtein_ratios(word, possibilities), possibilities)
+              if ratio >= cutoff]
+    return [poss for _, poss in nlargest(n, scored)]
+
+
 # VIM MODLINE
 # vim: ai ts=4 sw=4 sts=4 expandtab
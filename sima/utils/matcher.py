@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024 kaliko <kaliko@azylum.org>
+#
+#  This file is part of sima
+#
+#  sima is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  sima is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with sima.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Fuzzy close matches computed by worker processes
+
+Names collections are split into shards, one per worker process. Queries
+are sent to every worker and partial results merged.
+
+>>> matcher = ShardedMatcher(4, 'levenshtein')
+>>> matcher.load('artists', player_artists)
+>>> matcher.close_matches('artists', ['Nirvana', 'Muse'], 50, 0.73)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from heapq import nlargest
+from itertools import chain
+
+from .leven import levenshtein_ratios
+
+# Worker process side, shards loaded in this process
+_SHARDS = {}
+
+
+def _load(key, names):
+    _SHARDS[key] = names
+
+
+def _difflib_ratios(word, names, cutoff):
+    """Scores as computed by :py:func:`difflib.get_close_matches`, names
+    below cutoff score 0"""
+    seqm = SequenceMatcher()
+    seqm.set_seq2(word)
+    ratios = []
+    for name in names:
+        seqm.set_seq1(name)
+        if (seqm.real_quick_ratio() >= cutoff and
+                seqm.quick_ratio() >= cutoff):
+            ratios.append(seqm.ratio())
+        else:
+            ratios.append(0.0)
+    return ratios
+
+
+def _match(key, words, n, cutoff, matcher):
+    names = _SHARDS.get(key, [])
+    matches = []
+    for word in words:
+        if matcher == 'levenshtein':
+            ratios = levenshtein_ratios(word, names)
+        else:
+            ratios = _difflib_ratios(word, names, cutoff)
+        scored = [(ratio, name) for ratio, name in zip(ratios, names)
+                  if ratio >= cutoff]
+        matches.append(nlargest(n, scored))
+    return matches
+
+
+class ShardedMatcher:
+    """Close matches (cf. :py:func:`difflib.get_close_matches` and
+    :py:func:`sima.utils.leven.close_matches`) over large names collections,
+    using one worker process per shard.
+
+    :param int workers: number of worker processes
+    :param str matcher: similarity score, "difflib" or "levenshtein"
+    """
+
+    def __init__(self, workers, matcher='difflib'):
+        self.workers = workers
+        self.matcher = matcher
+        self._executors = []
+        self._loaded = {}
+
+    def load(self, key, names):
+        """Split names into shards and send them to workers, shards are kept
+        when names did not change since last load.
+
+        :param str key: collection name
+        :param iterable names: collection of names
+        :return: True if workers were (re)loaded
+        """
+        names = frozenset(names)
+        if self._loaded.get(key) == names:
+            return False
+        if not self._executors:
+            self._executors = [ProcessPoolExecutor(max_workers=1)
+                               for _ in range(self.workers)]
+        names_list = sorted(names)
+        futures = [executor.submit(_load, key, names_list[idx::self.workers])
+                   for idx, executor in enumerate(self._executors)]
+        for future in futures:
+            future.result()
+        self._loaded[key] = names
+        return True
+
+    def close_matches(self, key, words, n=3, cutoff=0.6):
+        """Best matches for each word in the collection key
+
+        :param str key: collection name, as used in :py:meth:`load`
+        :param list(str) words: strings to look for
+        :param int n: maximum number of matches per word
+        :param float cutoff: minimal similarity score
+        :return: list of matches lists, most similar first, one per word
+        """
+        words = list(words)
+        if key not in self._loaded or not words:
+            return [[] for _ in words]
+        futures = [executor.submit(_match, key, words, n, cutoff, self.matcher)
+                   for executor in self._executors]
+        shards = [future.result() for future in futures]
+        return [[name for _, name in
+                 nlargest(n, chain.from_iterable(shard[idx] for shard in shards))]
+                for idx in range(len(words))]
+
+    def shutdown(self):
+        """Stop worker processes"""
+        for executor in self._executors:
+            executor.shutdown()
+        self._executors = []
+        self._loaded = {}
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
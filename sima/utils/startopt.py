@@ -97,6 +97,7 @@ CMDS = [
         {'create-db': [{}], 'help': 'Create the database'},
         {'generate-config': [{}], 'help': 'Generate a configuration file to stdout'},
         {'purge-history': [{}], 'help': 'Remove play history'},
+        {'migrate-cache': [{}], 'help': 'Import Last.fm file cache into the SQLite cache'},
         {'bl-view': [{}], 'help': 'List blocklist IDs'},
         {'bl-add-artist': [
             {'name': 'artist', 'type': str, 'nargs': '?',
@@ -29,10 +29,10 @@ import sys
 from argparse import ArgumentError, Action
 from base64 import b64decode as push
 from codecs import getencoder
-from datetime import datetime
 from os import getenv, access, getcwd, W_OK, R_OK
 from os.path import dirname, isabs, join, normpath, exists, isdir, isfile
-from time import sleep
+from threading import Event, Lock
+from time import monotonic, sleep
 
 from musicpd import VERSION as mversion
 from sima.info import __version__ as sversion
@@ -169,23 +169,98 @@ class Wdir(FileAction):
             self.parser.error(f'no write access to "{self._file}"')
 
 
-class Throttle:
-    """throttle decorator"""
-    # pylint: disable=R0903
-    def __init__(self, wait):
-        self.wait = wait
-        self.last_called = datetime.now()
+class TokenBucket:
+    """Token bucket rate limiter, thread safe
+
+    Up to capacity calls go through at once, then one every 1/rate second.
+    Callers sleep exactly until their token is available.
+
+    :param float rate: tokens added per second
+    :param int capacity: burst size
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self._lock = Lock()
+
+    def reserve(self):
+        """Take a token, returns seconds to wait before it is available"""
+        with self._lock:
+            now = monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1  # possibly negative, tokens owed to waiting callers
+            return max(0, -self.tokens / self.rate)
+
+    def acquire(self):
+        """Wait for a token, returns time waited"""
+        wait = self.reserve()
+        if wait:
+            sleep(wait)
+        return wait
 
     def __call__(self, func):
         def wrapper(*args, **kwargs):
-            while self.last_called + self.wait > datetime.now():
-                sleep(0.1)
-            result = func(*args, **kwargs)
-            self.last_called = datetime.now()
-            return result
+            self.acquire()
+            return func(*args, **kwargs)
         return wrapper
 
 
+class SingleFlight:
+    """Coalesce concurrent calls, thread safe
+
+    While a call for a key is in flight, callers with the same key wait for
+    it and share its result, or its exception.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """Call func, unless a call for key is already in flight
+
+        :return: (result, shared), shared is True for a result obtained by
+                 another caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    def __len__(self):
+        return len(self._calls)
+
+
 class MPDSimaException(Exception):
     """Generic MPD_sima Exception"""
 
@@ -211,6 +286,10 @@ class WSHTTPError(WSError):
     pass
 
 
+class WSInvalidAnswer(WSError):
+    """Malformed answer, or answer without the expected data"""
+
+
 class PluginException(MPDSimaException):
     pass
 
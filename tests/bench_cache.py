@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""HTTP cache codecs benchmark, not run with the test suite
+
+    python -m tests.bench_cache [number of responses]
+
+Compresses Last.fm artist.getsimilar like answers (limit=100) with each
+available codec and reports compression ratio and CPU time.
+"""
+
+import json
+import sys
+
+from hashlib import md5
+
+from sima.lib.cache import CODECS, get_codec
+
+
+def similar(idx):
+    """Fake artist.getsimilar json answer"""
+    artists = [{'name': f'Artist {idx}-{i}',
+                'mbid': f'{idx:08x}-49ab-4f7c-b148-{i:012x}',
+                'match': f'{1 - i/100:.6f}',
+                'url': f'https://www.last.fm/music/Artist+{idx}-{i}',
+                'image': [{'#text': 'https://lastfm.freetls.fastly.net/i/u/'
+                                    f'{size}/{md5(bytes([idx % 256, i])).hexdigest()}.png',
+                           'size': size}
+                          for size in ('small', 'medium', 'large', 'extralarge')],
+                'streamable': '0'}
+               for i in range(100)]
+    return json.dumps({'similarartists': {'artist': artists,
+                                          '@attr': {'artist': f'Artist {idx}'}}}
+                      ).encode('utf-8')
+
+
+def main(count=1000):
+    bodies = [similar(idx) for idx in range(count)]
+    for name in CODECS:
+        codec = get_codec(name)
+        stored = [codec.compress(body) for body in bodies]
+        for body in stored:
+            codec.decompress(body)
+        print(f'{sum(map(len, bodies))/2**20:.1f} MiB → '
+              f'{sum(map(len, stored))/2**20:.1f} MiB {codec.report()}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Levenshtein microbenchmark, not run with the test suite
+
+    python -m tests.bench_leven
+
+Compares levenshtein_ratio with levenshtein_ratio_bounded at the ratio
+used by SimaStr on close and distant pairs of names.
+"""
+
+import timeit
+
+from sima.lib.simastr import SimaStr
+from sima.utils.leven import levenshtein_ratio, levenshtein_ratio_bounded
+
+PAIRS = {
+    'close': ('desert sessions pj harvey', 'desert session pj harvey'),
+    'distant': ('desert sessions pj harvey', 'godspeed you black emperor'),
+    'lengths': ('muse', 'red hot chili peppers with friends'),
+}
+
+
+def main(number=20000):
+    ratio = SimaStr.leven_ratio
+    for label, (a_st, b_st) in PAIRS.items():
+        full = timeit.timeit(lambda: levenshtein_ratio(a_st, b_st),
+                             number=number)
+        bounded = timeit.timeit(
+            lambda: levenshtein_ratio_bounded(a_st, b_st, ratio),
+            number=number)
+        print(f'{label:>8}: full {full:.3f}s, bounded {bounded:.3f}s '
+              f'(x{full/bounded:.1f})')
+
+
+if __name__ == '__main__':
+    main()
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
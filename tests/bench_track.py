@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Track parsing benchmark, not run with the test suite
+
+    python -m tests.bench_track [number of tracks]
+
+Builds Track objects from a find/playlistinfo like reply and reports time
+and memory used, then time spent deriving Artist and Album objects.
+"""
+
+import sys
+import time
+import tracemalloc
+
+from sima.lib.track import Track
+
+
+def reply(count):
+    """Fake MPD reply, as lists of dict returned by python-musicpd"""
+    for i in range(count):
+        yield {'file': f'music/artist_{i//100}/album_{i//10}/{i:06}.flac',
+               'last-modified': '2012-04-02T20:48:59Z',
+               'format': '44100:16:2',
+               'artist': f'artist_{i//100}',
+               'albumartist': [f'artist_{i//100}', 'Various Artists'],
+               'artistsort': f'artist_{i//100}',
+               'album': f'album_{i//10}',
+               'title': f'title {i}',
+               'track': str(i % 10),
+               'date': '2011-12-01',
+               'genre': ['Rock', 'Stoner'],
+               'disc': '1/1',
+               'musicbrainz_artistid': 'd8e7e3e2-49ab-4f7c-b148-fc946d521f99',
+               'musicbrainz_albumid': 'ea2ef2cf-59e1-443a-817e-9066e3e0be4b',
+               'musicbrainz_trackid': 'fabf8fc9-2ae5-49c9-8214-a839c958d872',
+               'time': '220',
+               'duration': '220.000',
+               'pos': str(i), 'id': str(i)}
+
+
+def main(count=100000):
+    songs = list(reply(count))
+    start = time.perf_counter()
+    tracks = [Track(**song) for song in songs]
+    elapsed = time.perf_counter() - start
+    del tracks
+    tracemalloc.start()
+    tracks = [Track(**song) for song in songs]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'parsed {count} tracks in {elapsed:.3f}s, {size/2**20:.1f} MiB')
+    start = time.perf_counter()
+    for _ in range(3):  # repeated access as in plugins hot loops
+        for trk in tracks:
+            _ = trk.Artist, trk.Album
+    elapsed = time.perf_counter() - start
+    print(f'Artist/Album access x3 in {elapsed:.3f}s')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
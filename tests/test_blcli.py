@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import configparser
+import os
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+from sima.utils.blcli import BLCli
+
+
+class TestBLCli(unittest.TestCase):
+
+    def blcli(self, directory, **options):
+        config = configparser.ConfigParser()
+        config.read_dict({'sima': {'db_file': os.path.join(directory, 'sima.db')}})
+        return BLCli(config, options)
+
+    @patch.object(BLCli, 'connect')
+    def test_escaped_filters(self, _):
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.object(BLCli, 'find', create=True, return_value=[]) as find:
+            self.blcli(directory, command='bl-add-track', track='Don\'t "Stop" \\o/')
+            find.assert_called_once_with("(title == 'Don\\'t \\\"Stop\\\" \\\\o/')")
+            find.reset_mock()
+            self.blcli(directory, command='bl-add-album', album="Heaven's Door")
+            find.assert_called_once_with("(album == 'Heaven\\'s Door')", 'window', (0, 1))
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
@@ -1,12 +1,25 @@
 # -*- coding: utf-8 -*-
 
+import os
+import pickle
+import tempfile
+import threading
 import unittest
 import time
 
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
-from sima.lib.cache import DictCache
-from sima.lib.http import CacheController
+from requests import Request, Response, ConnectionError as HTTPConnectionError
+from requests.structures import CaseInsensitiveDict
+
+from sima.lib.cache import DictCache, FileCache, SqliteCache, migrate_filecache
+from sima.lib.cache import CachedResponse, get_codec, LRUCache, TieredCache
+from sima.lib.cache import NegativeCache
+from sima.lib.http import CacheController, HttpClient, STALE, STALE_IF_ERROR
+from sima.lib.meta import Artist
+from sima.lib.simafm import SimaFM
+from sima.utils.utils import SingleFlight, TokenBucket, WSError, WSNotFound
+from sima.utils.utils import WSInvalidAnswer
 
 TIME_FMT = "%a, %d %b %Y %H:%M:%S GMT"
 
@@ -83,6 +96,536 @@ class TestCacheControlRequest(unittest.TestCase):
         r = self.req({})
         assert not r
 
+    def test_cache_request_vary(self):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        resp = Mock(headers={'cache-control': 'max-age=3600', 'date': now,
+                             'vary': 'Accept-Language'})
+        resp.request.headers = {'Accept-Language': 'fr'}
+        self.c.cache = DictCache({self.url: resp})
+        assert not self.req({'Accept-Language': 'en'})
+        assert self.req({'Accept-Language': 'fr'}) == resp
+
+    def test_cache_request_stale(self):
+        earlier = time.strftime(TIME_FMT, time.gmtime(time.time() - 7200))
+        resp = Mock(headers={'cache-control': 'max-age=3600', 'date': earlier})
+        self.c.cache = DictCache({self.url: resp})
+        self.c.STALE_WHILE_REVALIDATE = 3700
+        self.assertEqual(self.c.lookup(Mock(url=self.url, headers={})),
+                         (self.url, STALE))
+        self.c.STALE_WHILE_REVALIDATE, self.c.STALE_IF_ERROR = 0, 3700
+        self.assertEqual(self.c.lookup(Mock(url=self.url, headers={})),
+                         (self.url, STALE_IF_ERROR))
+        assert not self.req({})
+        assert self.c.cache.get(self.url)  # no etag, kept while usable
+        self.c.STALE_IF_ERROR = 0
+        assert not self.req({})
+        assert not self.c.cache.get(self.url)
+
+
+
+def response(url, headers, body=b'{"foo": "bar"}'):
+    resp = Response()
+    resp.status_code = 200
+    resp.headers = CaseInsensitiveDict(headers)
+    resp._content = body
+    resp.request = Request('GET', url, headers={'Accept': '*/*'}).prepare()
+    resp.url = resp.request.url
+    return resp
+
+
+class TestFileCache(unittest.TestCase):
+    url = 'http://foo.com/bar'
+
+    def test_meta(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileCache(directory)
+            cache.set(self.url, response(self.url, {
+                'cache-control': 'max-age=60', 'etag': '"abc"'}))
+            meta = cache.get_meta(self.url)
+            self.assertEqual((meta.max_age, meta.etag), (60, '"abc"'))
+            self.assertEqual(cache.get(self.url).json(), {'foo': 'bar'})
+            # Files written before metadata were introduced
+            with open(cache._fn(self.url), 'wb') as flh:
+                pickle.dump(response(self.url, {'etag': '"def"'}), flh)
+            self.assertEqual(cache.get_meta(self.url).etag, '"def"')
+            self.assertEqual(cache.get(self.url).headers['etag'], '"def"')
+
+    def test_atomic_set(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileCache(directory)
+            cache.set(self.url, response(self.url, {'etag': '"abc"'}))
+            with patch('sima.lib.cache.dump', side_effect=[None, OSError('full')]):
+                with self.assertRaises(OSError):
+                    cache.set(self.url, response(self.url, {'etag': '"def"'}))
+            # previous file untouched, no leftover
+            self.assertEqual(cache.get_meta(self.url).etag, '"abc"')
+            self.assertEqual(len(os.listdir(directory)), 1)
+            # Partially written files are misses
+            with open(cache._fn(self.url), 'wb') as flh:
+                flh.write(pickle.dumps(response(self.url, {}))[:50])
+            self.assertIsNone(cache.get(self.url))
+            self.assertIsNone(cache.get_meta(self.url))
+            self.assertIsNone(cache.get_record(self.url))
+            self.assertIsNone(cache.get('http://foo.com/missing'))
+
+    def test_stale_meta_only(self):
+        earlier = time.strftime(TIME_FMT, time.gmtime(time.time() - 3700))
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileCache(directory)
+            cache.set(self.url, response(self.url, {
+                'cache-control': 'max-age=3600', 'date': earlier,
+                'etag': '"abc"'}))
+            cache.get = Mock(side_effect=AssertionError('body loaded'))
+            headers = {}
+            req = Mock(url=self.url, headers=headers)
+            self.assertFalse(CacheController(cache).cached_request(req))
+            self.assertEqual(headers['If-None-Match'], '"abc"')
+
+    def test_purge(self):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        earlier = time.strftime(TIME_FMT, time.gmtime(time.time() - 3700))
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileCache(directory)
+            fresh = {'cache-control': 'max-age=3600', 'date': now}
+            cache.set('http://foo.com/?artist=Keep', response(
+                'http://foo.com/?artist=Keep', fresh))
+            cache.set('http://foo.com/?artist=Gone', response(
+                'http://foo.com/?artist=Gone', fresh))
+            cache.set('http://foo.com/?artist=Stale', response(
+                'http://foo.com/?artist=Stale',
+                {'cache-control': 'max-age=3600', 'date': earlier}))
+            evicted = cache.purge(keep=lambda url: 'Gone' not in url, batch=2)
+            evicted += cache.purge(keep=lambda url: 'Gone' not in url, batch=2)
+            self.assertEqual(evicted, 2)
+            self.assertEqual(os.listdir(directory),
+                             [os.path.basename(cache._fn('http://foo.com/?artist=Keep'))])
+
+    def test_purge_last_use(self):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        fresh = {'cache-control': 'max-age=3600', 'date': now}
+        urls = ['http://foo.com/?artist=Used', 'http://foo.com/?artist=Unused']
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileCache(directory)
+            for idx, url in enumerate(urls):
+                cache.set(url, response(url, fresh))
+                earlier = time.time() - 600 + idx  # Used is the oldest
+                os.utime(cache._fn(url), (earlier, earlier))
+            cache.get_meta(urls[0])
+            self.assertEqual(cache.purge(max_entries=1), 1)
+            self.assertEqual(os.listdir(directory),
+                             [os.path.basename(cache._fn(urls[0]))])
+
+    def test_purge_meta_only(self):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        fresh = {'cache-control': 'max-age=3600', 'date': now}
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileCache(directory)
+            for url in ('http://foo.com/?artist=Keep', 'http://foo.com/?artist=Gone'):
+                cache.set(url, response(url, fresh))
+            with patch.object(CachedResponse, '__setstate__',
+                              side_effect=AssertionError('body loaded')):
+                self.assertEqual(cache.purge(keep=lambda url: 'Gone' not in url), 1)
+            self.assertEqual(cache.get_meta('http://foo.com/?artist=Keep').url,
+                             'http://foo.com/?artist=Keep')
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_cached_response(self):
+        codec = get_codec('zlib')
+        body = b'{"foo": "bar"}' * 100
+        cached = CachedResponse.from_response(
+            response('http://foo.com/bar', {'etag': '"abc"'}, body), codec)
+        self.assertLess(len(cached.body), len(body))
+        self.assertIs(CachedResponse.from_response(cached, codec), cached)
+        # Unpickled response decompresses on access
+        resp = pickle.loads(pickle.dumps(cached))
+        self.assertIs(resp._content, False)
+        self.assertEqual(resp.headers['etag'], '"abc"')
+        self.assertEqual(resp.content, body)
+        self.assertIn('zlib: ratio', codec.report())
+
+
+class TestSqliteCache(unittest.TestCase):
+    url = 'http://foo.com/bar?q=1'
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = SqliteCache(os.path.join(self.tmp.name, 'http', 'ws.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_set_get(self):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        self.assertIsNone(self.cache.get(self.url))
+        self.cache.set(self.url, response(self.url, {'Date': now,
+                       'Cache-Control': 'max-age=3600', 'ETag': '"abc"'}))
+        resp = self.cache.get(self.url)
+        self.assertEqual(resp.json(), {'foo': 'bar'})
+        self.assertEqual(resp.headers['etag'], '"abc"')
+        self.assertEqual(resp.request.headers['accept'], '*/*')
+        row = self.cache.get_database_connection().execute(
+            'SELECT max_age, etag, date FROM responses').fetchone()
+        self.assertEqual(row[:2], (3600, '"abc"'))
+        self.assertAlmostEqual(row[2], time.time(), delta=2)
+        meta = self.cache.get_meta(self.url)
+        self.assertEqual((meta.max_age, meta.etag, meta.vary), (3600, '"abc"', ()))
+        self.cache.delete(self.url)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_purge(self):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        earlier = time.strftime(TIME_FMT, time.gmtime(time.time() - 3700))
+        fresh = {'cache-control': 'max-age=3600', 'date': now}
+        stale = {'cache-control': 'max-age=3600', 'date': earlier}
+        for idx in range(4):
+            url = f'{self.url}&artist={idx}'
+            self.cache.set(url, response(url, fresh))
+        self.cache.set(f'{self.url}&artist=stale', response(self.url, stale))
+        self.cache.set(f'{self.url}&artist=etag',
+                       response(self.url, dict(stale, etag='"e"')))
+        # stale without etag
+        self.assertEqual(self.cache.purge(), 1)
+        # artist 3 no longer wanted
+        self.assertEqual(self.cache.purge(keep=lambda url: not url.endswith('3')), 1)
+        connection = self.cache.get_database_connection()
+        connection.execute('UPDATE responses SET last_access = 10')
+        connection.execute('UPDATE responses SET last_access = 5 WHERE url = ?',
+                           (f'{self.url}&artist=1',))
+        connection.close()
+        self.cache.get(f'{self.url}&artist=0')  # accessed now
+        # stale first, then least recently used
+        self.assertEqual(self.cache.purge(max_entries=2), 2)
+        self.assertIsNone(self.cache.get_meta(f'{self.url}&artist=etag'))
+        self.assertIsNone(self.cache.get_meta(f'{self.url}&artist=1'))
+        self.assertEqual(len(self.cache), 2)
+        body = len(response(self.url, {}).content)
+        self.assertEqual(self.cache.purge(max_bytes=body), 1)
+        self.assertIsNotNone(self.cache.get_meta(f'{self.url}&artist=0'))
+
+    def test_codec(self):
+        cache = SqliteCache(os.path.join(self.tmp.name, 'zlib.db'),
+                            codec=get_codec('zlib'))
+        body = b'{"foo": "bar"}' * 100
+        cache.set(self.url, response(self.url, {}, body))
+        size, = cache.get_database_connection().execute(
+            'SELECT size FROM responses').fetchone()
+        self.assertLess(size, len(body))
+        resp = cache.get(self.url)
+        self.assertIs(resp._content, False)
+        self.assertEqual(resp.content, body)
+
+    def test_controller(self):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        ctrl = CacheController(self.cache)
+        request = Request('GET', self.url).prepare()
+        ctrl.cache_response(request, response(self.url, {
+            'date': now, 'cache-control': 'max-age=3600'}))
+        resp = ctrl.cached_request(Request('GET', self.url).prepare())
+        self.assertTrue(resp.from_cache)
+        self.assertEqual(resp.content, b'{"foo": "bar"}')
+
+    def test_migrate_filecache(self):
+        directory = os.path.join(self.tmp.name, 'LastFM')
+        filecache = FileCache(directory)
+        for idx in range(3):
+            url = f'{self.url}{idx}'
+            filecache.set(url, response(url, {'etag': str(idx)}))
+        with open(os.path.join(directory, 'corrupted'), 'wb') as flh:
+            flh.write(b'not a pickle')
+        self.assertEqual(migrate_filecache(directory, self.cache), (3, 1))
+        self.assertEqual(self.cache.get(f'{self.url}1').headers['etag'], '1')
+
+
+class TestTieredCache(unittest.TestCase):
+    url = 'http://foo.com/bar'
+
+    def test_lru(self):
+        cache = LRUCache(max_entries=2, max_bytes=30)
+        for idx in range(3):
+            cache.set(idx, response(self.url, {}, b'x' * 10))
+            cache.get(0)
+        self.assertEqual(list(cache.data), [2, 0])
+        cache.set(3, response(self.url, {}, b'x' * 20))
+        self.assertEqual((list(cache.data), cache.size), ([0, 3], 30))
+
+    def test_tiers(self):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        with tempfile.TemporaryDirectory() as directory:
+            l2 = SqliteCache(os.path.join(directory, 'ws.db'))
+            l2.set(self.url, response(self.url, {'date': now}))
+            cache = TieredCache(LRUCache(max_entries=10), l2)
+            self.assertIsNone(cache.get_meta('http://foo.com/missing'))
+            self.assertIsNotNone(cache.get_meta(self.url))
+            self.assertEqual(cache.get(self.url).json(), {'foo': 'bar'})
+            self.assertIn(self.url, cache.l1)  # promoted
+            self.assertIsNotNone(cache.get_meta(self.url))
+            self.assertEqual(cache.stats, {'l1_hit': 1, 'l1_miss': 2,
+                                           'l2_hit': 1, 'l2_miss': 1})
+            # write through
+            cache.set('http://foo.com/new', response(self.url, {'date': now}))
+            self.assertIsNotNone(l2.get_meta('http://foo.com/new'))
+            cache.delete(self.url)
+            self.assertIsNone(cache.get(self.url))
+
+    def test_record(self):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        resp = response(self.url, {'date': now})
+        resp.record = ('foo/1', (('foo', 'bar'),))
+        with tempfile.TemporaryDirectory() as directory:
+            l2 = SqliteCache(os.path.join(directory, 'ws.db'))
+            l2.set(self.url, resp)
+            cache = TieredCache(LRUCache(max_entries=10), l2)
+            with patch.object(l2, 'get') as get:
+                self.assertEqual(cache.get_record(self.url), resp.record)
+                get.assert_not_called()  # body not loaded
+            self.assertNotIn(self.url, cache.l1)
+            self.assertIsNone(cache.get_record('http://foo.com/missing'))
+            cache.l1.set(self.url, resp)
+            with patch.object(l2, 'get_record') as get_record:
+                self.assertEqual(cache.get_record(self.url), resp.record)
+                get_record.assert_not_called()
+
+    def test_record_promoted(self):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        resp = response(self.url, {'date': now})
+        resp.record = ('foo/1', (('foo', 'bar'),))
+        with tempfile.TemporaryDirectory() as directory:
+            FileCache(directory).set(self.url, resp)
+            # Restart, empty L1
+            l2 = FileCache(directory)
+            cache = TieredCache(LRUCache(max_entries=10), l2)
+            with patch.object(l2, 'get_record', wraps=l2.get_record) as get_record, \
+                    patch.object(CachedResponse, '__setstate__',
+                                 side_effect=AssertionError('body loaded')):
+                for _ in range(3):
+                    self.assertEqual(cache.get_record(self.url), resp.record)
+            get_record.assert_called_once_with(self.url)
+            self.assertEqual(len(cache.l1), 1)
+            self.assertEqual(cache.get(self.url).json(), {'foo': 'bar'})
+            # Stale promoted records are dropped on write
+            resp.record = ('foo/1', ())
+            cache.set(self.url, resp)
+            self.assertEqual(cache.get_record(self.url), resp.record)
+            self.assertEqual(FileCache(directory).get_record(self.url), resp.record)
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    @patch('sima.lib.cache.time.monotonic')
+    def test_ttl(self, monotonic):
+        monotonic.return_value = 100
+        cache = NegativeCache(ttl=60, max_entries=2)
+        cache.set('empty', ())
+        cache.set('missing', WSNotFound('not found'))
+        self.assertEqual(cache.get('empty'), ())
+        with self.assertRaisesRegex(WSNotFound, 'not found'):
+            cache.get('missing')
+        cache.set('other', ())
+        self.assertNotIn('empty', cache)
+        monotonic.return_value = 160
+        self.assertIsNone(cache.get('missing'))
+        self.assertEqual(len(cache), 1)
+        NegativeCache(ttl=0).set('empty', ())
+
+    def test_simafm(self):
+        client = SimaFM()
+        client.negative = NegativeCache(ttl=60)
+        client.stats = {'negative': 0}
+        client.http = Mock(side_effect=WSNotFound('not found'))
+        for _ in range(2):
+            with self.assertRaises(WSNotFound):
+                list(client.get_similar(Artist(name='Foo',
+                                               mbid='d8e7e3e2-49ab-4f7c-b148-fc946d521f99')))
+            with self.assertRaises(WSNotFound):
+                list(client.get_similar(Artist(name='Foo')))
+            with self.assertRaises(WSNotFound):  # canonical name
+                list(client.get_similar(Artist(name='FOO')))
+        self.assertEqual(client.http.call_count, 2)
+        self.assertEqual(client.stats['negative'], 4)
+        client.http = Mock(return_value=())
+        self.assertEqual(list(client.get_toptrack(Artist(name='Foo'))), [])
+        self.assertEqual(list(client.get_toptrack(Artist(name='Foo'))), [])
+        self.assertEqual(client.http.call_count, 1)
+
+
+class TestSimaFM(unittest.TestCase):
+    url = 'http://foo.com/bar'
+
+    def test_toptrack_record(self):
+        client = SimaFM()
+        body = b'{"toptracks": {"track": [{"name": "Bar", "playcount": "42", "duration": "180"}]}}'
+        rows = client._toptrack_record(response(self.url, {}, body))
+        self.assertEqual(rows, (('Bar', None, 42, 180),))
+        client.negative = NegativeCache()
+        client.http = Mock(return_value=rows)
+        trk = next(client.get_toptrack(Artist(name='Foo')))
+        self.assertEqual((trk.title, trk.duration, trk.time), ('Bar', 180, 180))
+
+    def test_malformed_record(self):
+        client = SimaFM()
+        body = b'{"toptracks": {"track": [{"name": "Bar", "playcount": "many"}]}}'
+        with self.assertRaises(WSInvalidAnswer):
+            client._toptrack_record(response(self.url, {}, body))
+        body = b'{"similarartists": {"artist": [{"name": "Bar", "match": "high"}]}}'
+        with self.assertRaises(WSInvalidAnswer):
+            client._similar_record(response(self.url, {}, body))
+
+
+class TestHttpClient(unittest.TestCase):
+    url = 'http://foo.com/bar'
+
+    def send(self, request, **kwargs):
+        now = time.strftime(TIME_FMT, time.gmtime())
+        resp = response(request.url, {'date': now, 'cache-control': 'max-age=60'})
+        resp.request = request
+        return resp
+
+    def test_record(self):
+        with tempfile.TemporaryDirectory() as directory:
+            client = HttpClient(SqliteCache(os.path.join(directory, 'ws.db')),
+                                stats={'total': 0, 'ccontrol': 0, 'etag': 0})
+            client.sess.send = Mock(side_effect=self.send)
+            parse = Mock(side_effect=lambda resp: tuple(resp.json().items()))
+            record = ('foo/1', parse)
+            self.assertEqual(client(self.url, {}, record), (('foo', 'bar'),))
+            self.assertEqual(client(self.url, {}, record), (('foo', 'bar'),))
+            self.assertEqual(client.sess.send.call_count, 1)
+            self.assertEqual(parse.call_count, 1)  # cached record
+            # New record schema, parsed again from cached response
+            self.assertEqual(client(self.url, {}, ('foo/2', parse)),
+                             (('foo', 'bar'),))
+            self.assertEqual((client.sess.send.call_count, parse.call_count), (1, 2))
+            self.assertEqual(client(self.url, {}).json(), {'foo': 'bar'})
+
+    def test_coalesced(self):
+        # The leader answers once the three followers wait for its call
+        followers = threading.Barrier(4, timeout=5)
+
+        class Waiting(threading.Event):
+            def wait(self, timeout=None):
+                followers.wait()
+                return super().wait(timeout)
+
+        class Flights(SingleFlight):
+            class _Call(SingleFlight._Call):
+                def __init__(self):
+                    super().__init__()
+                    self.done = Waiting()
+
+        def send(request, **kwargs):
+            followers.wait()
+            return self.send(request, **kwargs)
+        stats = {'total': 0, 'ccontrol': 0, 'etag': 0, 'coalesced': 0}
+        clients = [HttpClient(DictCache(), stats=stats, flights=Flights())]
+        clients.append(HttpClient(clients[0].controller.cache, stats=stats,
+                                  flights=clients[0].flights))
+        for client in clients:
+            client.sess.send = Mock(side_effect=send)
+        results = []
+        threads = [threading.Thread(target=lambda cli: results.append(cli(self.url, {})),
+                                    args=(cli,)) for cli in clients * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertFalse(followers.broken)
+        self.assertEqual(sum(cli.sess.send.call_count for cli in clients), 1)
+        self.assertEqual(stats['coalesced'], 3)
+        self.assertEqual(len({id(resp) for resp in results}), 1)
+        self.assertEqual(len(clients[0].flights), 0)
+
+    def stale_client(self, etag=None):
+        earlier = time.strftime(TIME_FMT, time.gmtime(time.time() - 7200))
+        headers = {'date': earlier, 'cache-control': 'max-age=3600'}
+        if etag:
+            headers['etag'] = etag
+        client = HttpClient(DictCache({self.url: response(self.url, headers)}),
+                            stats={'total': 0, 'ccontrol': 0, 'etag': 0},
+                            limiter=TokenBucket(100, 10), flights=SingleFlight())
+        return client
+
+    def test_stale_while_revalidate(self):
+        def not_modified(request, **kwargs):
+            resp = self.send(request, **kwargs)
+            resp.status_code = 304
+            return resp
+        client = self.stale_client(etag='"foo"')
+        client.controller.STALE_WHILE_REVALIDATE = 3700
+        client.sess.send = Mock()
+        threads = []
+
+        def thread(*args, **kwargs):
+            threads.append(threading.Thread(*args, **kwargs))
+            return threads[-1]
+        with patch('sima.lib.http.Session') as session, \
+                patch('sima.lib.http.Thread', side_effect=thread):
+            sess = session.return_value.__enter__.return_value
+            sess.merge_environment_settings.return_value = {}
+            sess.send.side_effect = not_modified
+            self.assertEqual(client(self.url, {}).json(), {'foo': 'bar'})
+            self.assertEqual(len(threads), 1)
+            threads[0].join(5)
+        self.assertFalse(threads[0].is_alive())
+        client.sess.send.assert_not_called()
+        self.assertEqual(sess.send.call_args.args[0].headers['If-None-Match'], '"foo"')
+        self.assertEqual(client(self.url, {}).json(), {'foo': 'bar'})
+        self.assertEqual(client.stats, {'total': 2, 'ccontrol': 1, 'etag': 1,
+                                        'stale': 1})
+
+    def test_stale_if_error(self):
+        client = self.stale_client()
+        client.controller.STALE_IF_ERROR = 3700
+        client.sess.send = Mock(side_effect=HTTPConnectionError('down'))
+        self.assertEqual(client(self.url, {}).json(), {'foo': 'bar'})
+        self.assertEqual(client.stats['stale_if_error'], 1)
+        client.controller.STALE_IF_ERROR = 0
+        with self.assertRaises(WSError):
+            client(self.url, {})
+
+    def test_stale_if_error_answer(self):
+        def error_answer(request, **kwargs):
+            resp = self.send(request, **kwargs)
+            resp._content = b'{"error": 16, "message": "temporarily unavailable"}'
+            return resp
+
+        def parse(resp):
+            data = resp.json()
+            if 'error' in data:
+                raise WSError(data['message'])
+            return tuple(data.items())
+        client = self.stale_client()
+        client.controller.STALE_IF_ERROR = 3700
+        client.sess.send = Mock(side_effect=error_answer)
+        self.assertEqual(client(self.url, {}, ('foo/1', parse)), (('foo', 'bar'),))
+        self.assertEqual(client.stats['stale_if_error'], 1)
+        # stale response kept
+        self.assertEqual(client.controller.cache.get(self.url).json(), {'foo': 'bar'})
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_do(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do('key', lambda: 42), (42, False))
+        with self.assertRaises(ValueError):
+            flights.do('key', int, 'nan')
+        self.assertEqual(len(flights), 0)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    @patch('sima.utils.utils.sleep')
+    @patch('sima.utils.utils.monotonic')
+    def test_burst(self, monotonic, sleep):
+        monotonic.return_value = 100
+        bucket = TokenBucket(rate=0.5, capacity=2)
+        self.assertEqual([bucket.acquire() for _ in range(4)], [0, 0, 2, 4])
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [2, 4])
+        monotonic.return_value = 110  # refilled, up to capacity
+        self.assertEqual([bucket.acquire() for _ in range(3)], [0, 0, 2])
+
 # VIM MODLINE
 # vim: ai ts=4 sw=4 sts=4 expandtab
 
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from sima.utils.leven import levenshtein, levenshtein_ratio
+from sima.utils.leven import levenshtein_bounded, levenshtein_ratio_bounded
+from sima.utils.leven import levenshtein_ratios, close_matches
+from sima.utils import leven
+
+
+class TestLevenshtein(unittest.TestCase):
+
+    def test_bounded(self):
+        pairs = [('kitten', 'sitting'), ('', 'abc'), ('abc', ''),
+                 ('flaw', 'lawn'), ('Desert Sessions', 'Desert Session'),
+                 ('same', 'same')]
+        for a_st, b_st in pairs:
+            dist = levenshtein(a_st, b_st)
+            for max_dist in range(6):
+                expected = dist if dist <= max_dist else None
+                self.assertEqual(levenshtein_bounded(a_st, b_st, max_dist),
+                                 expected, f'{a_st}/{b_st} ({max_dist})')
+
+    def test_ratio_bounded(self):
+        self.assertEqual(levenshtein_ratio_bounded('abc', 'abc', 0.82), 1)
+        self.assertEqual(levenshtein_ratio_bounded('', '', 0.82), 1)
+        self.assertIsNone(levenshtein_ratio_bounded('kitten', 'sitting', 0.82))
+        self.assertEqual(levenshtein_ratio_bounded('kitten', 'sitting', 0.5),
+                         levenshtein_ratio('kitten', 'sitting'))
+
+    def test_batch(self):
+        names = ['Sitting', 'kitten', '', 'Touché Amoré', 'k', 'mitten bitten']
+        expected = [levenshtein_ratio('kitten', name) for name in names]
+        numpy = leven.numpy
+        try:
+            for backend in {numpy, None}:
+                leven.numpy = backend
+                ratios = levenshtein_ratios('kitten', names)
+                for ratio, exp in zip(ratios, expected):
+                    self.assertAlmostEqual(ratio, exp)
+                self.assertEqual(levenshtein_ratios('', ['', 'a']), [1.0, 0.0])
+                self.assertEqual(close_matches('kitten', names, 2, 0.5),
+                                 ['kitten', 'Sitting'])
+        finally:
+            leven.numpy = numpy
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from difflib import get_close_matches
+
+from sima.utils.leven import close_matches
+from sima.utils.matcher import ShardedMatcher
+
+
+class TestShardedMatcher(unittest.TestCase):
+
+    def test_close_matches(self):
+        names = [f'Artist {i}' for i in range(100)] + ['The Doors', 'Doors']
+        matcher = ShardedMatcher(3, 'levenshtein')
+        try:
+            self.assertTrue(matcher.load('artists', names))
+            self.assertFalse(matcher.load('artists', reversed(names)))
+            words = ['Artist 42', 'The Door', 'Nothing alike']
+            self.assertEqual(matcher.close_matches('artists', words, 5, 0.7),
+                             [close_matches(word, names, 5, 0.7) for word in words])
+            self.assertEqual(matcher.close_matches('unknown', ['Doors']), [[]])
+        finally:
+            matcher.shutdown()
+
+    def test_difflib(self):
+        names = [f'Artist {i}' for i in range(100)] + ['The Doors', 'Doors']
+        matcher = ShardedMatcher(3, 'difflib')
+        try:
+            matcher.load('artists', names)
+            words = ['Artist 42', 'The Door', 'Nothing alike']
+            self.assertEqual(matcher.close_matches('artists', words, 5, 0.7),
+                             [get_close_matches(word, names, 5, 0.7) for word in words])
+        finally:
+            matcher.shutdown()
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
@@ -44,8 +44,8 @@ class TestMetaObject(unittest.TestCase):
 
     def test_aliases(self):
         art0 = Meta(name='Silver Mt. Zion')
-        art0.add_alias('A Silver Mt. Zion')
-        art0.add_alias(art0)
+        art0 = art0.with_alias('A Silver Mt. Zion')
+        self.assertIs(art0.with_alias(art0), art0)
 
         # Controls 'Silver Mt. Zion' is not in aliases
         self.assertTrue('Silver Mt. Zion' not in art0.aliases)
@@ -57,12 +57,12 @@ class TestMetaObject(unittest.TestCase):
         self.assertTrue(art0 == Meta(name='A Silver Mt. Zion'))
 
         art1 = Meta(name='Silver Mt. Zion')
-        art1.add_alias(art0)
+        art1 = art1.with_alias(art0)
         self.assertIn('A Silver Mt. Zion', art1.aliases)
 
         art3 = Meta(name='foo')
-        art3.add_alias('Silver Mt. Zion')
-        art1.add_alias(art3)
+        art3 = art3.with_alias('Silver Mt. Zion')
+        art1 = art1.with_alias(art3)
         self.assertNotIn('Silver Mt. Zion', art1.aliases)
 
     def test_union(self):
@@ -118,7 +118,7 @@ class TestMetaObject(unittest.TestCase):
         self.assertEqual(heavens_door.name_sz, target)
         self.assertEqual(heavens_door.name, name)
         self.assertEqual(heavens_door.names_sz, {target})
-        heavens_door.add_alias(name+" LP")
+        heavens_door = heavens_door.with_alias(name+" LP")
         self.assertEqual(heavens_door.aliases_sz, {target+" LP"})
         # Controls inheritance
         heavens_door = Album(name=name)
@@ -132,6 +132,19 @@ class TestMetaObject(unittest.TestCase):
         self.assertEqual(bonnie.name_sz, target)
         self.assertEqual(bonnie.name, name)
 
+    def test_copy_on_write(self):
+        art = Meta(name='Silver Mt. Zion')
+        names = art.names
+        self.assertIsInstance(names, frozenset)
+        self.assertIs(art.names, names)
+        other = art.with_alias('A Silver Mt. Zion')
+        self.assertEqual(art.names, {'Silver Mt. Zion'})
+        self.assertEqual(other.names, {'Silver Mt. Zion', 'A Silver Mt. Zion'})
+        other = other.with_alias('Thee Silver Mt. Zion')
+        self.assertEqual(other.names_sz, other.names)
+        self.assertEqual(art.names, {'Silver Mt. Zion'})
+        with self.assertRaises(AttributeError):
+            art.aliases = frozenset()
 
 
 class TestArtistObject(unittest.TestCase):
@@ -191,4 +204,21 @@ class TestMetaContainers(unittest.TestCase):
         art01._Meta__mbid = art00.mbid.replace('229', '330')
         self.assertFalse(MetaContainer([art00]) & MetaContainer([art01]))
 
+    def test_alias_merging(self):
+        mbid = 'f22942a1-6f70-4f48-866e-238cb2308fbd'
+        art00 = Meta(name='Aphex Twin', mbid=mbid)
+        art01 = Meta(name='AFX', mbid=mbid)
+        art02 = Meta(name='Aphex Twin', mbid=mbid.replace('229', '330'))
+        art03 = Meta(name='Aphex Twin')
+        cont = MetaContainer([art00, art01, art02, art03])
+        self.assertEqual(len(cont), 2)
+        self.assertIn('AFX', cont)
+        self.assertIn(Meta(name='AFX'), cont)
+        self.assertNotIn(Meta(name='AFX', mbid=mbid.replace('229', '440')), cont)
+        self.assertEqual(list(cont)[0].names, {'Aphex Twin', 'AFX'})
+        # Merged objects are copies
+        self.assertEqual(art00.names, {'Aphex Twin'})
+        self.assertEqual(len(cont - MetaContainer([art01])), 1)
+        self.assertEqual(len(cont | MetaContainer([Meta(name='Autechre')])), 3)
+
 # vim: ai ts=4 sw=4 sts=4 expandtab
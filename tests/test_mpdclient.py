@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+
+import configparser
+import shlex
+import unittest
+
+from unittest.mock import Mock, patch
+
+from sima.lib.meta import Album, Artist
+from sima.lib.mpdfilter import all_of, any_of, tag_filter
+from sima.lib.track import Track
+from sima.mpdclient import MPD, PlayerError, PlaylistModel, Snapshot, TrackCounter
+from sima.plugins.internal.crop import Crop
+
+STATUS = {'repeat': '0', 'random': '1', 'single': '0', 'consume': '0',
+          'playlist': '42', 'playlistlength': '4', 'state': 'play'}
+
+
+class FakeConnection:
+    """In memory MPD connection answering commands from replies
+
+    Replies map commands, as tuples of command name and arguments, to
+    response lines (without the final OK), unknown commands are
+    acknowledged with an error. Commands received are kept in commands,
+    command_lists counts command lists.
+    """
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.commands = []
+        self.command_lists = 0
+        self._written = ''
+        self._lines = []
+        self._command_list = None
+
+    def _answer(self, command):
+        self.commands.append(command)
+        if command not in self.replies:
+            return None
+        reply = self.replies[command]
+        return reply(command) if callable(reply) else list(reply)
+
+    def _process(self, line):
+        if line == 'command_list_ok_begin':
+            self._command_list = []
+            self.command_lists += 1
+            return
+        if self._command_list is not None and line != 'command_list_end':
+            self._command_list.append(tuple(shlex.split(line)))
+            return
+        if line == 'command_list_end':
+            for command in self._command_list:
+                reply = self._answer(command)
+                if reply is None:
+                    self._lines.append(f'ACK [5@0] {{{command[0]}}} unknown')
+                    break
+                self._lines.extend(reply + ['list_OK'])
+            else:
+                self._lines.append('OK')
+            self._command_list = None
+            return
+        command = tuple(shlex.split(line))
+        reply = self._answer(command)
+        if reply is None:
+            self._lines.append(f'ACK [5@0] {{{command[0]}}} unknown')
+        else:
+            self._lines.extend(reply + ['OK'])
+
+    def write(self, data):
+        self._written += data
+
+    def flush(self):
+        *lines, self._written = self._written.split('\n')
+        for line in lines:
+            self._process(line)
+
+    def readline(self):
+        return self._lines.pop(0) + '\n' if self._lines else ''
+
+    def close(self):
+        pass
+
+
+def fake_player(replies, version='0.23.5', blocklist=()):
+    """MPD client connected to a FakeConnection"""
+    config = configparser.ConfigParser()
+    config.read_dict({'sima': {}})
+    player = MPD(config)
+    player.mpd_version = version
+    player._sock = player._rfile = player._wfile = FakeConnection(replies)
+    player.database = Mock(view_bl=Mock(return_value=list(blocklist)))
+    player.database.get_bl_album.return_value = False
+    player.database.get_bl_artist.return_value = False
+    return player
+
+
+def lines(tag, *values):
+    return [f'{tag}: {value}' for value in values]
+
+
+def playlist(length):
+    return [Track(file=f'file_{i}', pos=i, artist=f'artist_{i}')
+            for i in range(length)]
+
+
+def snapshot_replies(length, current, version=42):
+    """status, currentsong and plchanges replies for a queue of length tracks"""
+    status = dict(STATUS, playlist=str(version), playlistlength=str(length))
+    tracks = [[f'file: file_{i}', f'Pos: {i}'] for i in range(length)]
+    return {
+        ('status',): [f'{key}: {val}' for key, val in status.items()],
+        ('currentsong',): tracks[current],
+        ('plchanges', '0'): sum(tracks, []),
+        }
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_playmode(self):
+        snap = Snapshot(STATUS, Track(), [])
+        self.assertEqual(snap.playmode, {'repeat': False, 'random': True,
+                                         'single': False, 'consume': False})
+        self.assertEqual(snap.state, 'play')
+
+    def test_queue(self):
+        plst = playlist(4)
+        snap = Snapshot(STATUS, plst[1], plst)
+        self.assertEqual([t.file for t in snap.queue], ['file_3', 'file_2'])
+        # Not playing, the whole playlist is ahead
+        snap = Snapshot({'state': 'stop'}, Track(), plst)
+        self.assertEqual(len(snap.queue), 4)
+        self.assertEqual(snap.state, 'stop')
+
+    def test_deny_counter(self):
+        plst = playlist(4)
+        snap = Snapshot(STATUS, plst[1], plst)
+        self.assertEqual(len(snap.deny_counter.files), 4)
+        snap = Snapshot(dict(STATUS, random='0'), plst[1], plst)
+        self.assertEqual(set(snap.deny_counter.files), {'file_2', 'file_3'})
+
+
+class TestPlayerSnapshot(unittest.TestCase):
+    snapshot_cmds = [('status',), ('currentsong',)]
+
+    def test_round_trip(self):
+        player = fake_player(snapshot_replies(4, current=1))
+        snap = player.snapshot
+        self.assertEqual(player._rfile.commands,
+                         self.snapshot_cmds + [('plchanges', '0')])
+        self.assertEqual(player._rfile.command_lists, 1)
+        self.assertEqual(snap.current.file, 'file_1')
+        self.assertEqual(len(snap.playlist), 4)
+        self.assertIs(player.snapshot, snap)
+        self.assertEqual(len(player._rfile.commands), 3)
+
+    def test_point_in_time(self):
+        player = fake_player(snapshot_replies(4, current=1))
+        snap = player.snapshot
+        counter = snap.playlist_counter
+        player._snapshot = None
+        replies = snapshot_replies(2, current=1, version=43)
+        replies[('plchanges', '42')] = ['file: new', 'Pos: 1']
+        player._rfile.replies = replies
+        self.assertEqual([t.file for t in player.snapshot.playlist], ['file_0', 'new'])
+        # Earlier snapshot unchanged
+        self.assertEqual([t.file for t in snap.playlist],
+                         [f'file_{i}' for i in range(4)])
+        self.assertIs(snap.playlist_counter, counter)
+        self.assertEqual(len(counter.files), 4)
+
+    def test_retry(self):
+        player = fake_player(snapshot_replies(4, current=1))
+        player.snapshot
+        player._snapshot = None
+        # Two tracks added, the first change is missing: out of sync
+        replies = snapshot_replies(6, current=1, version=44)
+        replies[('plchanges', '42')] = ['file: file_5', 'Pos: 5']
+        player._rfile.replies = replies
+        self.assertEqual(len(player.snapshot.playlist), 6)
+        self.assertEqual(player._rfile.commands[3:],
+                         self.snapshot_cmds + [('plchanges', '42')] +
+                         self.snapshot_cmds + [('plchanges', '0')])
+        # Second attempt, a complete reload, failing as well
+        player._snapshot = None
+        player._playlist.clear()
+        replies[('plchanges', '0')] = ['file: file_5', 'Pos: 5']
+        with self.assertRaises(PlayerError):
+            player.snapshot
+        self.assertEqual(player._rfile.command_lists, 5)
+
+    def test_invalidation(self):
+        replies = snapshot_replies(4, current=1)
+        replies.update({('clear',): [], ('add', 'file_0'): [],
+                        ('plchanges', '42'): []})
+        player = fake_player(replies)
+        snap = player.snapshot
+        player.clear()
+        self.assertIsNot(player.snapshot, snap)
+        snap = player.snapshot
+        player.add(playlist(1))
+        self.assertIsNot(player.snapshot, snap)
+        player.status()  # not a queue command
+        self.assertIsNotNone(player._snapshot)
+        self.assertEqual(player._rfile.command_lists, 4)
+
+
+class TestPlaylistModel(unittest.TestCase):
+
+    def test_update(self):
+        model = PlaylistModel()
+        self.assertTrue(model.update(2, 3, playlist(3)))
+        self.assertEqual(model.counter.artists[('artist_1', None)], 1)
+        # Replace second track and crop the last one
+        new = Track(file='new', pos=1, artist='artist_0')
+        self.assertTrue(model.update(3, 2, [new]))
+        self.assertEqual([t.file for t in model.tracks], ['file_0', 'new'])
+        self.assertEqual(model.counter.artists[('artist_0', None)], 2)
+        self.assertNotIn(('artist_1', None), model.counter.artists)
+        self.assertNotIn('file_2', model.counter.files)
+        self.assertEqual(model.version, 3)
+
+    def test_out_of_sync(self):
+        model = PlaylistModel()
+        model.update(5, 3, playlist(3))
+        # playlist version going backward
+        self.assertFalse(model.update(4, 3, []))
+        self.assertIsNone(model.version)
+        self.assertFalse(model.tracks)
+        # missing tracks
+        self.assertFalse(model.update(6, 3, playlist(3)[1:]))
+        self.assertIsNone(model.version)
+
+
+class TestQueue(unittest.TestCase):
+
+    def test_add(self):
+        player = fake_player({('add', 'file_0'): [], ('add', 'file_1'): []})
+        self.assertIsNone(player.add(playlist(2)))
+        self.assertEqual(player._rfile.commands, [('add', 'file_0'), ('add', 'file_1')])
+
+    def test_add_position(self):
+        player = fake_player({('addid', 'file_0', '3'): ['Id: 10'],
+                              ('addid', 'file_1', '4'): ['Id: 11']})
+        self.assertEqual(player.add(playlist(2), 3), ['10', '11'])
+        self.assertEqual(len(player._rfile.commands), 2)
+
+    def test_add_empty(self):
+        player = fake_player({})
+        self.assertEqual(player.add([]), [])
+        self.assertEqual(player._rfile.commands, [])
+
+    def test_delete_range(self):
+        player = fake_player({('delete', '0:2'): []})
+        player.delete_range(0, 2)
+        player.delete_range(2, 2)
+        self.assertEqual(player._rfile.commands, [('delete', '0:2')])
+
+    def test_crop(self):
+        replies = snapshot_replies(6, current=4)
+        replies[('delete', '0:3')] = []
+        player = fake_player(replies)
+        config = configparser.ConfigParser()
+        config.read_dict({'crop': {'consume': '1'}})
+        Crop(Mock(config=config, player=player, enabled=True)).callback_next_song()
+        self.assertEqual(player._rfile.commands[-1], ('delete', '0:3'))
+        self.assertIsNone(player._snapshot)
+
+
+class TestSearchAlbums(unittest.TestCase):
+    mbids = ('ea2ef2cf-59e1-443a-817e-9066e3e0be4b',
+             'fabf8fc9-2ae5-49c9-8214-a839c958d872')
+
+    def albums_filter(self, exclude=''):
+        return all_of(tag_filter('albumartist', 'Foo'),
+                      tag_filter('album', '', '!='), exclude)
+
+    def test_search_albums(self):
+        albums_filter = self.albums_filter()
+        same = [all_of(tag_filter('album', 'Same'),
+                       tag_filter('musicbrainz_albumid', mbid))
+                for mbid in self.mbids]
+        other = tag_filter('album', 'Other')
+        player = fake_player({
+            ('list', 'album', albums_filter): lines('Album', 'Same', 'Other'),
+            ('list', 'musicbrainz_albumid',
+             all_of(albums_filter, tag_filter('album', 'Same'))):
+                lines('MUSICBRAINZ_ALBUMID', *self.mbids),
+            ('list', 'musicbrainz_albumid',
+             all_of(albums_filter, other)): [],
+            # Same album name, releases by different album artists
+            ('list', 'albumartist', same[0]): lines('AlbumArtist', 'Foo'),
+            ('list', 'musicbrainz_albumartistid', same[0]): [],
+            ('list', 'albumartist', same[1]): lines('AlbumArtist', 'Various Artists'),
+            ('list', 'musicbrainz_albumartistid', same[1]): [],
+            # No album artist set, mostly tracks by Foo
+            ('list', 'albumartist', other): [],
+            ('list', 'musicbrainz_albumartistid', other): [],
+            ('count', other, 'group', 'artist'):
+                lines('Artist', 'Foo') + ['songs: 9', 'playtime: 0'] +
+                lines('Artist', 'Bar') + ['songs: 1', 'playtime: 0'],
+            })
+        albums = player.search_albums(Artist(name='Foo'))
+        self.assertEqual([(alb.name, alb.mbid) for alb in albums],
+                         [('Same', self.mbids[0]), ('Other', None)])
+        self.assertEqual(len(player._rfile.commands), 10)
+
+    def test_blocklist(self):
+        blocklist = [{'file': 'foo/same/01.flac'}]
+        albums_filter = self.albums_filter(tag_filter('file', 'foo/same/01.flac', '!='))
+        # Only blocklisted tracks in "Same" album, not listed
+        player = fake_player({('list', 'album', albums_filter): []},
+                             blocklist=blocklist)
+        self.assertEqual(player.search_albums(Artist(name='Foo')), [])
+        self.assertEqual(player._rfile.commands,
+                         [('list', 'album', albums_filter)])
+
+
+class TestFind(unittest.TestCase):
+    artist_filter = any_of(all_of(tag_filter('artist', 'Foo')))
+    bl_filter = tag_filter('file', 'foo/bl.flac', '!=')
+
+    def tracks(self, start, end):
+        return [line for i in range(start, end)
+                for line in (f'file: foo/{i:02}.flac', 'Artist: Foo')]
+
+    def test_iter_find(self):
+        player = fake_player({
+            ('find', 'foo', 'window', '0:2'): self.tracks(0, 2),
+            ('find', 'foo', 'window', '2:4'): self.tracks(2, 4),
+            ('find', 'foo', 'window', '4:6'): self.tracks(4, 5),
+            })
+        found = player.iter_find('foo', window=2)
+        self.assertEqual(next(found).file, 'foo/00.flac')
+        self.assertEqual(len(player._rfile.commands), 1)  # paged, lazy
+        self.assertEqual([trk.file for trk in found],
+                         [f'foo/{i:02}.flac' for i in range(1, 5)])
+        self.assertEqual(len(player._rfile.commands), 3)
+
+    def test_iter_tracks(self):
+        mpd_filter = all_of(self.artist_filter, self.bl_filter)
+        player = fake_player({('find', mpd_filter, 'window', '0:1000'):
+                              self.tracks(0, 3)},
+                             blocklist=[{'file': 'foo/bl.flac'}])
+        self.assertEqual(len(list(player.iter_tracks(Artist(name='Foo')))), 3)
+        self.assertEqual(player._rfile.commands,
+                         [('find', mpd_filter, 'window', '0:1000')])
+
+    @patch('sima.mpdclient.randrange', return_value=3)
+    def test_sample_find(self, randrange):
+        player = fake_player({
+            ('count', 'foo'): ['songs: 10', 'playtime: 0'],
+            ('find', 'foo', 'window', '3:5'): self.tracks(3, 5),
+            ('count', 'bar'): ['songs: 0', 'playtime: 0'],
+            })
+        self.assertEqual([trk.file for trk in player.sample_find('foo', 2)],
+                         ['foo/03.flac', 'foo/04.flac'])
+        randrange.assert_called_once_with(9)
+        self.assertEqual(player.sample_find('bar', 2), [])
+        self.assertEqual(player._rfile.commands[-1], ('count', 'bar'))
+
+    @patch('sima.mpdclient.randrange', return_value=0)
+    def test_sample_tracks(self, _):
+        mpd_filter = all_of(self.artist_filter, self.bl_filter)
+        player = fake_player({
+            ('count', mpd_filter): ['songs: 3', 'playtime: 0'],
+            ('find', mpd_filter, 'window', '0:2'): self.tracks(0, 2),
+            }, blocklist=[{'file': 'foo/bl.flac'}])
+        self.assertEqual(len(player.sample_tracks(Artist(name='Foo'), 2)), 2)
+        self.assertEqual(len(player._rfile.commands), 2)
+        player.database.get_bl_artist.return_value = True
+        self.assertEqual(player.sample_tracks(Artist(name='Foo'), 2), [])
+        self.assertEqual(len(player._rfile.commands), 2)
+
+
+class TestTrackCounter(unittest.TestCase):
+
+    def test_multi_tags(self):
+        trk = Track(file='foo', artist=['Art', 'Feat'], album='Alb',
+                    musicbrainz_albumid='EA2EF2CF-59E1-443A-817E-9066E3E0BE4B')
+        counter = TrackCounter([trk, trk])
+        self.assertEqual(counter.artists, {('Art', None): 2})
+        self.assertEqual(counter.album_names, {'Alb'})
+        self.assertEqual(counter.album_mbids,
+                         {'ea2ef2cf-59e1-443a-817e-9066e3e0be4b'})
+        counter.remove(trk)
+        counter.remove(trk)
+        self.assertFalse(counter.files)
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
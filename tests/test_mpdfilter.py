@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from sima.lib.mpdfilter import escape, tag_filter, all_of, any_of
+from sima.lib.mpdfilter import blocklist_filter
+
+
+class TestMPDFilter(unittest.TestCase):
+
+    def test_escape(self):
+        self.assertEqual(escape("Heaven's Door"), r"Heaven\'s Door")
+        self.assertEqual(escape('Bonnie "Prince" Billy'),
+                         r'Bonnie \"Prince\" Billy')
+        self.assertEqual(escape('AC\\DC'), r'AC\\DC')
+        self.assertEqual(tag_filter('artist', "Guns N' Roses"),
+                         r"(artist == 'Guns N\' Roses')")
+        self.assertEqual(tag_filter('artist', '', '!='), "(artist != '')")
+
+    def test_combination(self):
+        art_a = tag_filter('artist', 'a')
+        art_b = tag_filter('artist', 'b')
+        self.assertEqual(all_of(art_a), art_a)
+        self.assertEqual(all_of(art_a, '', art_b),
+                         "((artist == 'a') AND (artist == 'b'))")
+        self.assertEqual(any_of('', art_a), art_a)
+        self.assertEqual(any_of(art_a, art_b),
+                         "(!((!(artist == 'a')) AND (!(artist == 'b'))))")
+        self.assertEqual(any_of(), '')
+
+    def test_blocklist(self):
+        mbid = '9c9f1380-2516-4fc9-a3e6-f9f61941d090'
+        blocklist = [{'artist': 'Muse', 'musicbrainz_artist': mbid},
+                     {'artist': 'Foo', 'musicbrainz_artist': None},
+                     {'album': 'Bar', 'musicbrainz_album': None},
+                     {'title': 'Baz', 'file': 'a/b.flac'}]
+        self.assertEqual(blocklist_filter([]), '')
+        self.assertEqual(
+            blocklist_filter(blocklist),
+            f"((MUSICBRAINZ_ARTISTID != '{mbid}') AND "
+            "(!((artist == 'Foo') AND (MUSICBRAINZ_ARTISTID == ''))) AND "
+            "(!((album == 'Bar') AND (MUSICBRAINZ_ALBUMID == ''))) AND "
+            "(file != 'a/b.flac'))")
+        self.assertEqual(
+            blocklist_filter(blocklist[1:3], use_mbid=False),
+            "((artist != 'Foo') AND (album != 'Bar'))")
+        self.assertIsNone(blocklist_filter(blocklist, max_length=64))
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab
@@ -7,6 +7,9 @@ from unittest.mock import Mock
 
 import sima.lib.plugin
 
+from sima.lib.track import Track
+from sima.mpdclient import Snapshot
+
 class SomePlugin(sima.lib.plugin.Plugin):
 
     def __init__(self, daemon):
@@ -45,5 +48,34 @@ class TestFileAccessControl(unittest.TestCase):
         self.assertEqual(plugin.plugin_conf.get('priority'), '80')
 
 
+class SomeAdvancedPlugin(sima.lib.plugin.AdvancedPlugin):
+    pass
+
+
+class TestFilterTrack(unittest.TestCase):
+
+    def test_stream(self):
+        config = configparser.ConfigParser()
+        config.read_dict({'someadvancedplugin': {}})
+        tracks = [Track(file=f'foo/{i}.flac', artist='Foo') for i in range(4)]
+        daemon = Mock(config=config)
+        daemon.player.snapshot = Snapshot({'random': '1'}, Track(), [tracks[1]])
+        daemon.sdb.fetch_history.return_value = [tracks[0]]
+        plugin = SomeAdvancedPlugin(daemon)
+        consumed = []
+
+        def stream():
+            # player state is read before tracks are iterated
+            self.assertEqual(consumed, [])
+            for trk in tracks:
+                consumed.append(trk)
+                yield trk
+        for _ in range(10):
+            consumed.clear()
+            self.assertIn(plugin.filter_track(stream()), tracks[2:])
+            self.assertEqual(consumed, tracks)
+        self.assertIsNone(plugin.filter_track(iter([])))
+
+
 # VIM MODLINE
 # vim: ai ts=4 sw=4 sts=4 expandtab
@@ -37,4 +37,13 @@ class TestSequenceFunctions(unittest.TestCase):
         for sta, stb, assertfunc in tests:
             assertfunc(fuzzystr(sta, stb), '"{0}" == "{1}"'.format(sta, stb))
 
+    def test_matches(self):
+        names = ['Doors', 'The Dolls', 'the doors (live)', 'Dors']
+        query = sima.lib.simastr.SimaStr('The Doors')
+        keys = sima.lib.simastr.SimaStr.keys(names)
+        self.assertEqual(query.matches(names, keys),
+                         [name for name in names if query == name])
+        self.assertEqual(query.matches(names), ['Doors', 'the doors (live)'])
+        self.assertEqual(sima.lib.simastr.normalize('Touché Amoré!'), 'Touche Amore')
+
 # vim: ai ts=4 sw=4 sts=4 expandtab
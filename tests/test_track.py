@@ -62,4 +62,22 @@ class TestTrackObject(unittest.TestCase):
         self.assertEqual(trk.Album.name, DEVOLT['album'])
         self.assertEqual(trk.Album.mbid, DEVOLT['musicbrainz_albumid'])
 
+    def test_extra_tags(self):
+        trk = Track(**DEVOLT)
+        self.assertEqual(trk.disc, '1/1')
+        self.assertEqual(getattr(trk, 'last-modified'), DEVOLT['last-modified'])
+        self.assertEqual(trk.tags['albumartistsort'], 'Devolt')
+        self.assertFalse(hasattr(trk, 'id'))
+        self.assertFalse(hasattr(trk, 'prio'))
+        self.assertEqual(Track(id='42', **DEVOLT).id, '42')
+        with self.assertRaises(AttributeError):
+            trk.foo = 'bar'
+
+    def test_cached_meta(self):
+        trk = Track(**DEVOLT)
+        self.assertIs(trk.Artist, trk.Artist)
+        self.assertIs(trk.Album, trk.Album)
+        self.assertEqual(trk.Album.albumartist, trk.albumartist)
+        self.assertEqual(Track(file='foo').Album.name, '[unknown]')
+
 # vim: ai ts=4 sw=4 sts=4 expandtab
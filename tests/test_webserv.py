@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import configparser
+import time
+import unittest
+
+from collections import Counter
+from threading import Lock
+from unittest.mock import Mock
+
+from sima.lib.meta import Artist
+from sima.lib.webserv import WebService
+from sima.utils.utils import WSError, WSTimeout
+
+
+class FakeWS:
+    """Web service client answering after a delay, slower for first artists"""
+    name = 'fake'
+    calls = Counter()
+    lock = Lock()
+
+    def get_similar(self, artist):
+        with self.lock:
+            self.calls[artist.name] += 1
+        time.sleep(0.05 if artist.name == 'a' else 0.01)
+        if artist.name == 'error':
+            raise WSError('broken answer')
+        if artist.name == 'timeout':
+            raise WSTimeout('too slow')
+        for idx in range(3):
+            yield Artist(name=f'{artist.name}{idx}')
+
+
+class TestWebService(unittest.TestCase):
+
+    def setUp(self):
+        FakeWS.calls.clear()
+        daemon = Mock(config=configparser.ConfigParser())
+        self.plugin = WebService(daemon)
+        self.plugin.ws = FakeWS()
+
+    def tearDown(self):
+        self.plugin.shutdown()
+
+    def test_similar_artists_many(self):
+        artists = [Artist(name=name)
+                   for name in ('a', 'error', 'timeout', 'b', 'timeout')]
+        for _ in range(2):  # deterministic
+            similars = self.plugin.ws_similar_artists_many(artists)
+            self.assertEqual([[art.name for art in similar] for similar in similars],
+                             [['a0', 'a1', 'a2'], [], [], ['b0', 'b1', 'b2'], []])
+        # Retries capped per artist, workers do not share the count
+        self.assertEqual(FakeWS.calls['timeout'], 2*2*4)
+        self.assertEqual(FakeWS.calls['error'], 2)
+
+
+# VIM MODLINE
+# vim: ai ts=4 sw=4 sts=4 expandtab